@@ -6,11 +6,23 @@ HeTangAI JS API 桥接
 
 import json
 import base64
+import binascii
 import webbrowser
 
-import requests
-import webview
-
+try:
+    import webview
+except ImportError:  # 本地服务模式（backend.server）可不安装 pywebview
+    webview = None
+
+from backend import http_client
+from backend.blob_store import get_blob_store, is_blob_hash
+from backend.update_dispatcher import get_dispatcher
+from backend.rate_limiter import get_limiter_stats
+from backend.batch_import import import_file
+from backend.image_prep import get_preprocessor
+from backend.download_queue import get_download_queue
+from backend.result_cache import get_result_cache
+from backend.metrics import get_metrics
 from backend.logger import (
     get_logger,
     get_current_log_file,
@@ -30,15 +42,45 @@ from backend.task_manager import TaskManager
 from backend.video_task_manager import VideoTaskManager
 
 
+IMAGE_SPEC_FIELDS = ("prompt", "model", "mode", "image_base64", "image_ref", "priority", "use_cache")
+VIDEO_SPEC_FIELDS = (
+    "prompt",
+    "model",
+    "mode",
+    "image_base64",
+    "end_image_base64",
+    "image_ref",
+    "end_image_ref",
+    "priority",
+    "use_cache",
+)
+
+
+def _clean_specs(specs: list, fields: tuple[str, ...]) -> list[dict]:
+    """只保留允许的字段，丢弃缺少 prompt / model / mode 的项"""
+    cleaned = []
+    for spec in specs or []:
+        if not isinstance(spec, dict) or not all(spec.get(k) for k in ("prompt", "model", "mode")):
+            continue
+        item = {k: spec[k] for k in fields if k in spec}
+        try:
+            item["priority"] = int(item.get("priority") or 0)
+        except (TypeError, ValueError):
+            item["priority"] = 0
+        item["use_cache"] = item.get("use_cache", True) is not False
+        cleaned.append(item)
+    return cleaned
+
+
 class Api:
     """pywebview JS API 类，所有 public 方法都会暴露给前端"""
 
     def __init__(self, task_manager: TaskManager, video_task_manager: VideoTaskManager):
-        self._window: webview.Window | None = None
+        self._window: "webview.Window | None" = None
         self._task_manager = task_manager
         self._video_task_manager = video_task_manager
 
-    def set_window(self, window: webview.Window):
+    def set_window(self, window: "webview.Window"):
         """由 main.py 在窗口创建后调用"""
         self._window = window
         self._task_manager.set_window(window)
@@ -63,11 +105,9 @@ class Api:
         return get_setting(key)
 
     def set_setting(self, key: str, value: str):
+        # 并发数、缓存上限等由各模块订阅配置变更后立即生效
         set_setting(key, value)
         get_logger().info("配置已更新: %s", key)
-        # 线程池大小变更时动态调整
-        if key == "thread_pool_size":
-            self._task_manager.resize_pool()
 
     def get_all_settings(self) -> dict:
         return get_all_settings()
@@ -85,37 +125,163 @@ class Api:
             "log_total_size": get_log_dir_size(),
             "db_path": str(get_db_path()),
             "db_size": get_db_file_size(),
+            "blob_store": get_blob_store().stats(),
+            "result_cache": get_result_cache().stats(),
+            "image_prep": get_preprocessor().stats(),
+            "downloads": get_download_queue().stats(),
+        }
+
+    def clear_result_cache(self) -> int:
+        """清空结果缓存索引，返回清除条数（已生成的结果文件不受影响）"""
+        return get_result_cache().clear()
+
+    def get_connection_stats(self) -> dict:
+        """获取 HTTP 连接池统计（各主机新建连接数、复用次数、请求数）及各 API Key 的上游限流状态"""
+        return {**http_client.get_pool_stats(), "upstream": get_limiter_stats()}
+
+    def get_queue_stats(self) -> dict:
+        """获取图片 / 视频任务调度器状态（运行中、排队中及各分组并发占用）"""
+        return {
+            "image": self._task_manager.get_queue_stats(),
+            "video": self._video_task_manager.get_queue_stats(),
+        }
+
+    def get_metrics(self) -> dict:
+        """运行指标：各模型分阶段耗时直方图与执行结果计数、调度 / 下载队列深度、连接池占用、传输字节数"""
+        metrics = get_metrics().snapshot()
+        pools = http_client.get_pool_stats()["async"]
+        return {
+            "tasks": metrics["tasks"],
+            "queues": {
+                "image": self._task_manager.get_queue_stats(),
+                "video": self._video_task_manager.get_queue_stats(),
+                "download": get_download_queue().stats(),
+            },
+            "pools": pools,
+            "bytes": {
+                **metrics["bytes"],
+                "http_sent": sum(p["bytes_sent"] for p in pools.values()),
+                "http_received": sum(p["bytes_received"] for p in pools.values()),
+            },
         }
 
+    def get_push_stats(self) -> dict:
+        """获取前端推送统计（入队、合并、丢弃的更新数和实际推送批次数）"""
+        return get_dispatcher().stats()
+
     def clear_logs(self) -> dict:
         """清理旧日志文件"""
         count = clear_old_logs()
         get_logger().info("已清理 %d 个旧日志文件", count)
         return {"cleared": count, "log_total_size": get_log_dir_size()}
 
+    # ===================== 参考图上传 =====================
+
+    def upload_reference_image(self, chunk: str, upload_id: str = "", final: bool = True) -> dict:
+        """
+        分块上传参考图（按内容去重存储），任务只携带返回的句柄
+        - chunk: 本块数据的 base64（每块单独编码）
+        - upload_id: 首块留空，后续块传入首块返回的 upload_id
+        - final: 是否为最后一块
+        返回: 未结束时 {"upload_id"}，结束时 {"handle", "size"}；upload_id 无效或数据损坏时返回空 dict
+        """
+        blobs = get_blob_store()
+        try:
+            data = base64.b64decode(chunk or "", validate=True)
+        except (binascii.Error, ValueError):
+            get_logger().warning("参考图上传数据无效")
+            return {}
+        upload_id = upload_id or blobs.begin_upload()
+        if not blobs.append_upload(upload_id, data):
+            return {}
+        if not final:
+            return {"upload_id": upload_id}
+        result = blobs.finish_upload(upload_id)
+        if result is None:
+            return {}
+        handle, size = result
+        get_logger().info("参考图已上传: %s (%d KB)", handle[:12], size // 1024)
+        return {"handle": handle, "size": size}
+
+    def has_reference_image(self, handle: str) -> bool:
+        """参考图是否已存在（前端按内容哈希判断，已存在时跳过上传）"""
+        return is_blob_hash(handle or "") and get_blob_store().touch(handle)
+
     # ===================== 任务制图片生成 =====================
 
-    def add_image_task(self, prompt: str, model: str, mode: str, image_base64: str = "") -> dict:
+    def add_image_task(
+        self,
+        prompt: str,
+        model: str,
+        mode: str,
+        image_base64: str = "",
+        priority: int = 0,
+        use_cache: bool = True,
+        image_ref: str = "",
+    ) -> dict:
         """
         添加图片生成任务到队列
         - prompt: 提示词
         - model: 模型名
         - mode: "text2img" 或 "img2img"
         - image_base64: 图生图时的参考图 base64
-        返回: 任务摘要 dict
+        - priority: 优先级，越大越先执行（默认 0）
+        - use_cache: 结果缓存开启时，传 False 跳过缓存重新生成
+        - image_ref: 已上传参考图的句柄（upload_reference_image 返回），传入时 image_base64 留空
+        返回: 任务摘要 dict（命中缓存时 status 为 done、cached 为 True）
+        """
+        return self._task_manager.add_task(prompt, model, mode, image_base64, priority, use_cache, image_ref)
+
+    def add_image_tasks_batch(self, specs: list) -> list:
+        """
+        批量添加图片生成任务（一次桥接调用、一次加锁）
+        - specs: [{"prompt", "model", "mode", "image_base64" / "image_ref", "priority", "use_cache"}, ...]，
+          缺少必填字段的项被忽略
+        返回: 任务简要信息列表
         """
-        return self._task_manager.add_task(prompt, model, mode, image_base64)
+        return self._task_manager.add_tasks(_clean_specs(specs, IMAGE_SPEC_FIELDS))
+
+    def import_image_tasks(self, model: str = "", mode: str = "", priority: int = 0) -> dict:
+        """
+        弹出文件选择框，从 JSONL / CSV 导入图片任务
+        - model / mode / priority: 行内未指定时的默认值
+        返回: {"added", "failed", "errors"}，取消选择时返回空 dict
+        """
+        path = self._select_import_file()
+        if not path:
+            return {}
+        return import_file(path, self._task_manager, "image", {"model": model, "mode": mode, "priority": priority})
 
     def get_all_tasks(self) -> list:
         """获取所有任务列表"""
         return self._task_manager.get_all_tasks()
 
+    def list_tasks(self, limit: int = 100, after: str = "", status: str = "") -> dict:
+        """分页获取任务列表（after 为上一页返回的 next 游标，status 为逗号分隔的状态过滤）"""
+        return self._task_manager.list_tasks(limit, after, status)
+
+    def get_tasks_changed_since(self, version: int) -> dict:
+        """获取 version 之后有变更的任务（reset 为 true 时需调用 list_tasks 全量刷新）"""
+        return self._task_manager.get_tasks_changed_since(version)
+
     def get_task(self, task_id: str) -> dict:
         """获取单个任务详情"""
         return self._task_manager.get_task(task_id)
 
+    def set_task_priority(self, task_id: str, priority: int) -> bool:
+        """调整排队中任务的优先级"""
+        return self._task_manager.set_task_priority(task_id, priority)
+
+    def move_task_to_front(self, task_id: str) -> bool:
+        """排队中的任务插队到队首"""
+        return self._task_manager.move_task_to_front(task_id)
+
+    def get_queue_positions(self) -> dict:
+        """获取排队中任务的排队位置 {task_id: 位置}"""
+        return self._task_manager.get_queue_positions()
+
     def cancel_task(self, task_id: str) -> bool:
-        """取消排队中的任务"""
+        """取消排队中或运行中的任务（运行中的任务立即断开连接）"""
         return self._task_manager.cancel_task(task_id)
 
     def delete_task(self, task_id: str) -> bool:
@@ -130,6 +296,10 @@ class Api:
         """重试失败的图片任务"""
         return self._task_manager.retry_task(task_id)
 
+    def get_result_image(self, blob_hash: str) -> str:
+        """按哈希读取生成结果图片（data URL），任务列表中只带哈希，缩略图显示时再按需读取"""
+        return self._task_manager.get_result_image(blob_hash)
+
     # ===================== 图片保存 =====================
 
     def save_task_image(self, task_id: str) -> str:
@@ -137,7 +307,7 @@ class Api:
         if not self._window:
             return ""
 
-        image_data, image_type = self._task_manager.get_task_image(task_id)
+        image_data, _ = self._task_manager.get_task_image(task_id)
         if not image_data:
             return ""
 
@@ -149,21 +319,18 @@ class Api:
 
         if result:
             file_path = result if isinstance(result, str) else result[0]
-            try:
-                if image_type == "url":
-                    resp = requests.get(image_data, timeout=60)
-                    resp.raise_for_status()
-                    image_bytes = resp.content
-                else:
-                    image_bytes = base64.b64decode(image_data)
-
-                with open(file_path, "wb") as f:
-                    f.write(image_bytes)
-                get_logger().info("图片已保存: %s", file_path)
-                return file_path
-            except Exception as e:
-                get_logger().error("保存图片失败: %s", e)
-                return ""
+            return self._task_manager.save_task_image(task_id, file_path)
+        return ""
+
+    def _select_import_file(self) -> str:
+        if not self._window:
+            return ""
+        result = self._window.create_file_dialog(
+            webview.OPEN_DIALOG,
+            file_types=("任务文件 (*.jsonl;*.csv)", "所有文件 (*.*)"),
+        )
+        if result:
+            return result if isinstance(result, str) else result[0]
         return ""
 
     def select_download_path(self) -> str:
@@ -187,6 +354,10 @@ class Api:
         mode: str,
         image_base64: str = "",
         end_image_base64: str = "",
+        priority: int = 0,
+        use_cache: bool = True,
+        image_ref: str = "",
+        end_image_ref: str = "",
     ) -> dict:
         """
         添加视频生成任务到队列
@@ -195,22 +366,61 @@ class Api:
         - mode: "text2video" 或 "img2video"
         - image_base64: 图生视频时的首帧 base64
         - end_image_base64: 图生视频时的尾帧 base64（可选）
+        - priority: 优先级，越大越先执行（默认 0）
+        - use_cache: 结果缓存开启时，传 False 跳过缓存重新生成
+        - image_ref / end_image_ref: 已上传首帧 / 尾帧的句柄，传入时对应的 base64 留空
         返回: 任务摘要 dict
         """
         return self._video_task_manager.add_task(
-            prompt, model, mode, image_base64, end_image_base64
+            prompt, model, mode, image_base64, end_image_base64, priority, use_cache, image_ref, end_image_ref
         )
 
+    def add_video_tasks_batch(self, specs: list) -> list:
+        """
+        批量添加视频生成任务
+        - specs: [{"prompt", "model", "mode", "image_base64" / "image_ref",
+          "end_image_base64" / "end_image_ref", "priority"}, ...]
+        返回: 任务简要信息列表
+        """
+        return self._video_task_manager.add_tasks(_clean_specs(specs, VIDEO_SPEC_FIELDS))
+
+    def import_video_tasks(self, model: str = "", mode: str = "", priority: int = 0) -> dict:
+        """弹出文件选择框，从 JSONL / CSV 导入视频任务，返回 {"added", "failed", "errors"}"""
+        path = self._select_import_file()
+        if not path:
+            return {}
+        return import_file(path, self._video_task_manager, "video", {"model": model, "mode": mode, "priority": priority})
+
     def get_all_video_tasks(self) -> list:
         """获取所有视频任务列表"""
         return self._video_task_manager.get_all_tasks()
 
+    def list_video_tasks(self, limit: int = 100, after: str = "", status: str = "") -> dict:
+        """分页获取视频任务列表"""
+        return self._video_task_manager.list_tasks(limit, after, status)
+
+    def get_video_tasks_changed_since(self, version: int) -> dict:
+        """获取 version 之后有变更的视频任务"""
+        return self._video_task_manager.get_tasks_changed_since(version)
+
     def get_video_task(self, task_id: str) -> dict:
         """获取单个视频任务详情"""
         return self._video_task_manager.get_task(task_id)
 
+    def set_video_task_priority(self, task_id: str, priority: int) -> bool:
+        """调整排队中视频任务的优先级"""
+        return self._video_task_manager.set_task_priority(task_id, priority)
+
+    def move_video_task_to_front(self, task_id: str) -> bool:
+        """排队中的视频任务插队到队首"""
+        return self._video_task_manager.move_task_to_front(task_id)
+
+    def get_video_queue_positions(self) -> dict:
+        """获取排队中视频任务的排队位置 {task_id: 位置}"""
+        return self._video_task_manager.get_queue_positions()
+
     def cancel_video_task(self, task_id: str) -> bool:
-        """取消排队中的视频任务"""
+        """取消排队中或运行中的视频任务（运行中的任务立即断开连接）"""
         return self._video_task_manager.cancel_task(task_id)
 
     def delete_video_task(self, task_id: str) -> bool:
@@ -244,15 +454,5 @@ class Api:
 
         if result:
             file_path = result if isinstance(result, str) else result[0]
-            try:
-                resp = requests.get(video_url, timeout=120)
-                resp.raise_for_status()
-
-                with open(file_path, "wb") as f:
-                    f.write(resp.content)
-                get_logger().info("视频已保存: %s", file_path)
-                return file_path
-            except Exception as e:
-                get_logger().error("保存视频失败: %s", e)
-                return ""
+            return self._video_task_manager.save_task_video(task_id, file_path)
         return ""
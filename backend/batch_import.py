@@ -0,0 +1,154 @@
+"""
+HeTangAI 批量导入
+- 从 JSONL / CSV 文件逐行读取任务（prompt, model, mode, image, end_image, priority），
+  按块批量入队，不把整个文件读入内存
+- 参考图只记录文件路径，任务真正执行时才读取并编码，排队中的任务不占用图片内存
+"""
+
+import os
+import csv
+import json
+import base64
+from pathlib import Path
+from typing import Iterator, TextIO
+
+from backend.logger import get_logger
+
+
+CHUNK_SIZE = 500  # 每批入队的任务数
+MAX_ERRORS = 50  # 返回给前端的错误明细条数上限
+
+# 各任务类型的模式：(文生, 图生)
+MODES = {
+    "image": ("text2img", "img2img"),
+    "video": ("text2video", "img2video"),
+}
+
+# 支持的字段别名（CSV 表头不区分大小写）
+FIELD_ALIASES = {
+    "prompt": ("prompt", "提示词"),
+    "model": ("model", "模型"),
+    "mode": ("mode", "模式"),
+    "image": ("image", "image_path", "参考图", "首帧"),
+    "end_image": ("end_image", "end_image_path", "尾帧"),
+    "priority": ("priority", "优先级"),
+}
+
+
+def iter_rows(path: str | Path) -> Iterator[tuple[int, dict]]:
+    """逐行读取导入文件，返回 (行号, 原始字段)；.csv 按表头解析，其余按 JSONL 解析"""
+    path = Path(path)
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        yield from iter_jsonl(f)
+
+
+def iter_jsonl(f: TextIO) -> Iterator[tuple[int, dict]]:
+    """逐行解析 JSONL 文本流（如标准输入），空行和 # 开头的行被跳过"""
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, {"__error__": f"JSON 解析失败: {e}"}
+            continue
+        if isinstance(row, str):
+            row = {"prompt": row}
+        yield line_no, row if isinstance(row, dict) else {"__error__": "每行应为 JSON 对象"}
+
+
+def _field(row: dict, name: str) -> str:
+    for alias in FIELD_ALIASES[name]:
+        value = row.get(alias)
+        if value not in (None, ""):
+            return str(value).strip()
+    return ""
+
+
+def _resolve_image(value: str, base_dir: Path) -> str:
+    if not value:
+        return ""
+    path = Path(os.path.expanduser(value))
+    if not path.is_absolute():
+        path = base_dir / path
+    if not path.is_file():
+        raise ValueError(f"参考图不存在: {value}")
+    return str(path)
+
+
+def parse_row(row: dict, kind: str, base_dir: Path, defaults: dict) -> dict:
+    """把一行原始字段转为任务参数，缺少必填字段或参考图不存在时抛出 ValueError"""
+    if "__error__" in row:
+        raise ValueError(row["__error__"])
+    row = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+    prompt = _field(row, "prompt")
+    if not prompt:
+        raise ValueError("缺少 prompt")
+    model = _field(row, "model") or defaults.get("model", "")
+    if not model:
+        raise ValueError("缺少 model")
+    image_path = _resolve_image(_field(row, "image"), base_dir)
+    text_mode, image_mode = MODES[kind]
+    mode = _field(row, "mode") or defaults.get("mode") or (image_mode if image_path else text_mode)
+    if mode not in MODES[kind]:
+        raise ValueError(f"不支持的模式: {mode}")
+    if mode == image_mode and not image_path:
+        raise ValueError(f"{mode} 模式缺少参考图")
+    try:
+        priority = int(_field(row, "priority") or defaults.get("priority", 0))
+    except ValueError:
+        raise ValueError("priority 应为整数") from None
+    spec = {
+        "prompt": prompt,
+        "model": model,
+        "mode": mode,
+        "image_path": image_path,
+        "priority": priority,
+    }
+    if kind == "video":
+        spec["end_image_path"] = _resolve_image(_field(row, "end_image"), base_dir)
+    return spec
+
+
+def import_file(path: str | Path, manager, kind: str, defaults: dict | None = None) -> dict:
+    """
+    流式导入任务文件并按块入队
+    - manager: TaskManager / VideoTaskManager（使用其 add_tasks 批量接口）
+    - kind: "image" / "video"
+    - defaults: 行内未指定时使用的 model / mode / priority
+    返回: {"added": 入队数, "failed": 失败行数, "errors": ["第 N 行: 原因", ...]}
+    """
+    path = Path(path)
+    defaults = defaults or {}
+    added = failed = 0
+    errors: list[str] = []
+    chunk: list[dict] = []
+
+    for line_no, row in iter_rows(path):
+        try:
+            chunk.append(parse_row(row, kind, path.parent, defaults))
+        except ValueError as e:
+            failed += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"第 {line_no} 行: {e}")
+            continue
+        if len(chunk) >= CHUNK_SIZE:
+            added += len(manager.add_tasks(chunk))
+            chunk = []
+    if chunk:
+        added += len(manager.add_tasks(chunk))
+
+    get_logger().info("批量导入完成: %s - 入队 %d 个，失败 %d 行", path.name, added, failed)
+    return {"added": added, "failed": failed, "errors": errors}
+
+
+def read_image_base64(path: str) -> str:
+    """读取参考图并编码为 base64（阻塞，在 IO 线程池中调用）"""
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
@@ -0,0 +1,326 @@
+"""
+HeTangAI 结果文件存储（内容寻址）
+- 生成结果解码一次后写入数据目录下的 blobs/，以 sha256 命名，相同内容只存一份
+- 任务记录只保存哈希和大小，图片数据按需读取，不再常驻内存、也不随任务列表反复传给前端
+- 总大小超过上限时按最近访问时间淘汰（读取会刷新文件 mtime，重启后顺序依然有效），
+  被排队中任务引用的参考图、等待自动下载的任务结果固定（pin），不参与淘汰；其余结果淘汰后任务标记为结果已清理
+- 前端上传的参考图分块写入临时文件，完成后按哈希落入同一目录，返回哈希作为句柄
+"""
+
+import os
+import re
+import time
+import base64
+import hashlib
+import threading
+from uuid import uuid4
+from pathlib import Path
+from collections import OrderedDict
+
+from backend.logger import get_logger
+from backend.database import get_data_dir, get_setting, subscribe
+from backend.downloader import write_file_atomic, copy_file_atomic
+
+
+DEFAULT_MAX_MB = 2048
+UPLOAD_TIMEOUT = 600  # 秒，超过该时间未完成的分块上传被丢弃
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# 常见图片格式的文件头 -> MIME
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def guess_mime(data: bytes) -> str:
+    """根据文件头判断图片类型，未知时按 JPEG 处理"""
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def is_blob_hash(value: str) -> bool:
+    """校验哈希格式（前端传入的哈希会拼成路径，必须先校验）"""
+    return bool(value) and bool(_HASH_RE.match(value))
+
+
+class _Upload:
+    __slots__ = ("path", "hasher", "size", "updated")
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.updated = time.monotonic()
+
+
+class BlobStore:
+    """按 sha256 寻址的结果文件目录"""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self._root = root
+        self._max_bytes = max(0, max_bytes)
+        self._lock = threading.Lock()
+        self._index: OrderedDict[str, int] = OrderedDict()  # hash -> size，按访问时间从旧到新
+        self._total = 0
+        self._pins: dict[str, int] = {}  # hash -> 引用计数，固定的文件不淘汰
+        self._uploads: dict[str, _Upload] = {}  # 进行中的分块上传
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """启动时扫描已有文件，按 mtime 重建淘汰顺序，顺带清理残留的临时文件"""
+        entries = []
+        for path in self._root.glob("*/*"):
+            if path.name.startswith("."):
+                path.unlink(missing_ok=True)
+                continue
+            if not is_blob_hash(path.name):
+                continue
+            st = path.stat()
+            entries.append((st.st_mtime, path.name, st.st_size))
+        for _, blob_hash, size in sorted(entries):
+            self._index[blob_hash] = size
+            self._total += size
+        if entries:
+            get_logger().info("结果存储: %d 个文件, 共 %.1f MB", len(entries), self._total / 1024 / 1024)
+
+    def _path(self, blob_hash: str) -> Path:
+        return self._root / blob_hash[:2] / blob_hash
+
+    # ===================== 写入 =====================
+
+    def put(self, data: bytes) -> tuple[str, int]:
+        """写入数据，返回 (哈希, 大小)；内容已存在时只刷新访问时间"""
+        blob_hash = hashlib.sha256(data).hexdigest()
+        size = len(data)
+        with self._lock:
+            exists = blob_hash in self._index
+        if exists:
+            self._touch(blob_hash)
+            return blob_hash, size
+
+        path = self._path(blob_hash)
+        path.parent.mkdir(exist_ok=True)
+        write_file_atomic(path, data)
+
+        with self._lock:
+            if blob_hash not in self._index:
+                self._index[blob_hash] = size
+                self._total += size
+            self._evict_locked(keep=blob_hash)
+        return blob_hash, size
+
+    def put_base64(self, b64_data: str) -> tuple[str, int]:
+        """解码 base64 后写入"""
+        return self.put(base64.b64decode(b64_data))
+
+    # ===================== 分块上传 =====================
+
+    def begin_upload(self) -> str:
+        """开始一次分块上传，返回上传 ID"""
+        self._purge_uploads()
+        upload_id = uuid4().hex
+        path = self._root / "tmp" / f".upload-{upload_id}"
+        path.parent.mkdir(exist_ok=True)
+        path.touch()
+        with self._lock:
+            self._uploads[upload_id] = _Upload(path)
+        return upload_id
+
+    def append_upload(self, upload_id: str, data: bytes) -> bool:
+        """追加一块数据，上传 ID 无效（或已超时）时返回 False"""
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            return False
+        with open(upload.path, "ab") as f:
+            f.write(data)
+        upload.hasher.update(data)
+        upload.size += len(data)
+        upload.updated = time.monotonic()
+        return True
+
+    def finish_upload(self, upload_id: str) -> tuple[str, int] | None:
+        """完成上传，返回 (哈希, 大小)；内容已存在时丢弃临时文件，上传 ID 无效时返回 None"""
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload is None:
+            return None
+        blob_hash, size = upload.hasher.hexdigest(), upload.size
+        with self._lock:
+            exists = blob_hash in self._index
+        if exists:
+            upload.path.unlink(missing_ok=True)
+            self._touch(blob_hash)
+            return blob_hash, size
+
+        path = self._path(blob_hash)
+        path.parent.mkdir(exist_ok=True)
+        os.replace(upload.path, path)
+        with self._lock:
+            if blob_hash not in self._index:
+                self._index[blob_hash] = size
+                self._total += size
+            self._evict_locked(keep=blob_hash)
+        return blob_hash, size
+
+    def _purge_uploads(self):
+        now = time.monotonic()
+        with self._lock:
+            stale = [uid for uid, u in self._uploads.items() if now - u.updated > UPLOAD_TIMEOUT]
+            uploads = [self._uploads.pop(uid) for uid in stale]
+        for upload in uploads:
+            upload.path.unlink(missing_ok=True)
+
+    # ===================== 读取 =====================
+
+    def read(self, blob_hash: str) -> bytes | None:
+        """读取数据，不存在（或已被淘汰）时返回 None"""
+        if not is_blob_hash(blob_hash):
+            return None
+        try:
+            data = self._path(blob_hash).read_bytes()
+        except FileNotFoundError:
+            self._forget(blob_hash)
+            return None
+        self._touch(blob_hash)
+        return data
+
+    def read_base64(self, blob_hash: str) -> str | None:
+        """读取为 base64（在线程池中调用，编码不占用事件循环），不存在时返回 None"""
+        data = self.read(blob_hash)
+        if data is None:
+            return None
+        return base64.b64encode(data).decode("ascii")
+
+    def read_data_url(self, blob_hash: str) -> str:
+        """读取为 data URL（供前端 <img> 直接使用），不存在时返回空串"""
+        data = self.read(blob_hash)
+        if data is None:
+            return ""
+        return f"data:{guess_mime(data)};base64," + base64.b64encode(data).decode("ascii")
+
+    def copy_to(self, blob_hash: str, file_path: str | Path) -> int:
+        """把数据复制到 file_path（原子替换），返回字节数；不存在时抛出 FileNotFoundError"""
+        if not is_blob_hash(blob_hash):
+            raise FileNotFoundError(blob_hash)
+        try:
+            size = copy_file_atomic(self._path(blob_hash), file_path)
+        except FileNotFoundError:
+            self._forget(blob_hash)
+            raise
+        self._touch(blob_hash)
+        return size
+
+    def exists(self, blob_hash: str) -> bool:
+        with self._lock:
+            return blob_hash in self._index
+
+    def touch(self, blob_hash: str) -> bool:
+        """刷新访问时间（被引用的结果不会先被淘汰），不存在时返回 False"""
+        if not self.exists(blob_hash):
+            return False
+        self._touch(blob_hash)
+        return True
+
+    # ===================== 淘汰 =====================
+
+    def set_max_bytes(self, max_bytes: int):
+        """调整总大小上限，调小时立即淘汰"""
+        with self._lock:
+            self._max_bytes = max(0, max_bytes)
+            self._evict_locked()
+
+    def pin(self, blob_hash: str):
+        """固定文件（引用计数），固定期间不会被淘汰"""
+        with self._lock:
+            self._pins[blob_hash] = self._pins.get(blob_hash, 0) + 1
+
+    def unpin(self, blob_hash: str):
+        with self._lock:
+            count = self._pins.get(blob_hash, 0) - 1
+            if count > 0:
+                self._pins[blob_hash] = count
+            else:
+                self._pins.pop(blob_hash, None)
+
+    def _touch(self, blob_hash: str):
+        with self._lock:
+            if blob_hash in self._index:
+                self._index.move_to_end(blob_hash)
+        try:
+            os.utime(self._path(blob_hash))
+        except OSError:
+            pass
+
+    def _forget(self, blob_hash: str):
+        with self._lock:
+            size = self._index.pop(blob_hash, None)
+            if size is not None:
+                self._total -= size
+
+    def _evict_locked(self, keep: str = ""):
+        """淘汰最久未访问的文件直到总大小不超过上限（刚写入的 keep 和固定的文件不淘汰）"""
+        if not self._max_bytes:
+            return
+        excess = self._total - self._max_bytes
+        victims = []
+        for blob_hash, size in self._index.items():
+            if excess <= 0:
+                break
+            if blob_hash == keep or blob_hash in self._pins:
+                continue
+            victims.append(blob_hash)
+            excess -= size
+        for blob_hash in victims:
+            self._total -= self._index.pop(blob_hash)
+            self._path(blob_hash).unlink(missing_ok=True)
+        if victims:
+            get_logger().info("结果存储超出上限, 已淘汰 %d 个文件", len(victims))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "count": len(self._index),
+                "total_bytes": self._total,
+                "max_bytes": self._max_bytes,
+                "pinned": len(self._pins),
+            }
+
+
+_store: BlobStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_max_bytes() -> int:
+    """读取设置中的存储上限（MB），0 表示不限制"""
+    try:
+        return max(0, int(get_setting("blob_cache_max_mb") or DEFAULT_MAX_MB)) * 1024 * 1024
+    except (ValueError, TypeError):
+        return DEFAULT_MAX_MB * 1024 * 1024
+
+
+def get_blob_store() -> BlobStore:
+    """获取全局结果存储（首次调用时扫描目录）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore(get_data_dir() / "blobs", get_max_bytes())
+        return _store
+
+
+def _on_max_changed(key: str, value: str):
+    with _store_lock:
+        store = _store
+    if store is not None:
+        store.set_max_bytes(get_max_bytes())
+
+
+subscribe(_on_max_changed, ("blob_cache_max_mb",))
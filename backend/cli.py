@@ -0,0 +1,255 @@
+"""
+荷塘AI生成器 命令行入口（无界面）
+- 不依赖 pywebview，适合在无桌面环境的服务器上批量生成
+- 从 JSONL / CSV 文件或标准输入（JSONL）读取任务，字段同批量导入（prompt, model, mode, image, end_image, priority）
+- 结果自动下载到输出目录；进度以每行一个 JSON 的形式输出到 stdout，日志输出到 stderr
+- 任务记录保存在数据目录下单独的 cli.db，不会恢复或执行桌面版的任务；配置沿用桌面版（只读）
+- 中断时取消本次未完成的任务，不会留给下次运行或桌面版继续执行
+- 退出码: 0 全部成功（每个任务都写出了各自的结果文件）；1 有任务失败 / 取消 / 无效行 / 下载失败；
+  2 参数错误；130 被中断
+
+运行: python -m backend.cli jobs.jsonl --kind image --model gemini-3.0-pro-image-landscape -o outputs
+      cat jobs.jsonl | python -m backend.cli - --concurrency 4
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+from pathlib import Path
+
+from backend.logger import setup_logger, get_logger
+from backend.database import (
+    init_db,
+    get_setting,
+    get_data_dir,
+    get_db_path,
+    read_settings,
+    override_settings,
+    close_thread_connection,
+)
+from backend.batch_import import CHUNK_SIZE, MODES, iter_rows, iter_jsonl, parse_row
+from backend.engine import shutdown_engine
+from backend.update_dispatcher import get_dispatcher, shutdown_dispatcher
+from backend.download_queue import shutdown_download_queue
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+API_KEY_ENV = "HETANGAI_API_KEY"
+CLI_DB_NAME = "cli.db"
+CANCEL_WAIT = 5  # 中断后等待取消完成的最长时间（秒）
+FINISHED_EVENTS = ("done", "error", "cancelled")
+DOWNLOAD_EVENTS = ("downloaded", "download_failed")
+
+
+class BatchRun:
+    """跟踪本次提交的任务，把任务更新转为 JSON 行输出，全部结束（含下载）时唤醒主线程"""
+
+    def __init__(self, out=sys.stdout):
+        self._out = out
+        self._cond = threading.Condition()
+        self._task_ids: set[str] = set()
+        self._finished: dict[str, str] = {}  # task_id -> done / error / cancelled
+        self._downloads: dict[str, str] = {}  # task_id -> downloaded / download_failed
+        self._files: dict[str, str] = {}  # task_id -> 下载的文件路径
+        self.invalid = 0
+        self._started = time.monotonic()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({"event": event, **fields}, ensure_ascii=False)
+        with self._cond:
+            self._out.write(line + "\n")
+            self._out.flush()
+
+    def track(self, task_ids: list[str]):
+        with self._cond:
+            self._task_ids.update(task_ids)
+            self._cond.notify_all()
+
+    def on_update(self, callback: str, data: dict):
+        """推送调度器监听器（在推送线程中调用）"""
+        data = dict(data)
+        kind = data.pop("type", "")
+        event = data.pop("status", kind) if kind == "status" else kind
+        self.emit(event, **data)
+        task_id = data.get("task_id", "")
+        with self._cond:
+            if event in FINISHED_EVENTS:
+                self._finished[task_id] = event
+            elif event in DOWNLOAD_EVENTS:
+                self._downloads[task_id] = event
+                if event == "downloaded":
+                    self._files[task_id] = data.get("file_path", "")
+            self._cond.notify_all()
+
+    def _complete_locked(self) -> bool:
+        for task_id in self._task_ids:
+            status = self._finished.get(task_id)
+            if status is None or (status == "done" and task_id not in self._downloads):
+                return False
+        return True
+
+    def unfinished(self) -> list[str]:
+        with self._cond:
+            return [task_id for task_id in self._task_ids if task_id not in self._finished]
+
+    def wait(self, timeout: float = 0.5) -> bool:
+        """等待全部任务结束且已完成的任务下载完毕，超时返回 False（便于主线程响应 Ctrl+C）"""
+        with self._cond:
+            return self._cond.wait_for(self._complete_locked, timeout)
+
+    def summary(self) -> dict:
+        with self._cond:
+            statuses = [self._finished.get(task_id, "") for task_id in self._task_ids]
+            downloads = [self._downloads.get(task_id, "") for task_id in self._task_ids]
+            paths = [self._files.get(task_id, "") for task_id in self._task_ids]
+        # 按实际存在的不同文件计数，文件被覆盖或丢失时不会算作成功
+        files = {os.path.realpath(p) for p in paths if p and os.path.isfile(p)}
+        return {
+            "total": len(statuses),
+            "done": statuses.count("done"),
+            "error": statuses.count("error"),
+            "cancelled": statuses.count("cancelled"),
+            "invalid": self.invalid,
+            "downloaded": downloads.count("downloaded"),
+            "files": len(files),
+            "download_failed": downloads.count("download_failed"),
+            "seconds": round(time.monotonic() - self._started, 2),
+        }
+
+
+def _iter_jobs(source: str):
+    """返回 (行号, 原始字段) 迭代器和参考图相对路径的基准目录"""
+    if source == "-":
+        return iter_jsonl(sys.stdin), Path.cwd()
+    path = Path(source)
+    return iter_rows(path), path.resolve().parent
+
+
+def submit_jobs(run: BatchRun, manager, kind: str, source: str, defaults: dict, use_cache: bool):
+    """逐行解析任务并按块提交，每个任务输出一条 queued（无效行输出 invalid）"""
+    rows, base_dir = _iter_jobs(source)
+    chunk: list[tuple[int, dict]] = []
+
+    def flush():
+        specs = [spec for _, spec in chunk]
+        briefs = manager.add_tasks(specs)
+        run.track([brief["id"] for brief in briefs])
+        for (line_no, spec), brief in zip(chunk, briefs):
+            run.emit("queued", task_id=brief["id"], line=line_no, prompt=spec["prompt"], model=spec["model"])
+        chunk.clear()
+
+    for line_no, row in rows:
+        try:
+            spec = parse_row(row, kind, base_dir, defaults)
+        except ValueError as e:
+            run.invalid += 1
+            run.emit("invalid", line=line_no, error=str(e))
+            continue
+        spec["use_cache"] = use_cache
+        chunk.append((line_no, spec))
+        if len(chunk) >= CHUNK_SIZE:
+            flush()
+    if chunk:
+        flush()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m backend.cli", description="荷塘AI生成器 无界面批量生成")
+    parser.add_argument("jobs", help="任务文件（.jsonl / .csv），- 表示从标准输入读取 JSONL")
+    parser.add_argument("--kind", choices=sorted(MODES), default="image", help="任务类型（默认 image）")
+    parser.add_argument("--model", default="", help="行内未指定时使用的模型（默认取设置中的模型）")
+    parser.add_argument("--mode", default="", help="行内未指定时使用的模式（默认按是否有参考图判断）")
+    parser.add_argument("--priority", type=int, default=0, help="行内未指定时的优先级")
+    parser.add_argument("-c", "--concurrency", type=int, default=0, help="并发数（默认取设置）")
+    parser.add_argument("-o", "--output", default="outputs", help="结果保存目录（默认 ./outputs）")
+    parser.add_argument("--api-key", default="", help=f"API Key（默认取环境变量 {API_KEY_ENV} 或设置）")
+    parser.add_argument("--db", default="", help=f"任务数据库文件路径（默认为数据目录下的 {CLI_DB_NAME}，不与桌面版共用）")
+    parser.add_argument("--no-cache", action="store_true", help="跳过结果缓存，总是重新生成")
+    parser.add_argument("-q", "--quiet", action="store_true", help="stderr 只输出警告和错误日志")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.jobs != "-" and not Path(args.jobs).is_file():
+        print(f"任务文件不存在: {args.jobs}", file=sys.stderr)
+        return EXIT_USAGE
+
+    setup_logger(logging.WARNING if args.quiet else logging.INFO)
+    # 先读取桌面版的配置，再打开命令行自己的数据库
+    desktop_settings = read_settings(get_db_path())
+    init_db(args.db or get_data_dir() / CLI_DB_NAME)
+
+    # 本次运行的配置只在进程内生效，不改动已保存的设置
+    output = Path(args.output).expanduser().resolve()
+    output.mkdir(parents=True, exist_ok=True)
+    overrides = {**desktop_settings, "auto_download": "true", "download_path": str(output)}
+    api_key = args.api_key or os.environ.get(API_KEY_ENV, "")
+    if api_key:
+        overrides["api_key"] = api_key
+    if args.concurrency > 0:
+        overrides["video_thread_pool_size" if args.kind == "video" else "thread_pool_size"] = str(args.concurrency)
+    override_settings(overrides)
+    if not get_setting("api_key"):
+        print(f"未配置 API Key：使用 --api-key 或环境变量 {API_KEY_ENV}", file=sys.stderr)
+        return EXIT_USAGE
+
+    defaults = {
+        "model": args.model or get_setting("video_model" if args.kind == "video" else "image_model"),
+        "mode": args.mode,
+        "priority": args.priority,
+    }
+
+    run = BatchRun()
+    get_dispatcher().add_listener(run.on_update)
+    if args.kind == "video":
+        from backend.video_task_manager import VideoTaskManager
+
+        manager = VideoTaskManager(restore=False)
+    else:
+        from backend.task_manager import TaskManager
+
+        manager = TaskManager(restore=False)
+
+    exit_code = EXIT_OK
+    try:
+        submit_jobs(run, manager, args.kind, args.jobs, defaults, not args.no_cache)
+        while not run.wait():
+            pass
+    except KeyboardInterrupt:
+        get_logger().warning("已中断，取消未完成的任务")
+        for task_id in run.unfinished():
+            manager.cancel_task(task_id)
+        run.wait(CANCEL_WAIT)  # 等取消推送到达，汇总中计入 cancelled
+        exit_code = EXIT_INTERRUPTED
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"读取任务失败: {e}", file=sys.stderr)
+        exit_code = EXIT_USAGE
+    finally:
+        manager.shutdown()
+        shutdown_download_queue()
+        shutdown_dispatcher()
+        shutdown_engine()
+        close_thread_connection()
+
+    summary = run.summary()
+    run.emit("summary", **summary)
+    if exit_code == EXIT_OK and (
+        summary["done"] != summary["total"] or summary["invalid"] or summary["files"] != summary["done"]
+    ):
+        exit_code = EXIT_FAILED
+    return exit_code
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -1,29 +1,56 @@
 """
 HeTangAI 数据库模块
-- 使用 peewee + SQLite
+- 使用 peewee + SQLite，WAL 模式（读写互不阻塞），每个线程一个连接（peewee 线程本地连接），
+  新连接自动应用 SQLITE_PRAGMAS
 - Mac: ~/Library/Application Support/HeTangAIScript/hetangai.db
 - Windows: %APPDATA%/HeTangAIScript/hetangai.db
-- Setting 表: key-value 形式存储配置
+- Setting 表: key-value 形式存储配置（启动时整体载入内存，读取不访问数据库，写入同时更新内存并通知订阅者）
+- TaskRecord 表: 图片/视频任务记录（完整任务 JSON + 状态、创建时间、变更版本索引）
+- ResultCacheRecord 表: 结果缓存索引（请求哈希 -> 生成结果）
 """
 
 import os
 import platform
+import threading
 from pathlib import Path
+from typing import Callable
 
-from peewee import SqliteDatabase, Model, CharField, TextField
+from peewee import SqliteDatabase, DatabaseError, Model, CharField, TextField, FloatField, IntegerField, CompositeKey
+from playhouse.migrate import SqliteMigrator, migrate
+
+from backend.logger import get_logger
 
 
 APP_NAME = "HeTangAIScript"
+DATA_DIR_ENV = "HETANGAI_DATA_DIR"
 
 db = SqliteDatabase(None)  # 延迟初始化
 
 _db_path: Path | None = None
 
+# 每个新连接执行的 PRAGMA
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",  # 读不阻塞写，写不阻塞读
+    "synchronous": "normal",  # WAL 下只在检查点 fsync，断电最多丢失最后几个事务，不会损坏
+    "cache_size": -16 * 1024,  # 页缓存 16 MB（负数单位为 KB）
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "memory",
+}
+BUSY_TIMEOUT = 10  # 秒，写锁被其他线程占用时的等待时间
+
+# 配置缓存：init_db 时载入，set_setting 时同步更新
+_settings: dict[str, str] = {}
+_settings_lock = threading.Lock()
+SettingCallback = Callable[[str, str], None]  # (key, 新值)
+_subscribers: list[tuple[frozenset[str] | None, SettingCallback]] = []
+
 
 def get_data_dir() -> Path:
-    """获取应用数据目录（跨平台）"""
+    """获取应用数据目录（跨平台），可用环境变量 HETANGAI_DATA_DIR 指定（基准测试等隔离运行）"""
     system = platform.system()
-    if system == "Darwin":
+    if os.environ.get(DATA_DIR_ENV):
+        data_dir = Path(os.environ[DATA_DIR_ENV])
+    elif system == "Darwin":
         data_dir = Path.home() / "Library" / "Application Support" / APP_NAME
     elif system == "Windows":
         appdata = os.environ.get("APPDATA", Path.home() / "AppData" / "Roaming")
@@ -55,6 +82,37 @@ class Setting(BaseModel):
         table_name = "settings"
 
 
+class TaskRecord(BaseModel):
+    kind = CharField()  # "image" / "video"
+    task_id = CharField()
+    status = CharField(index=True)
+    created_at = FloatField(index=True)
+    updated_at = FloatField()
+    version = IntegerField(default=0)  # 变更版本号（单调递增），用于增量同步
+    data = TextField()  # 完整任务 dict 的 JSON
+
+    class Meta:
+        table_name = "tasks"
+        primary_key = CompositeKey("kind", "task_id")
+        indexes = (
+            (("kind", "status"), False),
+            (("kind", "created_at"), False),
+            (("kind", "version"), False),
+        )
+
+
+class ResultCacheRecord(BaseModel):
+    key = CharField(primary_key=True)  # 规范化请求的 sha256
+    kind = CharField()  # "image" / "video"
+    data = TextField()  # 结果字段的 JSON
+    size = IntegerField(default=0)  # 计入缓存上限的字节数
+    created_at = FloatField()
+    used_at = FloatField(index=True)  # 最近命中时间，用于 LRU 淘汰
+
+    class Meta:
+        table_name = "result_cache"
+
+
 # ---------- 便捷操作函数 ----------
 
 DEFAULT_SETTINGS = {
@@ -62,40 +120,145 @@ DEFAULT_SETTINGS = {
     "image_model": "gemini-3.0-pro-image-landscape",
     "video_model": "",
     "thread_pool_size": "2",
+    "video_thread_pool_size": "",  # 视频任务并发数，留空时与 thread_pool_size 相同
+    "rate_limit_rps": "5",  # 每个 API Key 每秒最多发起的请求数，0 为不限制
+    "adaptive_concurrency": "true",  # 按上游响应（429/503/延迟）自动调整并发
+    "concurrency_caps": "{}",  # 按模型 / 模式的并发上限 JSON，如 {"veo_3_1_*": 2, "*-4k": 2, "mode:img2img": 4}
     "auto_download": "false",
     "download_path": "",
+    "download_concurrency": "3",  # 自动下载的并发数（与生成并发分开，1-16）
+    "blob_cache_max_mb": "2048",  # 生成结果存储上限（MB），0 为不限制
+    "ui_push_interval_ms": "50",  # 前端推送合并窗口（毫秒）
+    "retry_policy": "",  # 自动重试策略（JSON，按 image / video 覆盖默认值）
+    "result_cache_enabled": "false",  # 相同请求（提示词、模型、模式、参考图）直接返回缓存结果
+    "result_cache_max_mb": "512",  # 结果缓存上限（MB），0 为不限制
+    "image_prep_enabled": "true",  # 上传前缩放、重新压缩参考图（需要 Pillow）
+    "image_prep_quality": "90",  # 参考图重新压缩的 JPEG 质量（30-95）
+    "api_server_enabled": "false",  # 启动本地 HTTP 服务（REST + SSE），供脚本或局域网内其他客户端调用
+    "api_server_host": "127.0.0.1",  # 本地服务监听地址，0.0.0.0 为允许局域网访问（应同时设置令牌）
+    "api_server_port": "8765",
+    "api_server_token": "",  # 本地服务访问令牌，开启服务时为空则自动生成
+    "api_base": "",  # 上游地址，留空为 https://hetang.lyvideo.top（接本地模拟服务做基准测试时修改）
 }
 
 
-def init_db():
-    """初始化数据库连接并创建表"""
+def init_db(path: str | Path | None = None, pragmas: dict | None = None):
+    """
+    初始化数据库连接并创建表
+    - path: 数据库文件路径，默认为应用数据目录下的 hetangai.db
+    - pragmas: 覆盖默认的 SQLITE_PRAGMAS（基准测试用）
+    """
     global _db_path
-    _db_path = get_db_path()
-    db.init(str(_db_path))
+    _db_path = Path(path) if path else get_db_path()
+    db.init(str(_db_path), pragmas=SQLITE_PRAGMAS if pragmas is None else pragmas, timeout=BUSY_TIMEOUT)
     db.connect(reuse_if_open=True)
-    db.create_tables([Setting])
+    _migrate()
+    db.create_tables([Setting, TaskRecord, ResultCacheRecord])
+
+    # 写入默认值（仅当 key 不存在时，一条 INSERT OR IGNORE）
+    Setting.insert_many(
+        [{"key": key, "value": value} for key, value in DEFAULT_SETTINGS.items()]
+    ).on_conflict_ignore().execute()
+    _load_settings()
+
+
+def close_thread_connection():
+    """关闭当前线程的数据库连接（工作线程退出前调用，主线程退出时关闭自身连接）"""
+    if not db.is_closed():
+        db.close()
 
-    # 写入默认值（仅当 key 不存在时）
-    for key, value in DEFAULT_SETTINGS.items():
-        Setting.get_or_create(key=key, defaults={"value": value})
+
+def _migrate():
+    """为旧版本创建的表补充新增列（需在 create_tables 建索引之前执行）"""
+    if not db.table_exists(TaskRecord._meta.table_name):
+        return
+    columns = {c.name for c in db.get_columns(TaskRecord._meta.table_name)}
+    if "version" not in columns:
+        migrate(SqliteMigrator(db).add_column(TaskRecord._meta.table_name, "version", TaskRecord.version))
+
+
+def _load_settings():
+    settings = {s.key: s.value for s in Setting.select()}
+    with _settings_lock:
+        _settings.clear()
+        _settings.update(settings)
 
 
 def get_setting(key: str) -> str:
-    """获取配置值"""
-    try:
-        return Setting.get_by_id(key).value
-    except Setting.DoesNotExist:
-        return ""
+    """获取配置值（读内存缓存，任意线程调用都不访问数据库）"""
+    return _settings.get(key, "")
 
 
 def set_setting(key: str, value: str):
-    """设置配置值"""
+    """设置配置值：写入数据库并更新缓存，值有变化时同步调用订阅者"""
+    value = "" if value is None else str(value)
     Setting.replace(key=key, value=value).execute()
+    with _settings_lock:
+        changed = _settings.get(key) != value
+        _settings[key] = value
+        callbacks = [cb for keys, cb in _subscribers if keys is None or key in keys]
+    if changed:
+        _notify(callbacks, key, value)
+
+
+def _notify(callbacks: list[SettingCallback], key: str, value: str):
+    for callback in callbacks:
+        try:
+            callback(key, value)
+        except Exception:
+            get_logger().exception("配置变更回调失败: %s", key)
+
+
+def override_settings(values: dict[str, str]):
+    """只在本进程内覆盖配置（不写入数据库，命令行运行时使用），同样通知订阅者"""
+    for key, value in values.items():
+        value = "" if value is None else str(value)
+        with _settings_lock:
+            changed = _settings.get(key) != value
+            _settings[key] = value
+            callbacks = [cb for keys, cb in _subscribers if keys is None or key in keys]
+        if changed:
+            _notify(callbacks, key, value)
+
+
+def subscribe(callback: SettingCallback, keys: tuple[str, ...] | None = None) -> Callable[[], None]:
+    """
+    订阅配置变更，keys 为 None 时订阅全部
+    - callback(key, value) 在调用 set_setting 的线程中执行，耗时操作应自行转交
+    返回取消订阅的函数
+    """
+    entry = (frozenset(keys) if keys is not None else None, callback)
+    with _settings_lock:
+        _subscribers.append(entry)
+
+    def unsubscribe():
+        with _settings_lock:
+            if entry in _subscribers:
+                _subscribers.remove(entry)
+
+    return unsubscribe
+
+
+def read_settings(path: str | Path) -> dict[str, str]:
+    """只读读取另一个数据库文件中的配置（不影响当前连接），文件不存在或无法读取时返回空字典"""
+    path = Path(path)
+    if not path.is_file():
+        return {}
+    other = SqliteDatabase(f"{path.resolve().as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT)
+    try:
+        with other.bind_ctx([Setting]):
+            return {s.key: s.value for s in Setting.select()}
+    except DatabaseError as e:
+        get_logger().warning("读取配置失败 (%s): %s", path, e)
+        return {}
+    finally:
+        other.close()
 
 
 def get_all_settings() -> dict[str, str]:
     """获取所有配置"""
-    return {s.key: s.value for s in Setting.select()}
+    with _settings_lock:
+        return dict(_settings)
 
 
 def get_db_file_size() -> int:
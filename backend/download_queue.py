@@ -0,0 +1,112 @@
+"""
+HeTangAI 自动下载队列
+- 生成完成后自动下载放入独立队列执行，生成并发名额在结果返回后立即释放
+- 下载在专用线程池中运行（不占用引擎的通用 IO 线程），并发数由 download_concurrency 设置控制，
+  超出并发的下载按提交顺序排队
+- 图片、视频任务共用同一个队列
+"""
+
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from backend.logger import get_logger
+from backend.database import get_setting, subscribe
+from backend.engine import get_engine, ConcurrencyLimiter
+
+
+DEFAULT_CONCURRENCY = 3
+MAX_CONCURRENCY = 16  # 线程池大小，设置的并发数不超过该值
+
+
+def get_concurrency() -> int:
+    try:
+        size = int(get_setting("download_concurrency") or DEFAULT_CONCURRENCY)
+        return max(1, min(size, MAX_CONCURRENCY))
+    except (ValueError, TypeError):
+        return DEFAULT_CONCURRENCY
+
+
+def is_auto_download_enabled() -> bool:
+    return get_setting("auto_download") == "true" and bool(get_setting("download_path"))
+
+
+class DownloadQueue:
+    """有界的下载队列：ConcurrencyLimiter 控制并发，专用线程池执行阻塞下载"""
+
+    def __init__(self, concurrency: int):
+        self._engine = get_engine()
+        self._limiter = ConcurrencyLimiter(concurrency)  # 只在事件循环线程中使用
+        self._pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="hetangai-download")
+        self._lock = threading.Lock()
+        self._completed = 0
+        self._failed = 0
+
+    def submit(self, fn, *args) -> Future:
+        """把阻塞的下载函数放入队列（任意线程调用），返回 concurrent Future"""
+        return self._engine.submit(self._run(functools.partial(fn, *args)))
+
+    async def _run(self, call):
+        async with self._limiter:
+            try:
+                result = await self._engine.loop.run_in_executor(self._pool, call)
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                get_logger().error("下载队列任务失败: %s", e)
+                return None
+        with self._lock:
+            self._completed += 1
+        return result
+
+    def resize(self, concurrency: int | None = None):
+        """调整并发数（设置页修改后调用），排队中的下载立即按新上限执行"""
+        concurrency = concurrency or get_concurrency()
+        self._engine.call_soon(self._limiter.set_limit, concurrency)
+        get_logger().info("下载并发已调整: %d", concurrency)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self._limiter.limit,
+                "active": self._limiter.active,
+                "waiting": self._limiter.waiting,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+
+    def shutdown(self):
+        """丢弃排队中的下载，不等待进行中的下载（临时文件由下载工具清理）"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_queue: DownloadQueue | None = None
+_queue_lock = threading.Lock()
+
+
+def get_download_queue() -> DownloadQueue:
+    """获取全局下载队列"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = DownloadQueue(get_concurrency())
+        return _queue
+
+
+def shutdown_download_queue():
+    """停止全局下载队列"""
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.shutdown()
+            _queue = None
+
+
+def _on_concurrency_changed(key: str, value: str):
+    with _queue_lock:
+        queue = _queue
+    if queue is not None:
+        queue.resize()
+
+
+subscribe(_on_concurrency_changed, ("download_concurrency",))
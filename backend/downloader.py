@@ -0,0 +1,338 @@
+"""
+HeTangAI 下载工具
+- 流式分块下载到目标目录下的临时文件，完成后原子重命名，内存占用恒定
+- 下载中断/失败时删除临时文件，不会留下写了一半的结果文件
+- 支持进度回调（按时间节流）
+- 大文件（服务器支持 Range 时）分段并行下载；失败时在应用数据目录保留已下载部分，
+  再次下载同一 URL 时从断点继续，合并前校验文件大小；超过 PART_MAX_AGE 未续传的部分文件自动清理
+"""
+
+import os
+import json
+import shutil
+import time
+import hashlib
+import threading
+from uuid import uuid4
+from pathlib import Path
+from typing import Callable, Iterator
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from backend import http_client
+from backend.database import get_data_dir
+from backend.logger import get_logger
+from backend.metrics import get_metrics
+
+
+CHUNK_SIZE = 256 * 1024
+# 进度回调的最小间隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+RANGE_MIN_SIZE = 8 * 1024 * 1024  # 小于该大小的文件单连接下载
+RANGE_PARTS = 4  # 分段数（并行连接数）
+PART_RETRIES = 3  # 每段失败后从断点重试的次数
+STATE_INTERVAL = 1.0  # 断点状态写盘的最小间隔（秒）
+PART_DIR_NAME = "partial"  # 应用数据目录下保存断点文件的子目录
+PART_MAX_AGE = 24 * 3600  # 断点文件保留时间（秒），上游结果地址约一天后失效，之后无法续传
+
+ProgressCallback = Callable[[int, int], None]  # (已下载字节, 总字节；未知为 0)
+
+
+def _temp_path(file_path: Path) -> Path:
+    """同目录下的隐藏临时文件，保证 os.replace 为同一文件系统内的原子操作"""
+    return file_path.with_name(f".{file_path.name}.{uuid4().hex[:8]}.part")
+
+
+def download_to_file(
+    url: str,
+    file_path: str | Path,
+    timeout: float = 120,
+    on_progress: ProgressCallback | None = None,
+) -> int:
+    """
+    流式下载 url 到 file_path，返回写入的字节数
+    失败时抛出异常，且目标路径保持不变
+    """
+    file_path = Path(file_path)
+    tmp_path = _temp_path(file_path)
+    written = 0
+    try:
+        with http_client.get_session().get(url, stream=True, timeout=timeout) as resp:
+            resp.raise_for_status()
+            total = int(resp.headers.get("Content-Length") or 0)
+            last_report = 0.0
+            with open(tmp_path, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    written += len(chunk)
+                    get_metrics().add_bytes("download", len(chunk))
+                    now = time.monotonic()
+                    if on_progress and now - last_report >= PROGRESS_INTERVAL:
+                        last_report = now
+                        on_progress(written, total)
+            if total and written != total:
+                raise IOError(f"下载不完整: {written}/{total} 字节")
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    if on_progress:
+        on_progress(written, written)
+    return written
+
+
+class _RangeState:
+    """
+    分段下载的断点状态，与 .part 文件一起保存在应用数据目录
+    - 各段已完成字节数只在数据写入文件之后增加，状态落后于文件时只会重复下载少量数据
+    """
+
+    def __init__(self, path: Path, total: int, validator: str, ranges: list[list[int]], done: list[int]):
+        self.path = path
+        self.total = total
+        self.validator = validator  # ETag / Last-Modified，用于判断服务器上的文件是否变化
+        self.ranges = ranges  # [[start, end], ...]（end 含）
+        self.done = done
+        self._lock = threading.Lock()
+        self._saved = 0.0
+        self._reported = 0.0
+
+    @classmethod
+    def load(cls, path: Path, total: int, validator: str) -> "_RangeState | None":
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if data.get("total") != total or data.get("validator") != validator:
+            return None
+        return cls(path, total, validator, data["ranges"], data["done"])
+
+    @classmethod
+    def create(cls, path: Path, total: int, validator: str, parts: int) -> "_RangeState":
+        size = -(-total // parts)
+        ranges = [[start, min(start + size, total) - 1] for start in range(0, total, size)]
+        return cls(path, total, validator, ranges, [0] * len(ranges))
+
+    @property
+    def downloaded(self) -> int:
+        return sum(self.done)
+
+    def advance(self, index: int, n: int, on_progress: ProgressCallback | None):
+        with self._lock:
+            self.done[index] += n
+            now = time.monotonic()
+            if now - self._saved >= STATE_INTERVAL:
+                self._saved = now
+                self._save_locked()
+            report = on_progress and now - self._reported >= PROGRESS_INTERVAL
+            if report:
+                self._reported = now
+                downloaded = sum(self.done)
+        if report:
+            on_progress(downloaded, self.total)
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        data = {"total": self.total, "validator": self.validator, "ranges": self.ranges, "done": self.done}
+        self.path.write_text(json.dumps(data), encoding="utf-8")
+
+
+# 同一 .part 文件同时只允许一个下载使用：part_path -> [锁, 使用者数]，无人使用时移除
+_part_locks: dict[Path, list] = {}
+_part_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _part_lock(part_path: Path) -> Iterator[None]:
+    with _part_locks_guard:
+        entry = _part_locks.setdefault(part_path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _part_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _part_locks[part_path]
+
+
+def _part_dir() -> Path:
+    part_dir = get_data_dir() / PART_DIR_NAME
+    part_dir.mkdir(exist_ok=True)
+    return part_dir
+
+
+def cleanup_partial(max_age: float = PART_MAX_AGE) -> int:
+    """删除超过 max_age 秒未更新且未在使用的断点文件，返回删除的下载数"""
+    removed = 0
+    cutoff = time.time() - max_age
+    for part_path in _part_dir().glob("*.part"):
+        state_path = part_path.with_name(part_path.name + ".json")
+        with _part_locks_guard:
+            if part_path in _part_locks:
+                continue
+        try:
+            mtime = max(p.stat().st_mtime for p in (part_path, state_path) if p.exists())
+        except (OSError, ValueError):
+            continue
+        if mtime < cutoff:
+            part_path.unlink(missing_ok=True)
+            state_path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def _probe(url: str, timeout: float) -> tuple[int, str] | None:
+    """请求首字节探测是否支持 Range，支持时返回 (文件大小, 校验标识)，否则返回 None"""
+    with http_client.get_session().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        content_range = resp.headers.get("Content-Range", "")
+        if resp.status_code != 206 or "/" not in content_range:
+            return None
+        try:
+            total = int(content_range.rsplit("/", 1)[1])
+        except ValueError:
+            return None
+        return total, resp.headers.get("ETag") or resp.headers.get("Last-Modified") or ""
+
+
+def _fetch_range(
+    url: str,
+    part_path: Path,
+    state: _RangeState,
+    index: int,
+    timeout: float,
+    on_progress: ProgressCallback | None,
+):
+    """下载第 index 段的剩余部分，连接中断时从断点重试"""
+    start, end = state.ranges[index]
+    for attempt in range(PART_RETRIES + 1):
+        pos = start + state.done[index]
+        if pos > end:
+            return
+        headers = {"Range": f"bytes={pos}-{end}"}
+        if state.validator:
+            headers["If-Range"] = state.validator
+        try:
+            with http_client.get_session().get(url, headers=headers, stream=True, timeout=timeout) as resp:
+                resp.raise_for_status()
+                if resp.status_code != 206:
+                    raise IOError("服务器文件已变化或不支持断点续传")
+                # 不经过用户态缓冲，断点状态记录的字节一定已写入文件
+                with open(part_path, "r+b", buffering=0) as f:
+                    f.seek(pos)
+                    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        chunk = chunk[: end + 1 - pos]
+                        f.write(chunk)
+                        pos += len(chunk)
+                        get_metrics().add_bytes("download", len(chunk))
+                        state.advance(index, len(chunk), on_progress)
+                        if pos > end:
+                            return
+            raise IOError(f"分段下载不完整: {pos - start}/{end + 1 - start} 字节")
+        except (requests.RequestException, IOError) as e:
+            if attempt == PART_RETRIES:
+                raise
+            get_logger().warning("分段下载中断，从断点重试 (%d/%d): %s", attempt + 1, PART_RETRIES, e)
+            time.sleep(min(2 ** attempt, 10))
+
+
+def download_resumable(
+    url: str,
+    file_path: str | Path,
+    timeout: float = 120,
+    on_progress: ProgressCallback | None = None,
+    parts: int = RANGE_PARTS,
+) -> int:
+    """
+    下载 url 到 file_path，返回写入的字节数
+    - 服务器支持 Range 且文件不小于 RANGE_MIN_SIZE 时分 parts 段并行下载，各段中断后从断点重试；
+      仍失败时在应用数据目录保留 .part 文件和断点状态，之后再下载同一 URL 时继续
+    - 否则退回 download_to_file 单连接流式下载
+    失败时抛出异常，且目标路径保持不变
+    """
+    file_path = Path(file_path)
+    probe = _probe(url, timeout)
+    if probe is None or probe[0] < RANGE_MIN_SIZE:
+        return download_to_file(url, file_path, timeout, on_progress)
+    total, validator = probe
+
+    # 断点文件按 URL 命名，保存在应用数据目录（不在用户的下载目录留下隐藏文件），换了保存路径也能续传
+    cleanup_partial()
+    url_hash = hashlib.sha256(url.encode()).hexdigest()[:16]
+    part_path = _part_dir() / f"{url_hash}.part"
+    state_path = _part_dir() / f"{url_hash}.part.json"
+
+    with _part_lock(part_path):
+        state = _RangeState.load(state_path, total, validator) if part_path.exists() else None
+        if state is None:
+            state = _RangeState.create(state_path, total, validator, max(1, parts))
+            with open(part_path, "wb") as f:
+                f.truncate(total)
+            state.save()
+        elif state.downloaded:
+            get_logger().info("断点续传: %s (已下载 %d/%d 字节)", file_path.name, state.downloaded, total)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(state.ranges), thread_name_prefix="hetangai-range") as pool:
+                futures = [
+                    pool.submit(_fetch_range, url, part_path, state, i, timeout, on_progress)
+                    for i in range(len(state.ranges))
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            state.save()
+
+        if state.downloaded != total or part_path.stat().st_size != total:
+            raise IOError(f"下载不完整: {state.downloaded}/{total} 字节")
+        try:
+            os.replace(part_path, file_path)
+        except OSError:
+            # 数据目录与下载目录不在同一文件系统：先复制到目标目录的临时文件再原子重命名
+            copy_file_atomic(part_path, file_path)
+            part_path.unlink(missing_ok=True)
+        state_path.unlink(missing_ok=True)
+
+    if on_progress:
+        on_progress(total, total)
+    return total
+
+
+def write_file_atomic(file_path: str | Path, data: bytes) -> int:
+    """将内存中的数据原子写入 file_path，返回写入的字节数"""
+    file_path = Path(file_path)
+    tmp_path = _temp_path(file_path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return len(data)
+
+
+def copy_file_atomic(src_path: str | Path, file_path: str | Path) -> int:
+    """将 src_path 原子复制到 file_path，返回复制的字节数"""
+    file_path = Path(file_path)
+    tmp_path = _temp_path(file_path)
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return file_path.stat().st_size
@@ -0,0 +1,234 @@
+"""
+HeTangAI 异步执行引擎
+- 单个事件循环线程承载所有流式生成请求，取代"每任务一个线程"
+- 阻塞操作（文件写入、下载等）交给 IO 线程池，CPU 密集操作（图片处理等）交给进程池，不占用 GIL
+- ConcurrencyLimiter: 可在线调整上限的并发限制器
+- CancelToken: 任务级取消令牌，可中止运行中的协程
+"""
+
+import os
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from backend.logger import get_logger
+
+
+class ConcurrencyLimiter:
+    """
+    可动态调整上限的异步并发限制器
+    - acquire/release 只能在事件循环线程中调用
+    - set_limit 立即生效：调大时唤醒等待者，调小时不打断运行中的任务
+    """
+
+    def __init__(self, limit: int):
+        self._limit = max(1, limit)
+        self._active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+    async def acquire(self):
+        if self._active < self._limit and not self._waiters:
+            self._active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已被分配名额但在唤醒前取消，归还名额
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self):
+        self._active -= 1
+        self._wake()
+
+    def set_limit(self, limit: int):
+        self._limit = max(1, limit)
+        self._wake()
+
+    def _wake(self):
+        while self._active < self._limit and self._waiters:
+            fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self._active += 1
+            fut.set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class CancelToken:
+    """
+    任务取消令牌
+    - bind() 绑定 submit() 返回的 Future
+    - cancel() 可在任意线程调用：立即取消任务协程，正在等待的网络读取随之中断，
+      协程 finally 中关闭连接、释放并发名额
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._future: Future | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def bind(self, future: Future):
+        with self._lock:
+            self._future = future
+            cancelled = self._cancelled
+        if cancelled:
+            future.cancel()
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            future = self._future
+        if future is not None:
+            future.cancel()
+
+
+class AsyncEngine:
+    """进程内共享的异步执行引擎"""
+
+    def __init__(self, io_workers: int = 8):
+        self._loop = asyncio.new_event_loop()
+        self._io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="hetangai-io")
+        self._cpu_pool: ProcessPoolExecutor | None = None  # 首次使用时创建
+        self._cpu_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="hetangai-engine", daemon=True)
+        self._thread.start()
+        get_logger().info("异步引擎已启动")
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def submit(self, coro) -> Future:
+        """从任意线程提交协程，返回可 cancel() 的 concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def submit_many(self, coros: list) -> list[Future]:
+        """
+        批量提交协程：只唤醒一次事件循环（逐个 submit 每次都要写一次唤醒管道），
+        返回与 coros 一一对应的 concurrent Future，语义同 submit()
+        """
+        futures = [Future() for _ in coros]
+
+        def start():
+            for coro, future in zip(coros, futures):
+                if future.cancelled():
+                    coro.close()  # 启动前已被取消
+                    continue
+                _chain(self._loop, self._loop.create_task(coro), future)
+
+        self._loop.call_soon_threadsafe(start)
+        return futures
+
+    def call_soon(self, fn, *args):
+        """在事件循环线程中执行同步回调（线程安全）"""
+        self._loop.call_soon_threadsafe(fn, *args)
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """在 IO 线程池中执行阻塞函数并等待结果（仅限协程内调用）"""
+        return await self._loop.run_in_executor(self._io_pool, functools.partial(fn, *args, **kwargs))
+
+    async def run_cpu(self, fn, *args):
+        """在进程池中执行 CPU 密集函数并等待结果（fn 须为模块级函数，参数和返回值须可 pickle）"""
+        with self._cpu_lock:
+            if self._cpu_pool is None:
+                self._cpu_pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+            pool = self._cpu_pool
+        try:
+            return await self._loop.run_in_executor(pool, functools.partial(fn, *args))
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，下次调用时重建
+            with self._cpu_lock:
+                if self._cpu_pool is pool:
+                    self._cpu_pool = None
+            raise
+
+    def shutdown(self):
+        """停止事件循环并关闭线程池、进程池"""
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._io_pool.shutdown(wait=False)
+        with self._cpu_lock:
+            if self._cpu_pool is not None:
+                self._cpu_pool.shutdown(wait=False, cancel_futures=True)
+                self._cpu_pool = None
+
+
+def _chain(loop: asyncio.AbstractEventLoop, task: asyncio.Task, future: Future):
+    """把协程任务的结果同步到 concurrent Future，Future 被取消时取消协程任务"""
+
+    def copy_result(t: asyncio.Task):
+        if t.cancelled():
+            future.cancel()
+        elif not future.set_running_or_notify_cancel():
+            return
+        elif t.exception() is not None:
+            future.set_exception(t.exception())
+        else:
+            future.set_result(t.result())
+
+    def cancel_task(f: Future):
+        if f.cancelled():
+            loop.call_soon_threadsafe(task.cancel)
+
+    task.add_done_callback(copy_result)
+    future.add_done_callback(cancel_task)
+
+
+_engine: AsyncEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> AsyncEngine:
+    """获取全局异步引擎（首次调用时启动）"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncEngine()
+        return _engine
+
+
+def shutdown_engine():
+    """关闭全局异步引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.shutdown()
+            _engine = None
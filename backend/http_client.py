@@ -0,0 +1,594 @@
+"""
+HeTangAI HTTP 客户端
+- 基于 asyncio 的轻量 HTTP/1.1 客户端，供异步引擎发起流式生成请求
+- 支持 HTTPS、系统代理（HTTPS 走 CONNECT 隧道）、chunked 传输
+- 超时语义与 requests 一致：连接超时 + 每次读取的间隔超时
+- 连接池：异步请求与同步 requests.Session 均按主机划分独立连接池，
+  保持长连接复用，池大小跟随任务并发数调整，并提供复用计数
+"""
+
+import ssl
+import json
+import time
+import socket
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+import certifi
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend.engine import get_engine, ConcurrencyLimiter
+from backend.database import get_setting, subscribe
+
+
+API_HOST = "hetang.lyvideo.top"
+API_BASE = f"https://{API_HOST}"
+
+# 视频/图片结果所在的下载主机，单独分配连接池
+DOWNLOAD_HOSTS = ("storage.googleapis.com",)
+DOWNLOAD_POOL_SIZE = 8
+# 未单独配置的主机的默认连接池大小
+DEFAULT_POOL_SIZE = 10
+# 空闲长连接的最长保留时间（秒），超过则丢弃，避免复用已被服务器关闭的连接
+IDLE_TIMEOUT = 60
+
+_ssl_context: ssl.SSLContext | None = None
+
+_pool_lock = threading.Lock()
+_host_limits: dict[str, int] = {host: DOWNLOAD_POOL_SIZE for host in DOWNLOAD_HOSTS}
+_worker_counts: dict[str, int] = {}
+_async_pools: dict[str, "_HostPool"] = {}
+_session: requests.Session | None = None
+_session_adapters: dict[str, HTTPAdapter] = {}
+
+# 单行（状态行/头部/chunk 大小行）最大长度
+_LINE_LIMIT = 64 * 1024
+# 单次读取的块大小
+_READ_SIZE = 64 * 1024
+
+
+class ConnectError(Exception):
+    """无法建立到服务器（或代理）的连接"""
+
+
+class HTTPStatusError(Exception):
+    """HTTP 状态码表示失败（4xx / 5xx）"""
+
+    def __init__(self, status: int, reason: str, url: str, headers: dict[str, str] | None = None):
+        kind = "Client" if status < 500 else "Server"
+        super().__init__(f"{status} {kind} Error: {reason} for url: {url}")
+        self.status = status
+        self.reason = reason
+        self.url = url
+        self.headers = headers or {}
+
+
+def get_ssl_context() -> ssl.SSLContext:
+    """获取共享的 SSL 上下文（使用 certifi 证书，避免系统证书缺失）"""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return _ssl_context
+
+
+def _host_key(scheme: str, host: str, port: int) -> str:
+    return f"{scheme}://{host}:{port}"
+
+
+def get_host_limit(host: str) -> int:
+    """获取某主机的连接池大小"""
+    with _pool_lock:
+        return _host_limits.get(host, DEFAULT_POOL_SIZE)
+
+
+def set_host_limit(host: str, limit: int):
+    """设置某主机的连接池大小，异步池与同步 Session 同时生效"""
+    limit = max(1, limit)
+    with _pool_lock:
+        if _host_limits.get(host) == limit:
+            return
+        _host_limits[host] = limit
+        pools = [p for p in _async_pools.values() if p.host == host]
+        if _session is not None:
+            _mount_adapter(_session, host, limit)
+    for pool in pools:
+        get_engine().call_soon(pool.limiter.set_limit, limit)
+
+
+def get_api_base() -> str:
+    """上游地址：api_base 设置（本地模拟服务等）优先，默认 API_BASE"""
+    return (get_setting("api_base") or API_BASE).rstrip("/")
+
+
+def get_api_host() -> str:
+    return urlsplit(get_api_base()).hostname or API_HOST
+
+
+def set_worker_count(owner: str, count: int):
+    """
+    登记任务管理器的并发数（owner 如 "image" / "video"）
+    API 主机的连接池大小 = 所有管理器并发数之和，保证每个流都能拿到连接
+    """
+    with _pool_lock:
+        _worker_counts[owner] = count
+        total = sum(_worker_counts.values())
+    set_host_limit(get_api_host(), total)
+
+
+def get_worker_count() -> int:
+    """所有任务管理器的并发数之和（未登记时为 0）"""
+    with _pool_lock:
+        return sum(_worker_counts.values())
+
+
+def _on_api_base_changed(key: str, value: str):
+    with _pool_lock:
+        total = sum(_worker_counts.values())
+    if total:
+        set_host_limit(get_api_host(), total)
+
+
+class _HostPool:
+    """单个主机的异步长连接池（仅在事件循环线程中使用）"""
+
+    def __init__(self, host: str, limit: int):
+        self.host = host
+        self.limiter = ConcurrencyLimiter(limit)
+        self.idle: deque[tuple[asyncio.StreamReader, asyncio.StreamWriter, bool, float]] = deque()
+        self.created = 0
+        self.reused = 0
+        self.requests = 0
+        self.bytes_sent = 0  # 请求体字节数
+        self.bytes_received = 0  # 响应字节数（含 chunk 分隔）
+
+    def take_idle(self):
+        now = time.monotonic()
+        while self.idle:
+            reader, writer, via_proxy, since = self.idle.pop()
+            if now - since > IDLE_TIMEOUT or writer.is_closing() or reader.at_eof():
+                writer.close()
+                continue
+            return reader, writer, via_proxy
+        return None
+
+    def put_idle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, via_proxy: bool):
+        self.idle.append((reader, writer, via_proxy, time.monotonic()))
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limiter.limit,
+            "active": self.limiter.active,
+            "waiting": self.limiter.waiting,
+            "idle": len(self.idle),
+            "created": self.created,
+            "reused": self.reused,
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+def _get_host_pool(key: str, host: str) -> _HostPool:
+    with _pool_lock:
+        pool = _async_pools.get(key)
+        if pool is None:
+            pool = _HostPool(host, _host_limits.get(host, DEFAULT_POOL_SIZE))
+            _async_pools[key] = pool
+        return pool
+
+
+class AsyncResponse:
+    """流式 HTTP 响应，body 按需读取；close() 后连接归还连接池或关闭"""
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        reason: str,
+        headers: dict[str, str],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        read_timeout: float,
+        pool: _HostPool | None = None,
+        keep_alive: bool = False,
+        via_proxy: bool = False,
+    ):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # key 统一为小写
+        self._reader = reader
+        self._writer = writer
+        self._read_timeout = read_timeout
+        self._pool = pool
+        self._keep_alive = keep_alive
+        self._via_proxy = via_proxy
+        self._complete = False
+        self._closed = False
+        self._body = None  # 正在读取的 body 生成器，中途停止后 drain() / 再次迭代从原处继续
+        self.timing: dict = {}  # {"connect": 建立连接秒数（复用为 0）, "ttfb": 发出请求到收到响应头的秒数, "reused"}
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPStatusError(self.status, self.reason, self.url, self.headers)
+
+    async def _read(self, coro):
+        data = await asyncio.wait_for(coro, self._read_timeout)
+        if self._pool is not None:
+            self._pool.bytes_received += len(data)
+        return data
+
+    def iter_chunks(self):
+        """
+        逐块产出 body 原始字节（自动处理 chunked / Content-Length / 读到关闭）
+        多次调用返回同一个生成器：提前 break 后再次迭代从上次停止的位置继续读
+        """
+        if self._body is None:
+            self._body = self._iter_body()
+        return self._body
+
+    async def _iter_body(self):
+        try:
+            if "chunked" in self.headers.get("transfer-encoding", "").lower():
+                while True:
+                    size_line = await self._read(self._reader.readuntil(b"\r\n"))
+                    size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                    if size == 0:
+                        # 跳过 trailer 直到空行
+                        while (await self._read(self._reader.readuntil(b"\r\n"))) != b"\r\n":
+                            pass
+                        self._complete = True
+                        return
+                    remaining = size
+                    while remaining > 0:
+                        data = await self._read(self._reader.read(min(remaining, _READ_SIZE)))
+                        if not data:
+                            raise ConnectionResetError("连接在 chunk 传输中断开")
+                        remaining -= len(data)
+                        yield data
+                    await self._read(self._reader.readexactly(2))
+            elif "content-length" in self.headers:
+                remaining = int(self.headers["content-length"])
+                while remaining > 0:
+                    data = await self._read(self._reader.read(min(remaining, _READ_SIZE)))
+                    if not data:
+                        raise ConnectionResetError("连接在 body 传输中断开")
+                    remaining -= len(data)
+                    yield data
+                self._complete = True
+            else:
+                while True:
+                    data = await self._read(self._reader.read(_READ_SIZE))
+                    if not data:
+                        return
+                    yield data
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionResetError("连接在响应传输中断开") from e
+
+    async def iter_lines(self):
+        """逐行产出解码后的文本（与 requests.iter_lines(decode_unicode=True) 行为一致）"""
+        pending = b""
+        async for chunk in self.iter_chunks():
+            pending += chunk
+            lines = pending.split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r").decode("utf-8", errors="replace")
+        if pending:
+            yield pending.rstrip(b"\r").decode("utf-8", errors="replace")
+
+    async def drain(self, max_bytes: int = 64 * 1024, timeout: float = 2):
+        """
+        从上次停止读取的位置读完剩余的少量 body（如 SSE 的 [DONE] 之后的结束块），使连接可以归还连接池
+        超过 max_bytes 或 timeout 则放弃，close() 时直接关闭连接
+        """
+        if self._complete or self._closed:
+            return
+
+        async def _consume():
+            total = 0
+            async for chunk in self.iter_chunks():
+                total += len(chunk)
+                if total > max_bytes:
+                    return
+
+        try:
+            await asyncio.wait_for(_consume(), timeout)
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+
+    async def read(self) -> bytes:
+        parts = [chunk async for chunk in self.iter_chunks()]
+        return b"".join(parts)
+
+    def close(self):
+        """body 已读完且可复用时归还连接池，否则立即关闭底层连接"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._pool is not None and self._keep_alive and self._complete:
+            self._pool.put_idle(self._reader, self._writer, self._via_proxy)
+        else:
+            self._writer.close()
+        if self._pool is not None:
+            self._pool.limiter.release()
+
+
+def _select_proxy(scheme: str, host: str) -> str:
+    """按系统/环境变量代理配置选择代理地址，无代理返回空串"""
+    try:
+        if proxy_bypass(host):
+            return ""
+    except OSError:
+        pass
+    return getproxies().get(scheme, "")
+
+
+def _open_tunnel(proxy_host: str, proxy_port: int, host: str, port: int, timeout: float) -> socket.socket:
+    """通过 HTTP 代理建立 CONNECT 隧道（阻塞，在线程池中执行）"""
+    sock = socket.create_connection((proxy_host, proxy_port), timeout=timeout)
+    try:
+        sock.sendall(
+            f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode("ascii")
+        )
+        head = b""
+        while b"\r\n\r\n" not in head:
+            data = sock.recv(4096)
+            if not data:
+                raise ConnectError("代理在 CONNECT 过程中关闭连接")
+            head += data
+            if len(head) > _LINE_LIMIT:
+                raise ConnectError("代理 CONNECT 响应过长")
+        status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+        parts = status_line.split(" ", 2)
+        if len(parts) < 2 or parts[1] != "200":
+            raise ConnectError(f"代理拒绝 CONNECT: {status_line}")
+        sock.settimeout(None)
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+async def _connect(scheme: str, host: str, port: int, timeout: float):
+    """建立连接，返回 (reader, writer, via_proxy)"""
+    loop = asyncio.get_running_loop()
+    proxy = _select_proxy(scheme, host)
+    ssl_ctx = get_ssl_context() if scheme == "https" else None
+
+    try:
+        if proxy:
+            p = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            proxy_port = p.port or 80
+            if scheme == "https":
+                sock = await asyncio.wait_for(
+                    loop.run_in_executor(None, _open_tunnel, p.hostname, proxy_port, host, port, timeout),
+                    timeout,
+                )
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(sock=sock, ssl=ssl_ctx, server_hostname=host, limit=_LINE_LIMIT),
+                    timeout,
+                )
+                return reader, writer, False
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(p.hostname, proxy_port, limit=_LINE_LIMIT), timeout
+            )
+            return reader, writer, True
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_ctx, limit=_LINE_LIMIT), timeout
+        )
+        return reader, writer, False
+    except asyncio.TimeoutError:
+        raise
+    except (OSError, ssl.SSLError) as e:
+        raise ConnectError(f"无法连接到 {host}:{port}: {e}") from e
+
+
+async def request(
+    method: str,
+    url: str,
+    *,
+    headers: dict[str, str] | None = None,
+    json_body=None,
+    data: bytes | None = None,
+    timeout: float = 300,
+    connect_timeout: float | None = None,
+) -> AsyncResponse:
+    """
+    发起请求并在收到响应头后返回 AsyncResponse
+    - timeout: 每次读取的间隔超时（秒）
+    - connect_timeout: 连接超时，默认与 timeout 相同
+    调用方负责在用完后 close() 响应
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https"):
+        raise ValueError(f"不支持的协议: {url}")
+    host = parts.hostname or ""
+    port = parts.port or (443 if scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    # Host 只含主机名和非默认端口，不带 URL 中的用户信息
+    host_header = f"[{host}]" if ":" in host else host
+    if parts.port:
+        host_header += f":{parts.port}"
+
+    body = data or b""
+    req_headers = {
+        "Host": host_header,
+        "User-Agent": "HeTangAI",
+        "Accept": "*/*",
+        "Accept-Encoding": "identity",
+        "Connection": "keep-alive",
+    }
+    if json_body is not None:
+        body = json.dumps(json_body, ensure_ascii=False).encode("utf-8")
+        req_headers["Content-Type"] = "application/json"
+    if body or method.upper() in ("POST", "PUT", "PATCH"):
+        req_headers["Content-Length"] = str(len(body))
+    if headers:
+        req_headers.update(headers)
+
+    pool = _get_host_pool(_host_key(scheme, host, port), host)
+    await pool.limiter.acquire()
+    try:
+        # 复用的空闲连接可能已被服务器关闭，此时换新连接重发一次
+        while True:
+            connect_started = time.monotonic()
+            conn = pool.take_idle()
+            reused = conn is not None
+            if conn is None:
+                conn = await _connect(scheme, host, port, connect_timeout or timeout)
+                pool.created += 1
+            sent = time.monotonic()
+            reader, writer, via_proxy = conn
+            try:
+                status, reason, resp_headers = await _send_request(
+                    reader, writer, method, url if via_proxy else path, req_headers, body, timeout
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if reused:
+                    continue
+                raise
+            if reused:
+                pool.reused += 1
+            pool.requests += 1
+            pool.bytes_sent += len(body)
+            break
+    except BaseException:
+        pool.limiter.release()
+        raise
+
+    keep_alive = (
+        resp_headers.get("connection", "").lower() != "close"
+        and ("content-length" in resp_headers or "chunked" in resp_headers.get("transfer-encoding", "").lower())
+    )
+    response = AsyncResponse(
+        url, status, reason, resp_headers, reader, writer, timeout,
+        pool=pool, keep_alive=keep_alive, via_proxy=via_proxy,
+    )
+    response.timing = {
+        "connect": round(sent - connect_started, 4),
+        "ttfb": round(time.monotonic() - sent, 4),
+        "reused": reused,
+    }
+    if method.upper() == "HEAD" or status in (204, 304):
+        response._complete = True
+    return response
+
+
+async def _send_request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    method: str,
+    target: str,
+    req_headers: dict[str, str],
+    body: bytes,
+    timeout: float,
+) -> tuple[int, str, dict[str, str]]:
+    """在已建立的连接上发送请求并读取响应头，失败时关闭连接"""
+    try:
+        head = f"{method.upper()} {target} HTTP/1.1\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in req_headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n")
+        if body:
+            writer.write(body)
+        await asyncio.wait_for(writer.drain(), timeout)
+
+        status_line = await asyncio.wait_for(reader.readuntil(b"\r\n"), timeout)
+        status_parts = status_line.decode("latin-1").strip().split(" ", 2)
+        if len(status_parts) < 2 or not status_parts[0].startswith("HTTP/"):
+            raise ConnectionResetError(f"无效的响应状态行: {status_line[:100]!r}")
+        status = int(status_parts[1])
+        reason = status_parts[2] if len(status_parts) > 2 else ""
+
+        resp_headers: dict[str, str] = {}
+        while True:
+            line = await asyncio.wait_for(reader.readuntil(b"\r\n"), timeout)
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            resp_headers[name.strip().lower()] = value.strip()
+        return status, reason, resp_headers
+    except asyncio.IncompleteReadError as e:
+        writer.close()
+        raise ConnectionResetError("服务器在返回响应头前断开连接") from e
+    except BaseException:
+        writer.close()
+        raise
+
+
+# ===================== 同步 Session =====================
+
+def _mount_adapter(session: requests.Session, host: str, limit: int):
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit)
+    old = _session_adapters.get(host)
+    for scheme in ("https", "http"):
+        session.mount(f"{scheme}://{host}/", adapter)
+    _session_adapters[host] = adapter
+    if old is not None:
+        old.close()
+
+
+def get_session() -> requests.Session:
+    """
+    获取共享的同步 requests.Session（下载、手动保存使用）
+    - 已配置的主机各自挂载独立的 HTTPAdapter（独立连接池及大小）
+    - 其余主机共用默认 adapter
+    """
+    global _session
+    with _pool_lock:
+        if _session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE))
+            session.mount("http://", HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE))
+            for host, limit in _host_limits.items():
+                _mount_adapter(session, host, limit)
+            _session = session
+        return _session
+
+
+def _sync_pool_stats() -> dict[str, dict]:
+    if _session is None:
+        return {}
+    stats: dict[str, dict] = {}
+    seen: set[int] = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        manager = adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            conn_pool = manager.pools.get(key)
+            if conn_pool is None:
+                continue
+            host = conn_pool.host
+            item = stats.setdefault(host, {
+                "limit": _host_limits.get(host, DEFAULT_POOL_SIZE), "created": 0, "reused": 0, "requests": 0,
+            })
+            item["created"] += conn_pool.num_connections
+            item["requests"] += conn_pool.num_requests
+            item["reused"] += max(0, conn_pool.num_requests - conn_pool.num_connections)
+    return stats
+
+
+def get_pool_stats() -> dict:
+    """获取连接池统计：按主机汇总新建连接数、复用次数、请求数（异步连接池按 协议://主机:端口 区分）"""
+    with _pool_lock:
+        async_stats = {key: p.stats() for key, p in _async_pools.items()}
+        sync_stats = _sync_pool_stats()
+    return {"async": async_stats, "sync": sync_stats}
+
+
+subscribe(_on_api_base_changed, ("api_base",))
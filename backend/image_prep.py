@@ -0,0 +1,175 @@
+"""
+HeTangAI 参考图预处理
+- 上传前在进程池中解码参考图：按 EXIF 方向摆正，缩放到目标模型所需的最大边长，
+  按设置的质量重新压缩为 JPEG（不写入 EXIF 等元数据）
+- 处理结果存入 blob_store，按"原图哈希 + 处理参数"缓存，同一张图再次使用时不再处理
+  （已上传的参考图直接用句柄作为原图哈希；哈希、base64 编码都在线程池中进行，不占用事件循环）
+- 依赖 Pillow（可选），未安装、关闭预处理或处理失败时原样上传
+"""
+
+import io
+import base64
+import hashlib
+import threading
+from fnmatch import fnmatchcase
+from collections import OrderedDict
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 为可选依赖
+    Image = ImageOps = None
+
+from backend.logger import get_logger
+from backend.database import get_setting
+from backend.blob_store import get_blob_store
+
+
+DEFAULT_QUALITY = 90
+MAX_CACHE_ENTRIES = 1024
+
+# 各模型参考图的最大边长（按顺序匹配，取第一条）
+MODEL_MAX_SIDE = (
+    ("*-4k", 4096),
+    ("*-2k", 2048),
+    ("veo_*", 1920),
+    ("*", 1536),
+)
+
+
+def is_available() -> bool:
+    return Image is not None
+
+
+def max_side_for(model: str) -> int:
+    for pattern, side in MODEL_MAX_SIDE:
+        if fnmatchcase(model, pattern):
+            return side
+    return MODEL_MAX_SIDE[-1][1]
+
+
+def get_quality() -> int:
+    try:
+        return min(95, max(30, int(get_setting("image_prep_quality") or DEFAULT_QUALITY)))
+    except (ValueError, TypeError):
+        return DEFAULT_QUALITY
+
+
+def process_image(b64_data: str, max_side: int, quality: int) -> tuple[bytes, dict]:
+    """解码 base64 参考图，摆正、缩放并重新压缩为 JPEG（在子进程中执行）"""
+    data = base64.b64decode(b64_data)
+    with Image.open(io.BytesIO(data)) as src:
+        img = ImageOps.exif_transpose(src)
+        source_size = img.size
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            # 透明背景铺白，避免转 JPEG 后变黑
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality, optimize=True)
+    result = out.getvalue()
+    return result, {
+        "before": len(data),
+        "after": len(result),
+        "source_size": list(source_size),
+        "size": list(img.size),
+    }
+
+
+def _hash_base64(b64_data: str) -> str:
+    return hashlib.sha256(b64_data.encode("ascii", "ignore")).hexdigest()
+
+
+def _store_result(blobs, data: bytes) -> tuple[str, str]:
+    """处理结果写入存储并编码为 base64，返回 (blob 哈希, base64)（在线程池中执行）"""
+    blob_hash, _ = blobs.put(data)
+    return blob_hash, base64.b64encode(data).decode("ascii")
+
+
+class ImagePreprocessor:
+    """参考图预处理（结果按原图哈希缓存）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, tuple[str, dict]] = OrderedDict()  # 缓存键 -> (结果 blob 哈希, 处理信息)
+        self._processed = 0
+        self._hits = 0
+        self._failed = 0
+        self._warned = False
+
+    def _enabled(self) -> bool:
+        if get_setting("image_prep_enabled") == "false":
+            return False
+        if not is_available():
+            if not self._warned:
+                self._warned = True
+                get_logger().warning("未安装 Pillow，参考图将原样上传")
+            return False
+        return True
+
+    async def prepare(self, engine, b64_data: str, model: str, source_hash: str = "") -> tuple[str, dict]:
+        """
+        预处理参考图，返回 (上传用的 base64, 处理信息)
+        - source_hash: 原图的内容哈希（已上传参考图的句柄），为空时在线程池中按 base64 计算
+        - 处理信息: {"before", "after", "source_size", "size", "cached"}，未处理时为空 dict
+        """
+        if not b64_data or not self._enabled():
+            return b64_data, {}
+        max_side, quality = max_side_for(model), get_quality()
+        if not source_hash:
+            source_hash = await engine.run_blocking(_hash_base64, b64_data)
+        key = f"{source_hash}:{max_side}:{quality}"
+        blobs = get_blob_store()
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry:
+                self._cache.move_to_end(key)
+        if entry:
+            result = await engine.run_blocking(blobs.read_base64, entry[0])
+            if result is not None:
+                with self._lock:
+                    self._hits += 1
+                return result, {**entry[1], "cached": True}
+
+        try:
+            data, info = await engine.run_cpu(process_image, b64_data, max_side, quality)
+            blob_hash, result = await engine.run_blocking(_store_result, blobs, data)
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            get_logger().warning("参考图预处理失败，原样上传: %s", e)
+            return b64_data, {}
+
+        with self._lock:
+            self._processed += 1
+            self._cache[key] = (blob_hash, info)
+            while len(self._cache) > MAX_CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+        return result, {**info, "cached": False}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": is_available(),
+                "processed": self._processed,
+                "hits": self._hits,
+                "failed": self._failed,
+            }
+
+
+_preprocessor: ImagePreprocessor | None = None
+_preprocessor_lock = threading.Lock()
+
+
+def get_preprocessor() -> ImagePreprocessor:
+    """获取全局参考图预处理器"""
+    global _preprocessor
+    with _preprocessor_lock:
+        if _preprocessor is None:
+            _preprocessor = ImagePreprocessor()
+        return _preprocessor
@@ -34,8 +34,8 @@ def get_log_dir() -> Path:
     return log_dir
 
 
-def setup_logger() -> logging.Logger:
-    """初始化日志系统，每次调用创建新的日志文件"""
+def setup_logger(console_level: int = logging.INFO) -> logging.Logger:
+    """初始化日志系统，每次调用创建新的日志文件（console_level 为控制台输出级别，控制台输出到 stderr）"""
     global _log_dir, _current_log_file
 
     _log_dir = get_log_dir()
@@ -55,7 +55,7 @@ def setup_logger() -> logging.Logger:
 
     # 控制台 handler
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+    console_handler.setLevel(console_level)
 
     # 日志格式
     formatter = logging.Formatter(
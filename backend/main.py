@@ -6,15 +6,18 @@
 
 import os
 import sys
+import multiprocessing
 from pathlib import Path
 
-import webview
-
 from backend.logger import setup_logger, get_logger
-from backend.database import init_db
+from backend.database import init_db, close_thread_connection
+from backend.engine import shutdown_engine
+from backend.update_dispatcher import shutdown_dispatcher
+from backend.download_queue import shutdown_download_queue
 from backend.task_manager import TaskManager
 from backend.video_task_manager import VideoTaskManager
 from backend.api import Api
+from backend.server import start_configured_server, stop_server
 
 
 def get_base_dir() -> Path:
@@ -42,6 +45,8 @@ def get_version() -> str:
 
 
 def main():
+    import webview  # 只在桌面版入口导入，命令行和本地服务模式不需要安装 pywebview
+
     # 1. 初始化日志
     setup_logger()
     logger = get_logger()
@@ -88,14 +93,24 @@ def main():
 
     logger.info("窗口已创建，启动 GUI")
 
+    # 按设置启动本地 HTTP 服务（与窗口共用同一组任务管理器）
+    start_configured_server(api)
+
     # 7. 启动 webview
     webview.start(debug=False)
 
     # 8. 清理
+    stop_server()
     task_manager.shutdown()
     video_task_manager.shutdown()
+    shutdown_download_queue()
+    shutdown_dispatcher()
+    shutdown_engine()
+    close_thread_connection()
     logger.info("荷塘AI生成器已退出")
 
 
 if __name__ == "__main__":
+    # 打包后的程序中，进程池子进程需要从这里进入
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,211 @@
+"""
+HeTangAI 运行指标
+- 每次执行按阶段记录时间点（见任务 attempts），结束时按 (任务类型, 模型, 阶段) 汇总为直方图：
+  queue 排队 / prepare 参考图准备 / throttle 上游限流等待 / connect 建立连接 / ttfb 发出请求到响应头 /
+  stream 读取流 / extract 结果提取与保存 / total 排队到结束 / download_wait 下载排队 / download 自动下载
+- 计数：各模型每次执行的结果（done / error / retry / cancelled / cached），结果下载字节数
+- render_prometheus() 把 Api.get_metrics() 的结果转为 Prometheus 文本格式（本地服务 GET /metrics）
+"""
+
+import threading
+
+
+# 直方图分桶上限（秒），最后隐含 +Inf
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# (阶段, 开始时间点, 结束时间点)
+PHASE_MARKS = (
+    ("queue", "queued_at", "started_at"),
+    ("prepare", "started_at", "prepared_at"),
+    ("throttle", "prepared_at", "sent_at"),
+    ("ttfb", "sent_at", "headers_at"),
+    ("stream", "headers_at", "streamed_at"),
+    ("extract", "streamed_at", "ended_at"),
+    ("total", "queued_at", "ended_at"),
+)
+
+
+def phase_durations(record: dict) -> dict[str, float]:
+    """从一次执行（或下载）记录的时间点计算各阶段耗时，缺少时间点的阶段跳过"""
+    durations = {}
+    for phase, start, end in PHASE_MARKS:
+        if start in record and end in record:
+            durations[phase] = max(0.0, record[end] - record[start])
+    if "connect" in record:
+        durations["connect"] = record["connect"]
+    return durations
+
+
+class Histogram:
+    """累计分桶直方图（调用方持有锁）"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按分桶估算分位数（返回所在分桶的上限，落在 +Inf 桶时返回最后一个上限）"""
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return BUCKETS[min(i, len(BUCKETS) - 1)]
+        return 0.0
+
+    def snapshot(self) -> dict:
+        cumulative, seen = [], 0
+        for bound, n in zip((*BUCKETS, "+Inf"), self.counts):
+            seen += n
+            cumulative.append([bound, seen])
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+
+class MetricsRegistry:
+    """任务阶段直方图与计数（任意线程调用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple[str, str, str], Histogram] = {}  # (kind, model, phase)
+        self._outcomes: dict[tuple[str, str, str], int] = {}  # (kind, model, outcome)
+        self._bytes: dict[str, int] = {}
+
+    def observe(self, kind: str, model: str, durations: dict[str, float]):
+        with self._lock:
+            for phase, seconds in durations.items():
+                key = (kind, model, phase)
+                hist = self._histograms.get(key)
+                if hist is None:
+                    hist = self._histograms[key] = Histogram()
+                hist.observe(seconds)
+
+    def observe_attempt(self, kind: str, model: str, attempt: dict, outcome: str):
+        """记录一次执行：各阶段耗时 + 结果计数"""
+        self.observe(kind, model, phase_durations(attempt))
+        self.count(kind, model, outcome)
+
+    def count(self, kind: str, model: str, outcome: str):
+        with self._lock:
+            key = (kind, model, outcome)
+            self._outcomes[key] = self._outcomes.get(key, 0) + 1
+
+    def add_bytes(self, name: str, n: int):
+        with self._lock:
+            self._bytes[name] = self._bytes.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        """{"tasks": {kind: {model: {"phases": {...}, "outcomes": {...}}}}, "bytes": {...}}"""
+        tasks: dict[str, dict[str, dict]] = {}
+        with self._lock:
+            for (kind, model, phase), hist in self._histograms.items():
+                entry = tasks.setdefault(kind, {}).setdefault(model, {"phases": {}, "outcomes": {}})
+                entry["phases"][phase] = hist.snapshot()
+            for (kind, model, outcome), n in self._outcomes.items():
+                entry = tasks.setdefault(kind, {}).setdefault(model, {"phases": {}, "outcomes": {}})
+                entry["outcomes"][outcome] = n
+            return {"tasks": tasks, "bytes": dict(self._bytes)}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._outcomes.clear()
+            self._bytes.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """获取全局指标"""
+    return _registry
+
+
+# ===================== Prometheus 文本格式 =====================
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _labels(**labels) -> str:
+    items = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + items + "}" if items else ""
+
+
+def render_prometheus(metrics: dict) -> str:
+    """把 Api.get_metrics() 的结果转为 Prometheus 文本格式"""
+    lines: list[str] = []
+
+    def family(name: str, kind: str, help_text: str):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    family("hetangai_task_phase_seconds", "histogram", "Task phase duration by kind, model and phase")
+    for kind, models in metrics.get("tasks", {}).items():
+        for model, entry in models.items():
+            for phase, hist in entry["phases"].items():
+                for bound, n in hist["buckets"]:
+                    lines.append(
+                        f"hetangai_task_phase_seconds_bucket{_labels(kind=kind, model=model, phase=phase, le=bound)} {n}"
+                    )
+                base = _labels(kind=kind, model=model, phase=phase)
+                lines.append(f"hetangai_task_phase_seconds_sum{base} {hist['sum']}")
+                lines.append(f"hetangai_task_phase_seconds_count{base} {hist['count']}")
+
+    family("hetangai_task_attempts_total", "counter", "Task attempts by outcome")
+    for kind, models in metrics.get("tasks", {}).items():
+        for model, entry in models.items():
+            for outcome, n in entry["outcomes"].items():
+                lines.append(f"hetangai_task_attempts_total{_labels(kind=kind, model=model, outcome=outcome)} {n}")
+
+    queues = metrics.get("queues", {})
+    for field, kind, help_text in (
+        ("limit", "gauge", "Concurrency limit"),
+        ("active", "gauge", "Running tasks or downloads"),
+        ("waiting", "gauge", "Queued tasks or downloads"),
+    ):
+        family(f"hetangai_queue_{field}", kind, help_text)
+        for queue, stats in queues.items():
+            lines.append(f"hetangai_queue_{field}{_labels(queue=queue)} {stats.get(field, 0)}")
+
+    pools = metrics.get("pools", {})
+    for field, kind, help_text in (
+        ("limit", "gauge", "Connection pool size"),
+        ("active", "gauge", "Connections in use"),
+        ("waiting", "gauge", "Requests waiting for a connection"),
+        ("idle", "gauge", "Idle keep-alive connections"),
+        ("created", "counter", "Connections opened"),
+        ("reused", "counter", "Requests served on a reused connection"),
+        ("requests", "counter", "Requests sent"),
+        ("bytes_sent", "counter", "Request body bytes sent"),
+        ("bytes_received", "counter", "Response bytes received"),
+    ):
+        name = f"hetangai_http_pool_{field}" + ("_total" if kind == "counter" else "")
+        family(name, kind, help_text)
+        for host, stats in pools.items():
+            if field in stats:
+                lines.append(f"{name}{_labels(host=host)} {stats[field]}")
+
+    family("hetangai_bytes_total", "counter", "Bytes transferred")
+    for name, n in metrics.get("bytes", {}).items():
+        lines.append(f"hetangai_bytes_total{_labels(direction=name)} {n}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,260 @@
+"""
+HeTangAI 上游限流
+- 每个 API Key 一个令牌桶，限制发往上游的请求速率（rate_limit_rps 设置，0 为不限）
+- 在令牌桶之上用 AIMD 动态调整并发：初始值为任务并发数之和；并发已用满且请求成功、延迟正常时增加
+  （首次回退前每次成功加一，之后每轮加一），未用满时不增加，避免上限空涨到远超实际并发；
+  遇到 429/503 减半并按 Retry-After 暂停发放令牌，其他 5xx / 连接失败时小幅回退
+- 实际并发因此跟随账号可承受的水平，设置页的并发数只作为上限
+- 所有方法只在事件循环线程中调用（stats 除外）
+"""
+
+import time
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager
+
+from backend import http_client
+from backend.logger import get_logger
+from backend.database import get_setting, subscribe
+from backend.engine import get_engine, ConcurrencyLimiter
+
+
+DEFAULT_RATE = 5.0  # 每秒请求数，突发容量为其 2 倍
+INITIAL_CONCURRENCY = 4  # 尚未登记任务并发数时的初始并发
+MAX_CONCURRENCY = 200
+
+OVERLOAD_STATUSES = (429, 503)
+DEFAULT_BACKOFF = 5.0  # 限流响应没有 Retry-After 时的暂停秒数
+MAX_BACKOFF = 300.0
+
+OVERLOAD_FACTOR = 0.5  # 429/503 时并发乘以该系数
+ERROR_FACTOR = 0.75  # 其他 5xx / 连接失败时并发乘以该系数
+DECREASE_COOLDOWN = 2.0  # 两次回退的最小间隔（秒），避免同一波失败把并发压到底
+LATENCY_TOLERANCE = 3.0  # 响应延迟超过"历史最低值 × 该倍数 + LATENCY_SLACK"时不再增加并发
+LATENCY_SLACK = 0.25  # 秒，避免延迟很低时的抖动误判
+LATENCY_ALPHA = 0.2  # 延迟 EWMA 平滑系数
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After（秒数或 HTTP 日期），无法解析返回 None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_BACKOFF)
+
+
+class TokenBucket:
+    """异步令牌桶，支持整体暂停（Retry-After）"""
+
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def set_rate(self, rate: float, burst: int):
+        self._refill(time.monotonic())
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = min(self._tokens, self._burst)
+
+    def pause(self, seconds: float):
+        """在 seconds 秒内暂停发放令牌"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def _refill(self, now: float):
+        if self._rate > 0:
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self._rate <= 0:
+                return
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class AdaptiveConcurrency:
+    """AIMD 并发控制器：成功加性增长，过载乘性回退"""
+
+    def __init__(self, initial: int, max_limit: int, enabled: bool = True):
+        self._max = max(1, max_limit)
+        self._enabled = enabled
+        self.limiter = ConcurrencyLimiter(min(initial, self._max) if enabled else self._max)
+        self._successes = 0
+        self._slow_start = True  # 首次回退前快速增长
+        self._last_decrease = 0.0
+        self._latency: float | None = None  # 响应延迟 EWMA
+        self._latency_floor: float | None = None  # 观测到的最低延迟
+
+    @property
+    def limit(self) -> int:
+        return self.limiter.limit
+
+    def configure(self, max_limit: int, enabled: bool):
+        self._max = max(1, max_limit)
+        self._enabled = enabled
+        self.limiter.set_limit(min(self.limiter.limit, self._max) if enabled else self._max)
+
+    def on_success(self, latency: float):
+        self._latency = latency if self._latency is None else (
+            LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self._latency
+        )
+        self._latency_floor = latency if self._latency_floor is None else min(self._latency_floor, latency)
+        if not self._enabled or self._latency > self._latency_floor * LATENCY_TOLERANCE + LATENCY_SLACK:
+            return
+        # 只有并发已用满（本请求仍占用名额）时才说明上限在限制吞吐，否则增长没有依据
+        if self.limiter.active < self.limiter.limit:
+            return
+        # 慢启动阶段每次成功加一；之后每完成"当前并发数"个成功请求加一，相当于每轮加一
+        self._successes += 1
+        threshold = 1 if self._slow_start else self.limiter.limit
+        if self._successes >= threshold and self.limiter.limit < self._max:
+            self._successes = 0
+            self.limiter.set_limit(self.limiter.limit + 1)
+
+    def on_overload(self):
+        self._decrease(OVERLOAD_FACTOR)
+
+    def on_error(self):
+        self._decrease(ERROR_FACTOR)
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if not self._enabled or now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        self._slow_start = False
+        new_limit = max(1, int(self.limiter.limit * factor))
+        if new_limit < self.limiter.limit:
+            get_logger().info("上游并发回退: %d -> %d", self.limiter.limit, new_limit)
+            self.limiter.set_limit(new_limit)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limiter.limit,
+            "active": self.limiter.active,
+            "waiting": self.limiter.waiting,
+            "max": self._max,
+            "adaptive": self._enabled,
+            "latency": round(self._latency, 3) if self._latency is not None else None,
+            "latency_floor": round(self._latency_floor, 3) if self._latency_floor is not None else None,
+        }
+
+
+class UpstreamLimiter:
+    """单个 API Key 的上游限流：令牌桶 + 自适应并发"""
+
+    def __init__(self, rate: float, burst: int, adaptive: bool):
+        self.bucket = TokenBucket(rate, burst)
+        initial = http_client.get_worker_count() or INITIAL_CONCURRENCY
+        self.concurrency = AdaptiveConcurrency(initial, MAX_CONCURRENCY, adaptive)
+        self._overloads = 0
+        self._errors = 0
+        self._successes = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个上游并发名额并取得令牌，async with 块结束时释放名额"""
+        async with self.concurrency.limiter:
+            await self.bucket.acquire()
+            yield self
+
+    def record_response(self, status: int, latency: float, headers: dict[str, str]):
+        """根据响应状态码调整（latency 为收到响应头的耗时）"""
+        if status in OVERLOAD_STATUSES:
+            self._overloads += 1
+            retry_after = parse_retry_after(headers.get("retry-after"))
+            self.bucket.pause(DEFAULT_BACKOFF if retry_after is None else retry_after)
+            self.concurrency.on_overload()
+        elif status >= 500:
+            self._errors += 1
+            self.concurrency.on_error()
+        elif status < 400:
+            self._successes += 1
+            self.concurrency.on_success(latency)
+
+    def record_failure(self):
+        """连接失败 / 等待响应超时"""
+        self._errors += 1
+        self.concurrency.on_error()
+
+    def stats(self) -> dict:
+        return {
+            **self.concurrency.stats(),
+            "paused_for": round(self.bucket.paused_for, 1),
+            "successes": self._successes,
+            "overloads": self._overloads,
+            "errors": self._errors,
+        }
+
+
+_limiters: dict[str, UpstreamLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _read_config() -> tuple[float, int, bool]:
+    try:
+        rate = max(0.0, float(get_setting("rate_limit_rps") or DEFAULT_RATE))
+    except (ValueError, TypeError):
+        rate = DEFAULT_RATE
+    burst = max(1, round(rate * 2))
+    adaptive = (get_setting("adaptive_concurrency") or "true") == "true"
+    return rate, burst, adaptive
+
+
+def get_upstream_limiter(api_key: str) -> UpstreamLimiter:
+    """获取 API Key 对应的上游限流器（图片、视频任务共用）"""
+    with _limiters_lock:
+        limiter = _limiters.get(api_key)
+        if limiter is None:
+            limiter = _limiters[api_key] = UpstreamLimiter(*_read_config())
+        return limiter
+
+
+def reload_config():
+    """设置变更后重新加载限流配置（在事件循环线程中调用）"""
+    rate, burst, adaptive = _read_config()
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    for limiter in limiters:
+        limiter.bucket.set_rate(rate, burst)
+        limiter.concurrency.configure(MAX_CONCURRENCY, adaptive)
+
+
+def get_limiter_stats() -> dict:
+    """各 API Key（只显示末 4 位）的限流状态"""
+    with _limiters_lock:
+        return {f"...{key[-4:]}": limiter.stats() for key, limiter in _limiters.items()}
+
+
+def _on_config_changed(key: str, value: str):
+    with _limiters_lock:
+        if not _limiters:
+            return
+    get_engine().call_soon(reload_config)
+
+
+subscribe(_on_config_changed, ("rate_limit_rps", "adaptive_concurrency"))
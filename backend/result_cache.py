@@ -0,0 +1,217 @@
+"""
+HeTangAI 结果缓存
+- 以规范化请求（任务类型、提示词、模型、模式、参考图）的哈希为键，记录生成结果
+- 命中时任务直接完成，不再请求上游；可按任务跳过缓存（想要新的变体时）
+- 索引存于 SQLite，总大小超过上限时按最近命中时间淘汰
+- 图片结果只引用 blob_store 中的文件，文件被淘汰后对应缓存视为未命中；
+  URL 结果（上游地址会过期）超过 URL_TTL 后失效
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Iterable
+
+from peewee import fn, chunked
+
+from backend.logger import get_logger
+from backend.database import db, get_setting, subscribe, ResultCacheRecord
+from backend.blob_store import get_blob_store
+
+
+DEFAULT_MAX_MB = 512
+URL_TTL = 24 * 3600  # URL 结果的有效期（秒）
+BATCH_SIZE = 500
+
+
+def make_key(
+    kind: str,
+    prompt: str,
+    model: str,
+    mode: str,
+    images: Iterable[str] = (),
+    paths: Iterable[str] = (),
+    handles: Iterable[str] = (),
+) -> str:
+    """
+    计算规范化请求的缓存键
+    - 提示词去掉首尾空白并合并连续空白
+    - images: 参考图 base64；paths: 参考图文件路径（按路径 + 大小 + 修改时间区分，避免读取文件）
+    - handles: 已上传参考图的句柄（即内容哈希）
+    """
+    refs = [hashlib.sha256(b64.encode("ascii", "ignore")).hexdigest() for b64 in images if b64]
+    refs.extend(h for h in handles if h)
+    for path in paths:
+        if not path:
+            continue
+        try:
+            st = os.stat(path)
+            refs.append(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            refs.append(os.path.abspath(path))
+    normalized = {
+        "kind": kind,
+        "prompt": " ".join(prompt.split()),
+        "model": model,
+        "mode": mode,
+        "refs": refs,
+    }
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def is_enabled() -> bool:
+    return get_setting("result_cache_enabled") == "true"
+
+
+class ResultCache:
+    """结果缓存索引（线程安全）"""
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max(0, max_bytes)
+        self._lock = threading.Lock()
+        self._total = ResultCacheRecord.select(fn.COALESCE(fn.SUM(ResultCacheRecord.size), 0)).scalar() or 0
+        self._hits = 0
+        self._misses = 0
+
+    # ===================== 查询 =====================
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        """批量查询，返回命中的 {key: 结果字段}，并刷新命中项的最近使用时间"""
+        keys = list(dict.fromkeys(k for k in keys if k))
+        if not keys:
+            return {}
+        now = time.time()
+        hits: dict[str, dict] = {}
+        stale: list[str] = []
+        blobs = get_blob_store()
+        for part in chunked(keys, BATCH_SIZE):
+            for record in ResultCacheRecord.select().where(ResultCacheRecord.key.in_(part)):
+                result = json.loads(record.data)
+                blob_hash = result.get("result_blob")
+                if blob_hash:
+                    valid = blobs.touch(blob_hash)
+                else:
+                    valid = now - record.created_at < URL_TTL
+                if valid:
+                    hits[record.key] = result
+                else:
+                    stale.append(record.key)
+
+        with db.atomic():
+            for part in chunked(list(hits), BATCH_SIZE):
+                ResultCacheRecord.update(used_at=now).where(ResultCacheRecord.key.in_(part)).execute()
+        if stale:
+            self._delete(stale)
+        with self._lock:
+            self._hits += len(hits)
+            self._misses += len(keys) - len(hits)
+        return hits
+
+    def get(self, key: str) -> dict | None:
+        return self.get_many([key]).get(key)
+
+    # ===================== 写入与淘汰 =====================
+
+    def put(self, key: str, kind: str, result: dict, size: int = 0):
+        """记录生成结果（size 为结果文件大小，URL 结果按记录本身大小计）"""
+        data = json.dumps(result, ensure_ascii=False)
+        size = size or len(data)
+        now = time.time()
+        with self._lock:
+            old = ResultCacheRecord.get_or_none(ResultCacheRecord.key == key)
+            ResultCacheRecord.replace(
+                key=key, kind=kind, data=data, size=size, created_at=now, used_at=now
+            ).execute()
+            self._total += size - (old.size if old else 0)
+            self._evict_locked()
+
+    def set_max_bytes(self, max_bytes: int):
+        with self._lock:
+            self._max_bytes = max(0, max_bytes)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        """淘汰最久未命中的记录直到总大小不超过上限"""
+        if not self._max_bytes:
+            return
+        evicted = 0
+        while self._total > self._max_bytes:
+            records = list(
+                ResultCacheRecord.select(ResultCacheRecord.key, ResultCacheRecord.size)
+                .order_by(ResultCacheRecord.used_at)
+                .limit(BATCH_SIZE)
+            )
+            if not records:
+                self._total = 0
+                break
+            doomed = []
+            for record in records:
+                if self._total <= self._max_bytes:
+                    break
+                doomed.append(record.key)
+                self._total -= record.size
+            ResultCacheRecord.delete().where(ResultCacheRecord.key.in_(doomed)).execute()
+            evicted += len(doomed)
+        if evicted:
+            get_logger().info("结果缓存超出上限, 已淘汰 %d 条", evicted)
+
+    def _delete(self, keys: list[str]):
+        with self._lock, db.atomic():
+            for part in chunked(keys, BATCH_SIZE):
+                removed = ResultCacheRecord.select(fn.COALESCE(fn.SUM(ResultCacheRecord.size), 0)).where(
+                    ResultCacheRecord.key.in_(part)
+                ).scalar() or 0
+                ResultCacheRecord.delete().where(ResultCacheRecord.key.in_(part)).execute()
+                self._total -= removed
+
+    def clear(self) -> int:
+        """清空缓存索引（不删除结果文件），返回清除条数"""
+        with self._lock:
+            count = ResultCacheRecord.delete().execute()
+            self._total = 0
+        get_logger().info("已清空结果缓存: %d 条", count)
+        return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": is_enabled(),
+                "count": ResultCacheRecord.select().count(),
+                "total_bytes": self._total,
+                "max_bytes": self._max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+_cache: ResultCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_max_bytes() -> int:
+    """读取设置中的缓存上限（MB），0 表示不限制"""
+    try:
+        return max(0, int(get_setting("result_cache_max_mb") or DEFAULT_MAX_MB)) * 1024 * 1024
+    except (ValueError, TypeError):
+        return DEFAULT_MAX_MB * 1024 * 1024
+
+
+def get_result_cache() -> ResultCache:
+    """获取全局结果缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(get_max_bytes())
+        return _cache
+
+
+def _on_max_changed(key: str, value: str):
+    with _cache_lock:
+        cache = _cache
+    if cache is not None:
+        cache.set_max_bytes(get_max_bytes())
+
+
+subscribe(_on_max_changed, ("result_cache_max_mb",))
@@ -0,0 +1,72 @@
+"""
+HeTangAI 自动重试策略
+- 按任务类型（image / video）配置：最大尝试次数、指数退避（带全抖动）、可重试的错误类型与 HTTP 状态码
+- 配置来自 retry_policy 设置（JSON），未配置的字段使用默认值
+- 429/503 带 Retry-After 时，退避时间不短于 Retry-After
+"""
+
+import json
+import random
+import asyncio
+from typing import NamedTuple
+
+from backend import http_client
+from backend.logger import get_logger
+from backend.database import get_setting
+from backend.rate_limiter import parse_retry_after
+
+
+class RetryPolicy(NamedTuple):
+    max_attempts: int = 3  # 含首次执行
+    base_delay: float = 2.0  # 秒，第 n 次重试的退避上限为 base_delay * 2^(n-1)
+    max_delay: float = 60.0
+    statuses: tuple[int, ...] = (429, 500, 502, 503, 504)
+    timeout: bool = True  # 请求超时
+    connect: bool = True  # 连接失败 / 传输中断
+
+    def reason(self, exc: BaseException | None) -> str:
+        """返回可重试的原因（如 "timeout"、"http_503"），不可重试返回空串"""
+        if isinstance(exc, asyncio.TimeoutError):
+            return "timeout" if self.timeout else ""
+        if isinstance(exc, (http_client.ConnectError, ConnectionError)):
+            return "connect" if self.connect else ""
+        if isinstance(exc, http_client.HTTPStatusError):
+            return f"http_{exc.status}" if exc.status in self.statuses else ""
+        return ""
+
+    def delay(self, retry: int, exc: BaseException | None = None) -> float:
+        """第 retry 次重试（从 1 开始）前的等待秒数：指数退避 + 全抖动"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (retry - 1))
+        delay = random.uniform(0, ceiling)
+        if isinstance(exc, http_client.HTTPStatusError):
+            retry_after = parse_retry_after(exc.headers.get("retry-after"))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+        return delay
+
+
+DEFAULT_POLICIES = {
+    "image": RetryPolicy(),
+    "video": RetryPolicy(max_attempts=3, base_delay=5.0, max_delay=120.0),
+}
+
+
+def get_retry_policy(kind: str) -> RetryPolicy:
+    """
+    读取任务类型对应的重试策略，retry_policy 设置示例:
+    {"image": {"max_attempts": 5, "statuses": [429, 503]}, "video": {"max_attempts": 1}}
+    """
+    default = DEFAULT_POLICIES.get(kind, RetryPolicy())
+    text = get_setting("retry_policy")
+    if not text:
+        return default
+    try:
+        overrides = json.loads(text).get(kind) or {}
+        fields = {k: v for k, v in overrides.items() if k in RetryPolicy._fields}
+        if "statuses" in fields:
+            fields["statuses"] = tuple(int(s) for s in fields["statuses"])
+        policy = default._replace(**fields)
+        return policy._replace(max_attempts=max(1, int(policy.max_attempts)))
+    except (ValueError, TypeError, AttributeError) as e:
+        get_logger().warning("重试策略配置无效，使用默认值: %s", e)
+        return default
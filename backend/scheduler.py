@@ -0,0 +1,221 @@
+"""
+HeTangAI 任务调度器
+- 排队中的任务按优先级（高者先）+ 入队顺序调度，排队期间可调整优先级或插队
+- 总并发上限之外，可按模型 / 模式设置并发上限（如 "veo_3_1_*": 2），
+  被上限挡住的任务不会阻塞后面其他模型的任务
+- 名额的分配与释放只在事件循环线程中进行；调整优先级、查询排队位置可在任意线程调用
+"""
+
+import json
+import asyncio
+import bisect
+import itertools
+import threading
+from fnmatch import fnmatchcase
+from contextlib import asynccontextmanager
+
+from backend.logger import get_logger
+from backend.database import get_setting
+
+
+class _Entry:
+    __slots__ = ("task_id", "priority", "seq", "groups", "future")
+
+    def __init__(self, task_id: str, priority: int, seq: int, groups: tuple[str, ...], future: asyncio.Future):
+        self.task_id = task_id
+        self.priority = priority
+        self.seq = seq
+        self.groups = groups
+        self.future = future
+
+    @property
+    def key(self) -> tuple[int, int, str]:
+        return (-self.priority, self.seq, self.task_id)
+
+
+def parse_caps(text: str) -> dict[str, int]:
+    """
+    解析并发上限配置（JSON 对象）
+    - 键为模型名通配符（如 "veo_3_1_*"、"*-4k"），或 "mode:<模式>"（如 "mode:img2img"）
+    - 值为该组的并发上限
+    """
+    if not text:
+        return {}
+    try:
+        raw = json.loads(text)
+    except ValueError:
+        get_logger().warning("并发上限配置不是合法的 JSON，已忽略: %s", text)
+        return {}
+    caps = {}
+    if isinstance(raw, dict):
+        for rule, limit in raw.items():
+            try:
+                caps[str(rule)] = max(1, int(limit))
+            except (TypeError, ValueError):
+                continue
+    return caps
+
+
+def get_caps() -> dict[str, int]:
+    """读取设置中的按模型 / 模式并发上限"""
+    return parse_caps(get_setting("concurrency_caps"))
+
+
+class TaskScheduler:
+    """带优先级和分组并发上限的任务调度器"""
+
+    def __init__(self, limit: int, caps: dict[str, int] | None = None):
+        self._limit = max(1, limit)
+        self._caps = dict(caps or {})
+        self._lock = threading.Lock()
+        self._order: list[tuple[int, int, str]] = []  # 排队顺序（有序），元素为 _Entry.key
+        self._waiting: dict[str, _Entry] = {}  # task_id -> 排队项
+        self._active = 0
+        self._group_active: dict[str, int] = {}  # 分组 -> 运行中数量
+        self._seq = itertools.count()
+        self._front_seq = itertools.count(-1, -1)  # 插队用的递减序号
+
+    # ===================== 配置 =====================
+
+    def set_limit(self, limit: int):
+        """调整总并发上限（在事件循环线程中调用）"""
+        with self._lock:
+            self._limit = max(1, limit)
+        self._dispatch()
+
+    def set_caps(self, caps: dict[str, int]):
+        """调整分组并发上限（在事件循环线程中调用），任务所属分组在入队时确定"""
+        with self._lock:
+            self._caps = dict(caps)
+        self._dispatch()
+
+    def _groups(self, model: str, mode: str) -> tuple[str, ...]:
+        groups = []
+        for rule in self._caps:
+            if rule.startswith("mode:"):
+                if rule[5:] == mode:
+                    groups.append(rule)
+            elif fnmatchcase(model, rule):
+                groups.append(rule)
+        return tuple(groups)
+
+    # ===================== 分配与释放 =====================
+
+    @asynccontextmanager
+    async def slot(self, task_id: str, model: str, mode: str, priority: int = 0):
+        """排队等待名额，拿到后执行 async with 块，结束时释放"""
+        groups = await self._acquire(task_id, model, mode, priority)
+        try:
+            yield
+        finally:
+            self._release(groups)
+
+    async def _acquire(self, task_id: str, model: str, mode: str, priority: int) -> tuple[str, ...]:
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            old = self._waiting.get(task_id)
+            if old is not None:
+                # 同一任务被取消后立即重试，旧协程尚未处理取消：直接移除旧的排队项
+                self._remove_locked(old)
+            entry = _Entry(task_id, priority, next(self._seq), self._groups(model, mode), future)
+            self._waiting[task_id] = entry
+            bisect.insort(self._order, entry.key)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = future.done() and not future.cancelled()
+                if not granted and self._waiting.get(task_id) is entry:
+                    self._remove_locked(entry)
+            if granted:
+                # 已分配名额但在唤醒前取消，归还名额
+                self._release(entry.groups)
+            raise
+        return entry.groups
+
+    def _release(self, groups: tuple[str, ...]):
+        with self._lock:
+            self._active -= 1
+            for group in groups:
+                self._group_active[group] -= 1
+        self._dispatch()
+
+    def _remove_locked(self, entry: _Entry):
+        del self._waiting[entry.task_id]
+        idx = bisect.bisect_left(self._order, entry.key)
+        del self._order[idx]
+
+    def _dispatch(self):
+        """按排队顺序分配空闲名额，跳过被分组上限挡住的任务"""
+        granted = []
+        with self._lock:
+            idx = 0
+            while self._active < self._limit and idx < len(self._order):
+                entry = self._waiting[self._order[idx][2]]
+                if entry.future.done() or any(
+                    self._group_active.get(g, 0) >= self._caps.get(g, self._limit) for g in entry.groups
+                ):
+                    idx += 1
+                    continue
+                del self._order[idx]
+                del self._waiting[entry.task_id]
+                self._active += 1
+                for group in entry.groups:
+                    self._group_active[group] = self._group_active.get(group, 0) + 1
+                granted.append(entry.future)
+        for future in granted:
+            future.set_result(None)
+
+    # ===================== 排队调整（任意线程） =====================
+
+    def set_priority(self, task_id: str, priority: int) -> bool:
+        """调整排队中任务的优先级，任务不在排队中时返回 False"""
+        with self._lock:
+            entry = self._waiting.get(task_id)
+            if entry is None:
+                return False
+            self._remove_locked(entry)
+            entry.priority = priority
+            self._waiting[task_id] = entry
+            bisect.insort(self._order, entry.key)
+            return True
+
+    def move_to_front(self, task_id: str) -> int | None:
+        """把排队中的任务移到队首（优先级提到当前最高），返回新的优先级，任务不在排队中时返回 None"""
+        with self._lock:
+            entry = self._waiting.get(task_id)
+            if entry is None:
+                return None
+            top = -self._order[0][0]
+            self._remove_locked(entry)
+            entry.priority = max(entry.priority, top)
+            entry.seq = next(self._front_seq)
+            self._waiting[task_id] = entry
+            bisect.insort(self._order, entry.key)
+            return entry.priority
+
+    def position(self, task_id: str) -> int:
+        """排队位置（从 1 开始），不在排队中返回 0"""
+        with self._lock:
+            entry = self._waiting.get(task_id)
+            if entry is None:
+                return 0
+            return bisect.bisect_left(self._order, entry.key) + 1
+
+    def positions(self) -> dict[str, int]:
+        """所有排队中任务的排队位置"""
+        with self._lock:
+            return {key[2]: i + 1 for i, key in enumerate(self._order)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self._limit,
+                "active": self._active,
+                "waiting": len(self._order),
+                "groups": {
+                    group: {"limit": cap, "active": self._group_active.get(group, 0)}
+                    for group, cap in self._caps.items()
+                },
+            }
@@ -0,0 +1,486 @@
+"""
+HeTangAI 本地 HTTP 服务（REST + SSE）
+- 把 Api 的方法以 JSON 接口暴露出来，多个脚本 / 客户端可共用同一个后端（同一套并发、限流和缓存）
+  POST /api/<方法名>  请求体为参数对象（按参数名）或数组（按位置），返回 {"ok": true, "result": ...}
+  GET  /api           可调用的方法列表
+  GET  /events        SSE 任务更新流：event 为 image / video，data 为与前端回调相同的更新 JSON
+  GET  /health        服务状态
+  GET  /metrics       运行指标（Prometheus 文本格式，内容同 get_metrics）
+- 请求需带 Authorization: Bearer <令牌>（EventSource 等无法设置请求头时可用 ?token=），
+  开启服务时未设置令牌会自动生成随机令牌并保存到设置
+- 防止网页跨站调用：POST 必须是 Content-Type: application/json；Host / Origin 必须是本机地址
+  （监听局域网地址时也允许 IP 形式的 Host / Origin，域名只允许 localhost，可防 DNS 重绑定）
+- 每个 SSE 客户端一个有界队列，跟不上推送的客户端会被断开，重连后用 get_tasks_changed_since 补齐
+- 桌面版在设置中开启后随窗口启动；也可无界面单独运行: python -m backend.server [--host] [--port] [--token]
+"""
+
+import sys
+import hmac
+import json
+import queue
+import signal
+import secrets
+import ipaddress
+import inspect
+import argparse
+import threading
+import multiprocessing
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from backend.logger import get_logger
+from backend.database import get_setting, set_setting, subscribe
+from backend.update_dispatcher import get_dispatcher
+from backend.metrics import render_prometheus
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY = 64 * 1024 * 1024  # 请求体上限（参考图以 base64 提交）
+CLIENT_QUEUE_SIZE = 2000  # 每个 SSE 客户端最多积压的更新条数
+PING_INTERVAL = 15  # SSE 心跳间隔（秒），空闲时保持连接
+TOKEN_BYTES = 24  # 自动生成的令牌长度
+
+EVENT_NAMES = {"__onTaskUpdate": "image", "__onVideoTaskUpdate": "video"}
+
+# 需要窗口（文件对话框）或在本机打开浏览器的方法不对外提供
+EXCLUDED_METHODS = {
+    "set_window",
+    "open_external_url",
+    "import_image_tasks",
+    "import_video_tasks",
+    "select_download_path",
+    "save_task_image",
+    "save_task_video",
+}
+SECRET_SETTINGS = ("api_key", "api_server_token")  # 读取设置时隐藏
+SERVER_SETTINGS = ("api_server_enabled", "api_server_host", "api_server_port", "api_server_token")
+PROTECTED_SETTINGS = (*SERVER_SETTINGS, "api_base")  # 只能在桌面端修改（api_base 会把 API Key 发往该地址）
+
+
+class _Client:
+    def __init__(self):
+        self.queue: queue.Queue[bytes] = queue.Queue(CLIENT_QUEUE_SIZE)
+        self.closed = False
+
+
+class EventHub:
+    """把推送调度器的任务更新分发给所有 SSE 客户端"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: set[_Client] = set()
+        self._sent = 0
+        self._kicked = 0
+
+    def connect(self) -> _Client:
+        client = _Client()
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def disconnect(self, client: _Client):
+        client.closed = True
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, callback: str, data: dict):
+        """推送调度器监听器（在推送线程中调用，不阻塞）"""
+        with self._lock:
+            clients = list(self._clients)
+        if not clients:
+            return
+        event = EVENT_NAMES.get(callback, callback)
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        for client in clients:
+            try:
+                client.queue.put_nowait(payload)
+            except queue.Full:
+                self.disconnect(client)
+                with self._lock:
+                    self._kicked += 1
+                get_logger().warning("SSE 客户端推送积压过多，已断开")
+        with self._lock:
+            self._sent += 1
+
+    def close_all(self):
+        """断开全部客户端（服务停止时调用）"""
+        with self._lock:
+            clients, self._clients = self._clients, set()
+        for client in clients:
+            client.closed = True
+            try:
+                client.queue.put_nowait(b"")  # 唤醒等待中的处理线程
+            except queue.Full:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"clients": len(self._clients), "events": self._sent, "kicked": self._kicked}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # REST 请求复用连接
+    server: "ApiServer"
+
+    # ===================== 路由 =====================
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not self._allowed_origin() or not self._authorized(url.query):
+            return
+        if url.path == "/events":
+            self._stream_events()
+        elif url.path == "/api":
+            self._send_json(HTTPStatus.OK, {"ok": True, "result": sorted(self.server.methods)})
+        elif url.path == "/health":
+            self._send_json(HTTPStatus.OK, {"ok": True, "result": self.server.stats()})
+        elif url.path == "/metrics":
+            self._send_text(HTTPStatus.OK, render_prometheus(self.server.methods["get_metrics"]()))
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "接口不存在")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if not self._allowed_origin() or not self._authorized(url.query):
+            return
+        # 网页无需预检即可跨站提交的只有表单 / 纯文本类型，只接受 JSON 即可拒绝这类请求
+        if self.headers.get_content_type() != "application/json":
+            self._send_error(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Content-Type 必须为 application/json")
+            return
+        name = url.path[len("/api/"):] if url.path.startswith("/api/") else ""
+        method = self.server.methods.get(name)
+        if method is None:
+            self._send_error(HTTPStatus.NOT_FOUND, f"方法不存在: {name}")
+            return
+        try:
+            args, kwargs = self._read_params()
+        except ValueError as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        if name == "set_setting" and (kwargs.get("key") or (args[:1] or [""])[0]) in PROTECTED_SETTINGS:
+            self._send_error(HTTPStatus.FORBIDDEN, "该设置只能在桌面端修改")
+            return
+        try:
+            inspect.signature(method).bind(*args, **kwargs)
+        except TypeError as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, f"参数错误: {e}")
+            return
+        try:
+            result = _redact(name, method(*args, **kwargs))
+        except Exception as e:
+            get_logger().error("本地服务调用 %s 失败: %s", name, e)
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+            return
+        self._send_json(HTTPStatus.OK, {"ok": True, "result": result})
+
+    # ===================== 请求处理 =====================
+
+    def _allowed_origin(self) -> bool:
+        """Host / Origin 必须指向本服务（拒绝网页跨站请求和 DNS 重绑定）"""
+        host = urlsplit("//" + self.headers.get("Host", "")).hostname
+        origin = self.headers.get("Origin")
+        if self.server.host_allowed(host) and (
+            origin is None or self.server.host_allowed(urlsplit(origin).hostname)
+        ):
+            return True
+        self._send_error(HTTPStatus.FORBIDDEN, "不允许的 Host 或 Origin")
+        return False
+
+    def _authorized(self, query: str) -> bool:
+        token = self.server.token
+        if not token:
+            return True
+        given = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not given:
+            given = (parse_qs(query).get("token") or [""])[0]
+        if hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8")):
+            return True
+        self._send_error(HTTPStatus.UNAUTHORIZED, "令牌无效")
+        return False
+
+    def _read_params(self) -> tuple[list, dict]:
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise ValueError("Content-Length 无效") from None
+        if length > MAX_BODY:
+            self.close_connection = True
+            raise ValueError("请求体过大")
+        if not length:
+            return [], {}
+        try:
+            params = json.loads(self.rfile.read(length))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"JSON 解析失败: {e}") from None
+        if isinstance(params, list):
+            return params, {}
+        if isinstance(params, dict):
+            return [], params
+        raise ValueError("请求体应为 JSON 对象或数组")
+
+    def _send_json(self, status: HTTPStatus, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, status: HTTPStatus, text: str):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: HTTPStatus, message: str):
+        self.close_connection = True  # 请求体可能未读取，不再复用连接
+        self._send_json(status, {"ok": False, "error": message})
+
+    def _stream_events(self):
+        """SSE 长连接：阻塞在本连接的处理线程中，直到客户端断开或被踢出"""
+        self.close_connection = True
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        hub = self.server.hub
+        client = hub.connect()
+        try:
+            self.wfile.write(b": connected\n\n")
+            self.wfile.flush()
+            while not client.closed and not self.server.closing:
+                try:
+                    chunks = [client.queue.get(timeout=PING_INTERVAL)]
+                except queue.Empty:
+                    chunks = [b": ping\n\n"]
+                # 一次写出已积压的全部更新
+                while True:
+                    try:
+                        chunks.append(client.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self.wfile.write(b"".join(chunks))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            hub.disconnect(client)
+
+    def log_message(self, format, *args):
+        get_logger().debug("本地服务 %s - %s", self.address_string(), format % args)
+
+
+def _redact(name: str, result):
+    """读取设置时隐藏密钥（只显示是否已设置）"""
+    if name == "get_all_settings" and isinstance(result, dict):
+        return {k: ("******" if v and k in SECRET_SETTINGS else v) for k, v in result.items()}
+    return result
+
+
+def _redact_setting(api, key: str) -> str:
+    value = api.get_setting(key)
+    return "******" if value and key in SECRET_SETTINGS else value
+
+
+class ApiServer(ThreadingHTTPServer):
+    """在后台线程中运行的 HTTP 服务，每个连接一个线程"""
+
+    daemon_threads = True
+    request_queue_size = 128  # 多个客户端同时连接（压测）时不被拒绝
+
+    def __init__(self, api, host: str, port: int, token: str = ""):
+        super().__init__((host, port), _Handler)
+        self.token = token
+        self.closing = False
+        self.methods = _public_methods(api)
+        self.hub = EventHub()
+        get_dispatcher().add_listener(self.hub.publish)
+        self._thread = threading.Thread(target=self.serve_forever, name="hetangai-server", daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def host_allowed(self, host: str | None) -> bool:
+        """本机地址总是允许；监听非本机地址（局域网访问）时也允许任意 IP，域名只允许 localhost"""
+        if not host:
+            return False
+        if host.lower() == "localhost":
+            return True
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return ip.is_loopback or not _is_loopback(self.server_address[0])
+
+    def start(self):
+        self._thread.start()
+        get_logger().info("本地服务已启动: %s", self.address)
+        if not _is_loopback(self.server_address[0]) and not self.token:
+            get_logger().warning("本地服务监听 %s 且未设置令牌，局域网内任何人都可以调用", self.server_address[0])
+
+    def stats(self) -> dict:
+        return {"address": self.address, **self.hub.stats()}
+
+    def close(self):
+        """停止接受请求并断开 SSE 客户端"""
+        self.closing = True
+        get_dispatcher().remove_listener(self.hub.publish)
+        self.hub.close_all()
+        self.shutdown()
+        self.server_close()
+        get_logger().info("本地服务已停止")
+
+
+def _is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host.lower() == "localhost"
+
+
+def _public_methods(api) -> dict:
+    methods = {
+        name: getattr(api, name)
+        for name in dir(api)
+        if not name.startswith("_") and name not in EXCLUDED_METHODS and callable(getattr(api, name))
+    }
+    methods["get_setting"] = lambda key: _redact_setting(api, key)
+    return methods
+
+
+# ===================== 随桌面版启动 =====================
+
+_server: ApiServer | None = None
+_server_api = None
+_server_lock = threading.Lock()
+
+
+def _start_locked():
+    global _server
+    if get_setting("api_server_enabled") != "true":
+        return
+    host = get_setting("api_server_host") or DEFAULT_HOST
+    try:
+        port = int(get_setting("api_server_port") or DEFAULT_PORT)
+        server = ApiServer(_server_api, host, port, get_setting("api_server_token"))
+    except (OSError, ValueError, OverflowError) as e:
+        get_logger().error("本地服务启动失败: %s", e)
+        return
+    server.start()
+    _server = server
+
+
+def ensure_token() -> str:
+    """返回本地服务令牌，未设置时生成随机令牌并保存到设置"""
+    token = get_setting("api_server_token")
+    if not token:
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        set_setting("api_server_token", token)
+        get_logger().info("已生成本地服务访问令牌（见设置）")
+    return token
+
+
+def start_configured_server(api):
+    """按设置启动本地服务（未开启时不启动），之后修改服务设置会自动重启"""
+    global _server_api
+    if get_setting("api_server_enabled") == "true":
+        ensure_token()  # 在加锁前生成：保存令牌会同步触发设置回调
+    with _server_lock:
+        _server_api = api
+        _start_locked()
+
+
+def stop_server():
+    """停止本地服务"""
+    global _server, _server_api
+    with _server_lock:
+        _server_api = None
+        if _server is not None:
+            _server.close()
+            _server = None
+
+
+def _on_server_settings_changed(key: str, value: str):
+    global _server
+    if _server_api is not None and get_setting("api_server_enabled") == "true" and not get_setting("api_server_token"):
+        ensure_token()  # 保存令牌会再次触发本回调，由该次调用重启服务
+        return
+    with _server_lock:
+        if _server_api is None:
+            return
+        if _server is not None:
+            _server.close()
+            _server = None
+        _start_locked()
+
+
+subscribe(_on_server_settings_changed, SERVER_SETTINGS)
+
+
+# ===================== 无界面运行 =====================
+
+
+def main(argv: list[str] | None = None) -> int:
+    from backend.logger import setup_logger
+    from backend.database import init_db, close_thread_connection
+    from backend.engine import shutdown_engine
+    from backend.update_dispatcher import shutdown_dispatcher
+    from backend.download_queue import shutdown_download_queue
+    from backend.task_manager import TaskManager
+    from backend.video_task_manager import VideoTaskManager
+    from backend.api import Api
+
+    parser = argparse.ArgumentParser(prog="python -m backend.server", description="荷塘AI生成器 本地 HTTP 服务")
+    parser.add_argument("--host", default="", help=f"监听地址（默认取设置，{DEFAULT_HOST}）")
+    parser.add_argument("--port", type=int, default=0, help=f"监听端口（默认取设置，{DEFAULT_PORT}）")
+    parser.add_argument("--token", default="", help="访问令牌（默认取设置）")
+    parser.add_argument("--db", default="", help="数据库文件路径（默认与桌面版共用）")
+    args = parser.parse_args(argv)
+
+    setup_logger()
+    init_db(args.db or None)
+    task_manager = TaskManager()
+    video_task_manager = VideoTaskManager()
+    api = Api(task_manager, video_task_manager)
+
+    host = args.host or get_setting("api_server_host") or DEFAULT_HOST
+    try:
+        port = args.port or int(get_setting("api_server_port") or DEFAULT_PORT)
+        token = args.token or get_setting("api_server_token")
+        if not token:
+            token = ensure_token()
+            print(f"已生成访问令牌（保存在设置 api_server_token）: {token}", file=sys.stderr)
+        server = ApiServer(api, host, port, token)
+    except (OSError, ValueError) as e:
+        print(f"本地服务启动失败: {e}", file=sys.stderr)
+        return 1
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    server.start()
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        task_manager.shutdown()
+        video_task_manager.shutdown()
+        shutdown_download_queue()
+        shutdown_dispatcher()
+        shutdown_engine()
+        close_thread_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
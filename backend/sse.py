@@ -0,0 +1,179 @@
+"""
+HeTangAI SSE 解析
+- SSEParser: 基于原始字节的增量 SSE 解析器，按规范处理多行 data:、注释行、CR/LF/CRLF 换行
+- ContentAccumulator: 分块累积文本，最后一次性拼接，避免 += 的二次方开销
+- ChatStream: 解析 OpenAI 兼容的 chat.completion.chunk 流，两个任务管理器共用
+"""
+
+import json
+from typing import NamedTuple
+
+
+class SSEEvent(NamedTuple):
+    event: str
+    data: str
+    id: str
+
+
+class SSEParser:
+    """
+    增量 SSE 解析器，feed() 接收任意切分的字节块，返回已完整的事件
+    - 多个 data: 行以 "\\n" 连接（SSE 规范）
+    - 兼容上游把超长 data 拆成不带 "data:" 前缀的续行：续行直接拼接到上一行
+    - 长行只扫描新到达的字节，解析开销与数据量成线性
+    """
+
+    _FIELDS = (b"data", b"event", b"id", b"retry")
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._scan_from = 0
+        self._data: list[list[bytes]] = []  # 每条 data 行（含续行片段）
+        self._event = ""
+        self._id = ""
+        self._skip_lf = False
+
+    def feed(self, chunk: bytes) -> list[SSEEvent]:
+        if not chunk:
+            return []
+        buf = self._buf
+        if self._skip_lf:
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        buf += chunk
+
+        events: list[SSEEvent] = []
+        start = 0
+        pos = self._scan_from
+        end = len(buf)
+        while pos < end:
+            lf = buf.find(b"\n", pos)
+            cr = buf.find(b"\r", pos, lf if lf != -1 else end)
+            if cr != -1:
+                nl, width = cr, 1
+                if cr + 1 < end and buf[cr + 1] == 0x0A:
+                    width = 2
+                elif cr + 1 == end:
+                    # CR 在块末尾，下一块开头的 LF 属于同一个换行
+                    self._skip_lf = True
+            elif lf != -1:
+                nl, width = lf, 1
+            else:
+                break
+            event = self._process_line(bytes(buf[start:nl]))
+            if event is not None:
+                events.append(event)
+            start = pos = nl + width
+
+        if start:
+            del buf[:start]
+        self._scan_from = len(buf)
+        return events
+
+    def flush(self) -> list[SSEEvent]:
+        """流结束时调用，处理末尾未以空行结束的事件"""
+        events: list[SSEEvent] = []
+        if self._buf:
+            event = self._process_line(bytes(self._buf))
+            self._buf.clear()
+            self._scan_from = 0
+            if event is not None:
+                events.append(event)
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _process_line(self, line: bytes) -> SSEEvent | None:
+        if not line:
+            return self._dispatch()
+        if line[:1] == b":":
+            return None
+
+        name, sep, value = line.partition(b":")
+        if sep and name in self._FIELDS:
+            if value[:1] == b" ":
+                value = value[1:]
+            if name == b"data":
+                self._data.append([value])
+            elif name == b"event":
+                self._event = value.decode("utf-8", errors="replace")
+            elif name == b"id":
+                self._id = value.decode("utf-8", errors="replace")
+        elif self._data:
+            # 非规范续行：拼接到上一条 data
+            self._data[-1].append(line)
+        return None
+
+    def _dispatch(self) -> SSEEvent | None:
+        if not self._data:
+            self._event = ""
+            return None
+        data = b"\n".join(b"".join(parts) for parts in self._data).decode("utf-8", errors="replace")
+        event = SSEEvent(self._event or "message", data, self._id)
+        self._data = []
+        self._event = ""
+        return event
+
+
+class ContentAccumulator:
+    """分块累积字符串，getvalue() 时一次性拼接并缓存"""
+
+    def __init__(self):
+        self._parts: list[str] = []
+        self._size = 0
+
+    def append(self, text: str):
+        if text:
+            self._parts.append(text)
+            self._size += len(text)
+
+    def getvalue(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class ChatStream:
+    """
+    解析 chat.completion.chunk SSE 流
+    feed() 返回本次新增的 reasoning_content 文本（已 strip，去掉空行），
+    content 片段累积在 self.content 中；收到 [DONE] 后 self.done 为 True
+    """
+
+    def __init__(self):
+        self._parser = SSEParser()
+        self.content = ContentAccumulator()
+        self.done = False
+
+    def feed(self, chunk: bytes) -> list[str]:
+        return self._handle(self._parser.feed(chunk))
+
+    def close(self) -> list[str]:
+        return self._handle(self._parser.flush())
+
+    def _handle(self, events: list[SSEEvent]) -> list[str]:
+        progress: list[str] = []
+        for event in events:
+            if self.done:
+                break
+            data = event.data
+            if data.strip() == "[DONE]":
+                self.done = True
+                break
+            try:
+                delta = json.loads(data)["choices"][0]["delta"]
+            except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                continue
+
+            reasoning = delta.get("reasoning_content") or ""
+            text = reasoning.strip()
+            if text:
+                progress.append(text)
+
+            self.content.append(delta.get("content") or "")
+        return progress
@@ -1,98 +1,294 @@
 """
 HeTangAI 任务管理器
-- 使用 ThreadPoolExecutor 并发执行图片生成任务
+- 在共享异步引擎（单事件循环线程）上并发执行图片生成任务
 - 支持流式 SSE 解析、进度推送、自动下载
 """
 
-import json
 import re
 import time
 import base64
+import asyncio
 import threading
 from uuid import uuid4
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, Future
-
-import requests
-import webview
+from typing import TYPE_CHECKING
 
+from backend import http_client
 from backend.logger import get_logger
-from backend.database import get_setting
+from backend.database import get_setting, subscribe
+from backend.blob_store import get_blob_store
+from backend.batch_import import read_image_base64
+from backend.image_prep import get_preprocessor
+from backend.result_cache import get_result_cache, make_key as make_cache_key, is_enabled as is_result_cache_enabled
+from backend.downloader import download_resumable, write_file_atomic
+from backend.download_queue import get_download_queue, is_auto_download_enabled
+from backend.engine import get_engine, CancelToken
+from backend.scheduler import TaskScheduler, get_caps
+from backend.sse import ChatStream
+from backend.rate_limiter import get_upstream_limiter, OVERLOAD_STATUSES
+from backend.retry import get_retry_policy
+from backend.update_dispatcher import get_dispatcher
+from backend.metrics import get_metrics
+from backend.task_store import (
+    TaskStore,
+    ACTIVE_STATUSES,
+    FINISHED_STATUSES,
+    INTERRUPTED_ERROR,
+    MAX_PAGE_SIZE,
+    parse_statuses,
+)
+
+# 并发上限：任务在事件循环中以协程运行，不再占用线程，可远大于旧线程池
+MAX_CONCURRENCY = 200
+
+if TYPE_CHECKING:
+    import webview  # 只在有界面时使用，命令行运行不需要安装
 
 
 class TaskManager:
     """管理图片生成任务队列"""
 
-    def __init__(self):
-        self._window: webview.Window | None = None
-        self._tasks: dict[str, dict] = {}  # task_id -> task
-        self._task_order: list[str] = []    # 保持插入顺序
-        self._futures: dict[str, Future] = {}
+    def __init__(self, restore: bool = True):
+        self._tasks: dict[str, dict] = {}  # task_id -> 活跃任务（排队中/运行中），已结束的只在数据库中
+        self._tokens: dict[str, CancelToken] = {}  # task_id -> 取消令牌
+        self._result_pins: dict[str, str] = {}  # task_id -> 等待自动下载的结果 blob（下载结束前不淘汰）
         self._lock = threading.Lock()
-        self._pool: ThreadPoolExecutor | None = None
+        self._engine = get_engine()
+        self._dispatcher = get_dispatcher()
+        self._store = TaskStore("image")
+        self._blobs = get_blob_store()
+        self._cache = get_result_cache()
+        self._prep = get_preprocessor()
+        self._scheduler: TaskScheduler | None = None
         self._init_pool()
+        self._unsubscribe = subscribe(self._on_setting_changed, ("thread_pool_size", "concurrency_caps"))
+        if restore:  # 命令行运行时不恢复数据库中上次未结束的任务
+            self._restore_tasks()
 
-    def set_window(self, window: webview.Window):
-        self._window = window
+    def set_window(self, window: "webview.Window"):
+        self._dispatcher.set_window(window)
 
     def _init_pool(self):
-        """初始化线程池"""
+        """初始化任务调度器"""
         size = self._get_pool_size()
-        self._pool = ThreadPoolExecutor(max_workers=size)
-        get_logger().info("线程池已初始化, 线程数: %d", size)
+        self._scheduler = TaskScheduler(size, get_caps())
+        http_client.set_worker_count("image", size)
+        get_logger().info("任务并发已初始化, 并发数: %d", size)
 
     def _get_pool_size(self) -> int:
         try:
             size = int(get_setting("thread_pool_size") or "2")
-            return max(1, min(size, 10))
+            return max(1, min(size, MAX_CONCURRENCY))
         except (ValueError, TypeError):
             return 2
 
     def resize_pool(self):
-        """重新创建线程池（设置页修改线程数后调用）"""
-        old_pool = self._pool
-        self._pool = ThreadPoolExecutor(max_workers=self._get_pool_size())
-        get_logger().info("线程池已调整, 新线程数: %d", self._get_pool_size())
-        # 旧的池不 shutdown，让正在运行的任务自然完成
-        if old_pool:
-            old_pool.shutdown(wait=False)
+        """调整并发上限（设置页修改并发数后调用），排队中的任务立即按新上限调度"""
+        size = self._get_pool_size()
+        self._engine.call_soon(self._scheduler.set_limit, size)
+        http_client.set_worker_count("image", size)
+        get_logger().info("任务并发已调整, 新并发数: %d", size)
+
+    def update_caps(self):
+        """按设置重新加载按模型 / 模式的并发上限"""
+        self._engine.call_soon(self._scheduler.set_caps, get_caps())
+
+    def _on_setting_changed(self, key: str, value: str):
+        """配置变更回调：并发数、分组上限立即生效"""
+        if key == "concurrency_caps":
+            self.update_caps()
+        else:
+            self.resize_pool()
 
     # ===================== 任务操作 =====================
 
-    def add_task(self, prompt: str, model: str, mode: str, image_base64: str = "") -> dict:
-        """添加一个图片生成任务，返回任务摘要"""
-        task_id = str(uuid4())[:8]
-        task = {
-            "id": task_id,
+    def add_task(
+        self,
+        prompt: str,
+        model: str,
+        mode: str,
+        image_base64: str = "",
+        priority: int = 0,
+        use_cache: bool = True,
+        image_ref: str = "",
+    ) -> dict:
+        """
+        添加一个图片生成任务，返回任务摘要（priority 越大越先执行）
+        - 结果缓存开启且 use_cache 时，相同请求直接返回缓存结果（status 为 done、cached 为 True）
+        - image_ref: 已上传参考图的句柄（upload_reference_image 返回），与 image_base64 二选一
+        """
+        task = self._new_task(
+            prompt, model, mode, image_base64, priority=priority, use_cache=use_cache, image_ref=image_ref
+        )
+        task_id = task["id"]
+        self._store_inline_images([task])
+        cached = self._apply_cache([task])
+
+        with self._lock:
+            self._tasks[task_id] = task
+            self._pin_refs(task)
+            self._store.save(task)
+
+        if cached:
+            get_logger().info("任务命中结果缓存: %s - %s", task_id, prompt[:30])
+            self._finish_cached([task_id])
+        else:
+            get_logger().info("任务已添加: %s - %s", task_id, prompt[:30])
+            # 提交到异步引擎
+            self._submit(task_id)
+
+        return self._task_summary(task)
+
+    def add_tasks(self, specs: list[dict]) -> list[dict]:
+        """
+        批量添加图片生成任务（一次加锁、一次登记落库），返回任务简要信息列表
+        - specs: [{"prompt", "model", "mode", "image_base64" / "image_ref" / "image_path", "priority"}, ...]
+        """
+        tasks = [
+            self._new_task(
+                spec["prompt"],
+                spec["model"],
+                spec["mode"],
+                spec.get("image_base64", ""),
+                spec.get("image_path", ""),
+                spec.get("priority", 0),
+                spec.get("use_cache", True),
+                spec.get("image_ref", ""),
+            )
+            for spec in specs
+        ]
+        if not tasks:
+            return []
+        self._store_inline_images(tasks)
+        cached = {task["id"] for task in self._apply_cache(tasks)}
+
+        with self._lock:
+            for task in tasks:
+                self._tasks[task["id"]] = task
+                self._pin_refs(task)
+            self._store.save_many(tasks)
+
+        get_logger().info("批量添加任务: %d 个（命中结果缓存 %d 个）", len(tasks), len(cached))
+
+        self._submit_many([task["id"] for task in tasks if task["id"] not in cached])
+        if cached:
+            self._finish_cached(list(cached))
+
+        return [self._task_brief(task) for task in tasks]
+
+    @staticmethod
+    def _new_task(
+        prompt: str,
+        model: str,
+        mode: str,
+        image_base64: str = "",
+        image_path: str = "",
+        priority: int = 0,
+        use_cache: bool = True,
+        image_ref: str = "",
+    ) -> dict:
+        return {
+            "id": str(uuid4())[:8],
             "prompt": prompt,
             "model": model,
             "mode": mode,
             "image_base64": image_base64,
+            "image_path": image_path,  # 批量导入的参考图路径，执行时才读取
+            "image_ref": image_ref,  # 已上传参考图的 blob 哈希，执行时才读取
             "status": "pending",
+            "priority": int(priority),
+            "use_cache": bool(use_cache),  # False 时跳过结果缓存，总是重新生成
+            "cache_key": "",  # 结果缓存键（缓存开启时计算）
+            "cached": False,  # 结果是否来自缓存
+            "attempts": [],  # 每次执行的记录：开始/结束时间、错误、重试等待秒数
+            "retry_count": 0,  # 本轮已自动重试的次数（手动重试时清零）
             "progress": [],
-            "result_image": "",
-            "result_image_type": "",
+            "result_image": "",  # URL 结果直接保存地址；base64 结果解码后存入 blob_store
+            "result_image_type": "",  # "url" / "blob"（旧记录可能为 "base64"）
+            "result_blob": "",  # blob 哈希
+            "result_size": 0,
             "error": "",
             "created_at": time.time(),
             "file_path": "",
         }
 
-        with self._lock:
-            self._tasks[task_id] = task
-            self._task_order.append(task_id)
-
-        get_logger().info("任务已添加: %s - %s", task_id, prompt[:30])
-
-        # 提交到线程池
-        future = self._pool.submit(self._execute_task, task_id)
-        self._futures[task_id] = future
-
-        return self._task_summary(task)
+    def _store_inline_images(self, tasks: list[dict]):
+        """
+        直接提交的 base64 参考图写入结果存储，任务中只保留句柄（与上传的参考图相同），
+        任务记录不再携带数 MB 的 base64，失败后重试也从存储读取
+        """
+        for task in tasks:
+            for key in ("image",):
+                b64_data = task[f"{key}_base64"]
+                if not b64_data or task[f"{key}_ref"]:
+                    continue
+                try:
+                    task[f"{key}_ref"], _ = self._blobs.put_base64(b64_data)
+                except (ValueError, OSError) as e:
+                    get_logger().warning("[%s] 参考图写入存储失败，保留在任务中: %s", task["id"], e)
+                    continue
+                task[f"{key}_base64"] = ""
+
+    # ===================== 结果缓存 =====================
+
+    def _apply_cache(self, tasks: list[dict]) -> list[dict]:
+        """缓存开启时计算缓存键，允许使用缓存且命中的任务直接标记为完成，返回命中的任务"""
+        if not is_result_cache_enabled():
+            return []
+        for task in tasks:
+            task["cache_key"] = make_cache_key(
+                "image",
+                task["prompt"],
+                task["model"],
+                task["mode"],
+                [task["image_base64"]],
+                [task["image_path"]],
+                [task["image_ref"]],
+            )
+        hits = self._cache.get_many([task["cache_key"] for task in tasks if task["use_cache"]])
+        cached = []
+        for task in tasks:
+            result = hits.get(task["cache_key"]) if task["use_cache"] else None
+            if result:
+                task.update(result)
+                task["status"] = "done"
+                task["cached"] = True
+                task["image_base64"] = ""
+                cached.append(task)
+        return cached
+
+    def _finish_cached(self, task_ids: list[str]):
+        """命中缓存的任务：归档并推送完成，自动下载交给下载队列"""
+        for task_id in task_ids:
+            with self._lock:
+                task = self._tasks.get(task_id)
+            if not task:
+                continue
+            self._finish_task(task_id)
+            get_metrics().count("image", task["model"], "cached")
+            self._push_task_update(task_id, {
+                "type": "done",
+                "result_image": task["result_image"],
+                "result_image_type": task["result_image_type"],
+                "result_blob": task["result_blob"],
+                "result_size": task["result_size"],
+                "file_path": "",
+                "cached": True,
+            })
+            self._queue_download(task)
+
+    def _remember_result(self, key: str, result: dict, size: int):
+        """把生成结果写入缓存（阻塞，在 IO 线程池中调用）"""
+        try:
+            self._cache.put(key, "image", result, size)
+        except Exception as e:
+            get_logger().warning("写入结果缓存失败: %s", e)
 
     def get_all_tasks(self) -> list[dict]:
-        """获取所有任务摘要列表（不含 image_base64 大字段）"""
+        """获取所有任务摘要列表（不含 image_base64 大字段），活跃任务取内存中的最新状态"""
+        records = self._store.list()
         with self._lock:
-            return [self._task_summary(self._tasks[tid]) for tid in self._task_order if tid in self._tasks]
+            return [self._task_summary(self._tasks.get(t["id"], t)) for t in records]
 
     def get_task(self, task_id: str) -> dict:
         """获取单个任务详情"""
@@ -100,63 +296,209 @@ class TaskManager:
             task = self._tasks.get(task_id)
             if task:
                 return self._task_summary(task)
-            return {}
+        task = self._store.get(task_id)
+        return self._task_summary(task) if task else {}
+
+    def list_tasks(self, limit: int = 100, after: str = "", status: str | list[str] = "") -> dict:
+        """
+        分页获取任务摘要（按创建时间排序，进度只带最后一条）
+        - after: 上一页返回的 next 游标，首页传空串
+        - status: 状态过滤，逗号分隔的字符串或列表
+        返回: {"tasks": [...], "next": 下一页游标（没有时为空串）, "version": 当前版本号}
+        """
+        version = self._store.version
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        records, cursor = self._store.page(limit, after, parse_statuses(status))
+        with self._lock:
+            tasks = [self._task_brief(self._tasks.get(t["id"], t)) for t in records]
+        return {"tasks": tasks, "next": cursor, "version": version}
+
+    def get_tasks_changed_since(self, version: int) -> dict:
+        """
+        增量获取 version 之后有变更的任务
+        返回: {"tasks": [...], "deleted": [task_id, ...], "version": 当前版本号, "reset": 是否需要全量刷新}
+        """
+        current = self._store.version
+        changes = self._store.changed_since(int(version))
+        if changes is None:
+            return {"tasks": [], "deleted": [], "version": current, "reset": True}
+        records, deleted = changes
+        with self._lock:
+            changed = {t["id"]: t for t in records if t["id"] not in self._tasks}
+            # 活跃任务的进度只更新内存（见 _handle_progress），以内存中的版本为准
+            for task in self._tasks.values():
+                if task.get("version", 0) > version:
+                    changed[task["id"]] = task
+            tasks = [self._task_brief(t) for t in changed.values()]
+        tasks.sort(key=lambda t: t["created_at"])
+        return {"tasks": tasks, "deleted": deleted, "version": current, "reset": False}
+
+    # ===================== 排队调整 =====================
+
+    def set_task_priority(self, task_id: str, priority: int) -> bool:
+        """调整排队中任务的优先级（数值越大越先执行），任务已开始或不存在时返回 False"""
+        priority = int(priority)
+        if not self._scheduler.set_priority(task_id, priority):
+            return False
+        self._update_priority(task_id, priority)
+        return True
+
+    def move_task_to_front(self, task_id: str) -> bool:
+        """把排队中的任务插到队首"""
+        priority = self._scheduler.move_to_front(task_id)
+        if priority is None:
+            return False
+        self._update_priority(task_id, priority)
+        return True
+
+    def _update_priority(self, task_id: str, priority: int):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task:
+                task["priority"] = priority
+                self._store.save(task)
+
+    def get_queue_positions(self) -> dict[str, int]:
+        """所有排队中任务的排队位置（从 1 开始）"""
+        return self._scheduler.positions()
+
+    def get_queue_stats(self) -> dict:
+        """调度器状态：总并发、运行中、排队中及各分组的并发占用"""
+        return self._scheduler.stats()
 
     def cancel_task(self, task_id: str) -> bool:
-        """取消排队中的任务"""
+        """取消排队中或运行中的任务，运行中的任务会立即断开连接并释放并发名额"""
         with self._lock:
             task = self._tasks.get(task_id)
-            if task and task["status"] == "pending":
-                task["status"] = "cancelled"
-                future = self._futures.get(task_id)
-                if future:
-                    future.cancel()
-                self._push_task_update(task_id, {"type": "cancelled"})
-                get_logger().info("任务已取消: %s", task_id)
-                return True
-        return False
+            if not task or task["status"] not in ("pending", "running"):
+                return False
+            task["status"] = "cancelled"
+            self._end_attempt(task, "", "cancelled")
+            token = self._tokens.get(task_id)
+        if token:
+            token.cancel()
+        self._finish_task(task_id)
+        self._push_task_update(task_id, {"type": "cancelled"})
+        get_logger().info("任务已取消: %s", task_id)
+        return True
 
     def delete_task(self, task_id: str) -> bool:
         """删除任务记录"""
         with self._lock:
-            if task_id in self._tasks:
-                del self._tasks[task_id]
-                if task_id in self._task_order:
-                    self._task_order.remove(task_id)
-                self._futures.pop(task_id, None)
-                return True
-        return False
+            task = self._tasks.pop(task_id, None)
+            token = self._tokens.pop(task_id, None)
+            if task:
+                self._pin_refs(task, False)
+        if token:
+            # 删除运行中的任务时一并中止
+            token.cancel()
+        self._unpin_result(task_id)
+        if task is None and self._store.get(task_id) is None:
+            return False
+        self._store.delete(task_id)
+        return True
 
     def clear_done_tasks(self) -> int:
         """清除所有已完成/失败/取消的任务，返回清除数量"""
-        count = 0
+        count = self._store.clear(FINISHED_STATUSES)
         with self._lock:
-            to_remove = [
-                tid for tid, t in self._tasks.items()
-                if t["status"] in ("done", "error", "cancelled")
-            ]
-            for tid in to_remove:
-                del self._tasks[tid]
-                self._task_order.remove(tid)
-                self._futures.pop(tid, None)
-                count += 1
+            pins, self._result_pins = self._result_pins, {}
+        for blob_hash in pins.values():
+            self._blobs.unpin(blob_hash)
         return count
 
+    def _restore_tasks(self):
+        """启动时恢复上次未结束的任务：排队中的重新入队，运行中的标记为中断待重试"""
+        requeued, interrupted = [], 0
+        for task in self._store.list(ACTIVE_STATUSES):
+            if task["status"] == "running":
+                task["status"] = "error"
+                task["error"] = INTERRUPTED_ERROR
+                self._store.save(task)
+                interrupted += 1
+            else:
+                self._tasks[task["id"]] = task
+                self._pin_refs(task)
+                requeued.append(task["id"])
+        for task_id in requeued:
+            self._submit(task_id)
+        if requeued or interrupted:
+            get_logger().info("已恢复任务: %d 个重新排队, %d 个中断待重试", len(requeued), interrupted)
+
+    def _finish_task(self, task_id: str):
+        """任务结束（完成/失败/取消）：写入数据库并移出内存"""
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            self._tokens.pop(task_id, None)
+            if task:
+                self._pin_refs(task, False)
+                self._store.save(task)
+
+    def _pin_result_locked(self, task: dict):
+        """固定等待自动下载的结果 blob，下载结束（成功或失败）、手动保存或任务删除时释放（调用方持有锁）"""
+        blob_hash = task.get("result_blob")
+        if task["status"] == "done" and blob_hash and not task.get("file_path") and task["id"] not in self._result_pins:
+            self._result_pins[task["id"]] = blob_hash
+            self._blobs.pin(blob_hash)
+
+    def _unpin_result(self, task_id: str):
+        with self._lock:
+            blob_hash = self._result_pins.pop(task_id, None)
+        if blob_hash:
+            self._blobs.unpin(blob_hash)
+
+    def _pin_refs(self, task: dict, pin: bool = True):
+        """固定/释放任务引用的已上传参考图（任务在内存中期间不被存储淘汰）"""
+        ref = task.get("image_ref")
+        if ref:
+            (self._blobs.pin if pin else self._blobs.unpin)(ref)
+
     # ===================== 任务执行 =====================
 
-    def _execute_task(self, task_id: str):
-        """在线程池中执行单个任务"""
+    def _submit(self, task_id: str, delay: float = 0):
+        """提交任务协程到异步引擎，并登记取消令牌（delay 为自动重试的退避时间）"""
+        token = CancelToken()
+        self._tokens[task_id] = token
+        token.bind(self._engine.submit(self._run_task(task_id, token, delay)))
+
+    def _submit_many(self, task_ids: list[str]):
+        """批量提交任务协程（只唤醒一次事件循环）"""
+        tokens = [CancelToken() for _ in task_ids]
+        for task_id, token in zip(task_ids, tokens):
+            self._tokens[task_id] = token
+        futures = self._engine.submit_many([
+            self._run_task(task_id, token) for task_id, token in zip(task_ids, tokens)
+        ])
+        for token, future in zip(tokens, futures):
+            token.bind(future)
+
+    async def _run_task(self, task_id: str, token: CancelToken, delay: float = 0):
+        """等待退避时间（不占用并发名额）后在调度器中按优先级排队，拿到名额后执行任务"""
+        if delay:
+            await asyncio.sleep(delay)
+        queued_at = time.time()
+        with self._lock:
+            task = self._tasks.get(task_id)
+        if not task:
+            return
+        async with self._scheduler.slot(task_id, task["model"], task["mode"], task.get("priority", 0)):
+            await self._execute_task(task_id, token, queued_at)
+
+    async def _execute_task(self, task_id: str, token: CancelToken, queued_at: float):
+        """在事件循环中执行单个任务，各阶段的时间点记录在本次执行记录中（见 metrics.PHASE_MARKS）"""
         logger = get_logger()
 
         with self._lock:
             task = self._tasks.get(task_id)
-            if not task or task["status"] == "cancelled":
+            if not task or token.cancelled:
                 return
             task["status"] = "running"
+            task.setdefault("attempts", []).append({"queued_at": queued_at, "started_at": time.time()})
+            self._store.save(task)
 
         self._push_task_update(task_id, {"type": "status", "status": "running"})
 
-        api_base = "https://hetang.lyvideo.top"
+        api_base = http_client.get_api_base()
         api_key = get_setting("api_key")
 
         if not api_key:
@@ -165,13 +507,21 @@ class TaskManager:
 
         url = f"{api_base.rstrip('/')}/v1/chat/completions"
 
-        # 构建 messages
-        if task["mode"] == "img2img" and task["image_base64"]:
+        # 构建 messages（批量导入的任务此时才读取参考图）
+        image_base64 = ""
+        if task["mode"] == "img2img":
+            try:
+                image_base64 = await self._load_reference(task, "image")
+            except OSError as e:
+                self._fail_task(task_id, f"参考图读取失败: {e}")
+                return
+
+        if task["mode"] == "img2img" and image_base64:
             content = [
                 {"type": "text", "text": task["prompt"]},
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{task['image_base64']}"},
+                    "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"},
                 },
             ]
         else:
@@ -190,126 +540,265 @@ class TaskManager:
 
         logger.info("[%s] 开始生成 - 模型: %s, 提示词: %s", task_id, task["model"], task["prompt"][:30])
 
+        upstream = get_upstream_limiter(api_key)
+        self._mark(task, "prepared")
         try:
-            response = requests.post(url, json=payload, headers=headers, stream=True, timeout=300)
-            response.raise_for_status()
-
-            full_content = ""
-            buffer = ""
-
-            for line in response.iter_lines(decode_unicode=True):
-                # 检查任务是否被取消
-                with self._lock:
-                    t = self._tasks.get(task_id)
-                    if not t or t["status"] == "cancelled":
-                        logger.info("[%s] 任务已被取消，终止请求", task_id)
-                        return
-
-                if not line:
-                    buffer = ""
-                    continue
-
-                if line.startswith("data: "):
-                    data_str = line[6:]
-                    if data_str.strip() == "[DONE]":
-                        break
-                    buffer = data_str
-                else:
-                    buffer += line
-
+            # 上游限流：令牌桶 + 自适应并发，名额占用到流读取结束
+            async with upstream.slot():
+                self._mark(task, "sent")
+                started = time.monotonic()
                 try:
-                    data = json.loads(buffer)
-                except json.JSONDecodeError:
-                    continue
-
-                buffer = ""
+                    response = await http_client.request(
+                        "POST", url, json_body=payload, headers=headers, timeout=300
+                    )
+                except (asyncio.TimeoutError, http_client.ConnectError):
+                    upstream.record_failure()
+                    raise
                 try:
-                    delta = data["choices"][0]["delta"]
-
-                    reasoning = delta.get("reasoning_content", "")
-                    if reasoning:
-                        text = reasoning.strip()
-                        if text:
-                            with self._lock:
-                                task["progress"].append(text)
-                            self._push_task_update(task_id, {
-                                "type": "progress",
-                                "progress_text": text,
-                            })
-
-                    content_piece = delta.get("content", "")
-                    if content_piece:
-                        full_content += content_piece
-
-                except (KeyError, IndexError):
-                    continue
+                    upstream.record_response(response.status, time.monotonic() - started, response.headers)
+                    self._mark(task, "headers", connect=response.timing.get("connect", 0))
+                    full_content = await self._read_stream(task_id, task, response)
+                finally:
+                    response.close()
+                self._mark(task, "streamed")
 
             # 提取图片
             image_data, image_type = self._extract_image(full_content)
             if image_data:
                 logger.info("[%s] 图片生成成功 (类型: %s)", task_id, image_type)
+                blob_hash, blob_size = "", 0
+                if image_type == "base64":
+                    # 只解码一次，写入结果存储，任务中只保留哈希
+                    blob_hash, blob_size = await self._engine.run_blocking(self._blobs.put_base64, image_data)
+                    image_data, image_type = "", "blob"
                 with self._lock:
+                    if token.cancelled:
+                        return
                     task["status"] = "done"
+                    self._end_attempt(task, "", "done")
                     task["result_image"] = image_data
                     task["result_image_type"] = image_type
+                    task["result_blob"] = blob_hash
+                    task["result_size"] = blob_size
                     # 清除 image_base64 释放内存
                     task["image_base64"] = ""
 
-                # 自动下载
-                file_path = self._auto_download(task_id, image_data, image_type, task["prompt"])
-
+                if task.get("cache_key"):
+                    await self._engine.run_blocking(
+                        self._remember_result,
+                        task["cache_key"],
+                        {
+                            "result_image": image_data,
+                            "result_image_type": image_type,
+                            "result_blob": blob_hash,
+                            "result_size": blob_size,
+                        },
+                        blob_size,
+                    )
+
+                # 先推送完成并释放生成名额，自动下载在下载队列中进行，完成后推送 downloaded
+                self._finish_task(task_id)
                 self._push_task_update(task_id, {
                     "type": "done",
                     "result_image": image_data,
                     "result_image_type": image_type,
-                    "file_path": file_path,
+                    "result_blob": blob_hash,
+                    "result_size": blob_size,
+                    "file_path": "",
                 })
+                self._queue_download(task)
             else:
                 logger.warning("[%s] 未能提取图片, content: %s", task_id, full_content[:200])
                 self._fail_task(task_id, "未能从响应中提取图片")
 
-        except requests.exceptions.Timeout:
-            self._fail_task(task_id, "请求超时，请重试")
-        except requests.exceptions.ConnectionError:
-            self._fail_task(task_id, "无法连接到 API 服务器")
+        except asyncio.TimeoutError as e:
+            self._fail_task(task_id, "请求超时，请重试", e)
+        except http_client.ConnectError as e:
+            self._fail_task(task_id, "无法连接到 API 服务器", e)
+        except http_client.HTTPStatusError as e:
+            if e.status in OVERLOAD_STATUSES:
+                self._fail_task(task_id, f"上游服务繁忙 ({e.status})，已自动降低并发，请稍后重试", e)
+            else:
+                logger.error("[%s] 生成失败: %s", task_id, e)
+                self._fail_task(task_id, str(e), e)
         except Exception as e:
             logger.error("[%s] 生成失败: %s", task_id, e)
-            self._fail_task(task_id, str(e))
+            self._fail_task(task_id, str(e), e)
+
+    async def _load_reference(self, task: dict, key: str) -> str:
+        """读取参考图（已上传的按句柄从存储读取，批量导入的从文件读取）并预处理，返回上传用的 base64"""
+        b64_data = task.get(f"{key}_base64", "")
+        if b64_data and key in task.get("image_prep", {}):
+            return b64_data  # 自动重试：任务中已是处理后的图片
+        ref, path = task.get(f"{key}_ref", ""), task.get(f"{key}_path", "")
+        source_hash = ""  # 原图内容哈希：已上传的句柄即为 sha256，预处理缓存直接使用
+        if not b64_data and ref:
+            b64_data = await self._engine.run_blocking(self._blobs.read_base64, ref)
+            if b64_data is None:
+                raise FileNotFoundError("参考图已失效，请重新上传")
+            source_hash = ref
+        elif not b64_data and path:
+            b64_data = await self._engine.run_blocking(read_image_base64, path)
+        b64_data, info = await self._prep.prepare(self._engine, b64_data, task["model"], source_hash)
+        if info:
+            get_logger().info(
+                "[%s] 参考图已预处理: %d KB -> %d KB", task["id"], info["before"] // 1024, info["after"] // 1024
+            )
+            with self._lock:
+                task.setdefault("image_prep", {})[key] = info
+                if task.get(f"{key}_base64"):
+                    # 排队重试期间只保留处理后的图片
+                    task[f"{key}_base64"] = b64_data
+        return b64_data
+
+    async def _read_stream(self, task_id: str, task: dict, response: http_client.AsyncResponse) -> str:
+        """读取 SSE 流，推送进度，返回拼接后的 content"""
+        response.raise_for_status()
+
+        stream = ChatStream()
+        # 取消由 CancelToken 直接中断本协程（连接在调用方 finally 中关闭），无需逐块检查
+        async for chunk in response.iter_chunks():
+            self._handle_progress(task_id, task, stream.feed(chunk))
+            if stream.done:
+                break
+        else:
+            self._handle_progress(task_id, task, stream.close())
+
+        # 读完 [DONE] 之后的结束块，让连接回到连接池复用
+        await response.drain()
+        return stream.content.getvalue()
+
+    def _handle_progress(self, task_id: str, task: dict, texts: list[str]):
+        """记录并推送 reasoning_content 进度"""
+        for text in texts:
+            with self._lock:
+                task["progress"].append(text)
+                self._store.touch(task)
+            self._push_task_update(task_id, {
+                "type": "progress",
+                "progress_text": text,
+            })
 
     def retry_task(self, task_id: str) -> dict:
         """重试失败的任务"""
+        task = self._store.get(task_id)
         with self._lock:
-            task = self._tasks.get(task_id)
-            if not task or task["status"] not in ("error", "cancelled"):
+            if not task or task_id in self._tasks or task["status"] not in ("error", "cancelled"):
                 return {}
             task["status"] = "pending"
             task["progress"] = []
             task["result_image"] = ""
             task["result_image_type"] = ""
+            task["result_blob"] = ""
+            task["result_size"] = 0
             task["error"] = ""
             task["file_path"] = ""
+            task.pop("download", None)
+            task["retry_count"] = 0
+            task["cached"] = False
+            self._tasks[task_id] = task
+            self._pin_refs(task)
+            self._store.save(task)
 
         get_logger().info("任务重试: %s", task_id)
 
-        future = self._pool.submit(self._execute_task, task_id)
-        self._futures[task_id] = future
+        self._submit(task_id)
 
         with self._lock:
             return self._task_summary(task)
 
-    def _fail_task(self, task_id: str, error: str):
-        """标记任务失败"""
+    def _fail_task(self, task_id: str, error: str, exc: BaseException | None = None):
+        """标记任务失败；exc 属于可重试的错误且未超过最大尝试次数时，退避后重新进入调度器排队"""
+        delay = None
+        policy = get_retry_policy("image")
         with self._lock:
             task = self._tasks.get(task_id)
-            if task:
+            if not task or task["status"] == "cancelled":
+                return
+            retry = task.get("retry_count", 0) + 1
+            reason = policy.reason(exc)
+            if reason and retry < policy.max_attempts:
+                delay = policy.delay(retry, exc)
+                self._end_attempt(task, error, "retry")
+                task["status"] = "pending"
+                task["retry_count"] = retry
+                task["attempts"][-1]["retry_in"] = round(delay, 1)
+                self._store.save(task)
+            else:
+                self._end_attempt(task, error, "error")
                 task["status"] = "error"
                 task["error"] = error
                 # 不清除 image_base64，保留以便重试
+        if delay is not None:
+            get_logger().warning(
+                "[%s] 第 %d 次执行失败 (%s)，%.1f 秒后自动重试: %s", task_id, retry, reason, delay, error
+            )
+            self._push_task_update(task_id, {"type": "retrying", "retry_count": retry, "delay": round(delay, 1), "error": error})
+            self._submit(task_id, delay)
+            return
+        self._finish_task(task_id)
         self._push_task_update(task_id, {"type": "error", "error": error})
         get_logger().error("[%s] 任务失败: %s", task_id, error)
 
+    def _mark(self, task: dict, phase: str, **extra):
+        """记录本次执行到达某阶段的时间点（{phase}_at）"""
+        with self._lock:
+            attempt = task["attempts"][-1]
+            attempt[f"{phase}_at"] = time.time()
+            attempt.update(extra)
+
+    def _end_attempt(self, task: dict, error: str, outcome: str):
+        """补全本次执行记录并计入指标（调用方持有锁），outcome: done / retry / error / cancelled"""
+        attempts = task.get("attempts")
+        if attempts and "ended_at" not in attempts[-1]:
+            attempts[-1]["ended_at"] = time.time()
+            attempts[-1]["error"] = error
+            get_metrics().observe_attempt("image", task["model"], attempts[-1], outcome)
+
     # ===================== 自动下载 =====================
 
+    def _queue_download(self, task: dict):
+        """启用自动下载时把已完成任务的结果放入下载队列（排队期间结果不被淘汰）"""
+        if is_auto_download_enabled():
+            with self._lock:
+                self._pin_result_locked(task)
+            get_download_queue().submit(
+                self._download_result,
+                task["id"],
+                task["model"],
+                task["result_blob"] or task["result_image"],
+                task["result_image_type"],
+                task["prompt"],
+                time.time(),
+            )
+
+    def _download_result(
+        self, task_id: str, model: str, image_data: str, image_type: str, prompt: str, queued_at: float
+    ):
+        """下载队列中执行：自动保存结果，记录文件路径和下载耗时并推送 downloaded"""
+        started_at = time.time()
+        try:
+            file_path = self._auto_download(task_id, image_data, image_type, prompt)
+        finally:
+            # 无论成功与否都释放固定，结果存储中的副本交给总大小上限淘汰
+            self._unpin_result(task_id)
+        timing = {"queued_at": queued_at, "started_at": started_at, "ended_at": time.time()}
+        get_metrics().observe("image", model, {
+            "download_wait": started_at - queued_at,
+            "download": timing["ended_at"] - started_at,
+        })
+        if not file_path:
+            self._push_task_update(task_id, {"type": "download_failed"})
+            return
+        with self._lock:
+            task = self._store.get(task_id)
+            if not task or task_id in self._tasks:
+                return  # 已删除或已重新执行
+            task["file_path"] = file_path
+            task["download"] = timing
+            self._store.save(task)
+        self._push_task_update(task_id, {"type": "downloaded", "file_path": file_path})
+
     def _auto_download(self, task_id: str, image_data: str, image_type: str, prompt: str) -> str:
         """如果启用自动下载，保存图片到本地，返回文件路径"""
         auto = get_setting("auto_download")
@@ -328,28 +817,14 @@ class TaskManager:
                 get_logger().error("[%s] 无法创建下载目录: %s", task_id, e)
                 return ""
 
-        # 文件名：hetangai_时间戳_提示词前几个字.jpg
+        # 文件名：hetangai_时间戳_提示词前几个字_任务ID.jpg（任务 ID 保证同一秒完成的相同提示词不会互相覆盖）
         ts = time.strftime("%Y%m%d_%H%M%S")
         safe_prompt = re.sub(r'[^\w\u4e00-\u9fff]', '', prompt)[:10]
-        filename = f"hetangai_{ts}_{safe_prompt}.jpg"
+        filename = f"hetangai_{ts}_{safe_prompt}_{task_id}.jpg"
         file_path = dl_dir / filename
 
         try:
-            if image_type == "url":
-                resp = requests.get(image_data, timeout=60)
-                resp.raise_for_status()
-                image_bytes = resp.content
-            else:
-                image_bytes = base64.b64decode(image_data)
-
-            with open(file_path, "wb") as f:
-                f.write(image_bytes)
-
-            with self._lock:
-                task = self._tasks.get(task_id)
-                if task:
-                    task["file_path"] = str(file_path)
-
+            self._write_image(task_id, image_data, image_type, file_path)
             get_logger().info("[%s] 图片已自动保存: %s", task_id, file_path)
             return str(file_path)
 
@@ -357,45 +832,97 @@ class TaskManager:
             get_logger().error("[%s] 自动下载失败: %s", task_id, e)
             return ""
 
+    def save_task_image(self, task_id: str, file_path: str) -> str:
+        """将已完成任务的图片保存到指定路径（手动保存），返回文件路径，失败返回空串"""
+        image_data, image_type = self.get_task_image(task_id)
+        if not image_data:
+            return ""
+        try:
+            self._write_image(task_id, image_data, image_type, Path(file_path))
+            get_logger().info("图片已保存: %s", file_path)
+            self._unpin_result(task_id)
+            return file_path
+        except Exception as e:
+            get_logger().error("保存图片失败: %s", e)
+            return ""
+
+    def _write_image(self, task_id: str, image_data: str, image_type: str, file_path: Path):
+        """写入图片文件：URL 下载（大文件分段续传）并推送进度，blob 从结果存储复制，旧记录的 base64 解码后原子写入"""
+        if image_type == "url":
+            download_resumable(
+                image_data,
+                file_path,
+                timeout=60,
+                on_progress=lambda done, total: self._push_task_update(task_id, {
+                    "type": "download_progress",
+                    "downloaded": done,
+                    "total": total,
+                }),
+            )
+        elif image_type == "blob":
+            self._blobs.copy_to(image_data, file_path)
+        else:
+            write_file_atomic(file_path, base64.b64decode(image_data))
+
     # ===================== 推送与工具方法 =====================
 
     def _push_task_update(self, task_id: str, data: dict):
-        """通过 evaluate_js 推送任务状态更新到前端"""
-        if not self._window:
-            return
-        data["task_id"] = task_id
-        try:
-            json_str = json.dumps(data, ensure_ascii=True)
-            self._window.evaluate_js(
-                f"window.__onTaskUpdate && window.__onTaskUpdate({json_str})"
-            )
-        except Exception:
-            pass
+        """推送任务状态更新到前端（由推送调度器按帧合并批量发送，不阻塞调用方）"""
+        self._dispatcher.push("__onTaskUpdate", task_id, data)
 
     def _task_summary(self, task: dict) -> dict:
-        """生成任务摘要（不含 image_base64 大字段）"""
+        """生成任务摘要（不含 image_base64 大字段，blob 结果只带哈希，图片数据由前端按需读取）"""
         return {
             "id": task["id"],
             "prompt": task["prompt"],
             "model": task["model"],
             "mode": task["mode"],
             "status": task["status"],
+            "priority": task.get("priority", 0),
+            "retry_count": task.get("retry_count", 0),
+            "attempts": task.get("attempts", []),
+            "download": task.get("download", {}),
+            "cached": task.get("cached", False),
+            "image_prep": task.get("image_prep", {}),
             "progress": task["progress"],
             "result_image": task["result_image"],
             "result_image_type": task["result_image_type"],
+            "result_blob": task.get("result_blob", ""),
+            "result_size": task.get("result_size", 0),
+            "result_missing": self._result_missing(task),
             "error": task["error"],
             "created_at": task["created_at"],
             "file_path": task["file_path"],
         }
 
+    def _task_brief(self, task: dict) -> dict:
+        """分页/增量列表用的精简摘要：进度只带最后一条"""
+        brief = self._task_summary(task)
+        brief["progress"] = task["progress"][-1:]
+        brief["progress_count"] = len(task["progress"])
+        brief["version"] = task.get("version", 0)
+        return brief
+
     def get_task_image(self, task_id: str) -> tuple[str, str]:
-        """获取任务的图片数据和类型"""
+        """获取任务的图片数据和类型（URL / blob 哈希 / 旧记录的 base64）"""
         with self._lock:
             task = self._tasks.get(task_id)
-            if task and task["status"] == "done":
-                return task["result_image"], task["result_image_type"]
+        if task is None:
+            task = self._store.get(task_id)
+        if task and task["status"] == "done" and not self._result_missing(task):
+            if task["result_image_type"] == "blob":
+                return task["result_blob"], "blob"
+            return task["result_image"], task["result_image_type"]
         return "", ""
 
+    def _result_missing(self, task: dict) -> bool:
+        """blob 结果是否已被结果存储淘汰（只查内存索引）"""
+        return task["result_image_type"] == "blob" and not self._blobs.exists(task.get("result_blob", ""))
+
+    def get_result_image(self, blob_hash: str) -> str:
+        """按哈希读取 blob 结果，返回 data URL（已被淘汰时返回空串）"""
+        return self._blobs.read_data_url(blob_hash)
+
     @staticmethod
     def _extract_image(content: str) -> tuple[str, str]:
         """
@@ -426,6 +953,8 @@ class TaskManager:
         return "", ""
 
     def shutdown(self):
-        """关闭线程池"""
-        if self._pool:
-            self._pool.shutdown(wait=False)
+        """取消所有未完成的任务协程并写入剩余的任务记录（未结束的任务下次启动时恢复）"""
+        self._unsubscribe()
+        for token in list(self._tokens.values()):
+            token.cancel()
+        self._store.close()
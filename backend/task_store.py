@@ -0,0 +1,293 @@
+"""
+HeTangAI 任务持久化
+- 任务记录保存在 SQLite tasks 表（见 database.TaskRecord）
+- 写入先进入内存缓冲区，由后台线程按批次在一个事务中落库，不阻塞事件循环
+- 读取时先查缓冲区再查数据库，保证"刚写入尚未落库"的记录也能读到
+- 每次变更分配单调递增的版本号，支持按游标分页和"某版本之后的变更"增量查询
+"""
+
+import json
+import time
+import threading
+from collections import deque
+
+from peewee import chunked, fn
+
+from backend.database import db, TaskRecord, close_thread_connection
+from backend.logger import get_logger
+
+
+FLUSH_INTERVAL = 0.5  # 秒
+BATCH_SIZE = 100  # 单条 SQL 的最大行数
+MAX_PAGE_SIZE = 500  # 分页查询单页上限
+MAX_TOMBSTONES = 1000  # 保留的删除记录数，更早的删除无法增量同步，需要全量刷新
+
+ACTIVE_STATUSES = ("pending", "running")
+FINISHED_STATUSES = ("done", "error", "cancelled")
+
+# 上次运行时被中断的任务的错误信息（启动恢复时写入，可直接重试）
+INTERRUPTED_ERROR = "任务在上次运行时被中断，请重试"
+
+_DELETED = object()  # 缓冲区中的删除标记
+
+
+class TaskStore:
+    """单一任务类型（kind）的持久化存储"""
+
+    def __init__(self, kind: str, flush_interval: float = FLUSH_INTERVAL):
+        self._kind = kind
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: dict[str, object] = {}   # task_id -> 任务快照 / _DELETED
+        self._inflight: dict[str, object] = {}  # 正在写入数据库的批次
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._version = self._load_version()
+        self._tombstones: deque[tuple[int, str]] = deque()  # (删除时的版本号, task_id)
+        self._tombstone_floor = self._version  # 早于该版本的删除记录已丢弃
+        self._thread = threading.Thread(
+            target=self._run, name=f"hetangai-store-{kind}", daemon=True
+        )
+        self._thread.start()
+
+    # ===================== 版本号 =====================
+
+    def _load_version(self) -> int:
+        value = (
+            TaskRecord.select(fn.MAX(TaskRecord.version))
+            .where(TaskRecord.kind == self._kind)
+            .scalar()
+        )
+        return value or 0
+
+    @property
+    def version(self) -> int:
+        """当前最新的变更版本号"""
+        with self._lock:
+            return self._version
+
+    def touch(self, task: dict):
+        """标记任务有变更（只更新版本号，不落库，用于进度等高频字段）"""
+        with self._lock:
+            self._version += 1
+            task["version"] = self._version
+
+    def _add_tombstones_locked(self, task_ids: list[str]):
+        self._version += 1
+        for task_id in task_ids:
+            self._tombstones.append((self._version, task_id))
+        while len(self._tombstones) > MAX_TOMBSTONES:
+            self._tombstone_floor = self._tombstones.popleft()[0]
+
+    # ===================== 写入 =====================
+
+    def save(self, task: dict):
+        """登记任务快照（同时分配新版本号），稍后批量落库"""
+        with self._lock:
+            self._version += 1
+            task["version"] = self._version
+            self._pending[task["id"]] = _snapshot(task)
+
+    def save_many(self, tasks: list[dict]):
+        """批量登记任务快照（一次加锁），用于批量添加任务"""
+        with self._lock:
+            for task in tasks:
+                self._version += 1
+                task["version"] = self._version
+                self._pending[task["id"]] = _snapshot(task)
+
+    def delete(self, task_id: str):
+        with self._lock:
+            self._pending[task_id] = _DELETED
+            self._add_tombstones_locked([task_id])
+
+    def clear(self, statuses: tuple[str, ...]) -> int:
+        """同步删除指定状态的所有记录，返回删除数量"""
+        self.flush()
+        query = TaskRecord.select(TaskRecord.task_id).where(
+            (TaskRecord.kind == self._kind) & (TaskRecord.status.in_(statuses))
+        )
+        task_ids = [r.task_id for r in query]
+        with db.atomic():
+            for part in chunked(task_ids, BATCH_SIZE):
+                TaskRecord.delete().where(
+                    (TaskRecord.kind == self._kind) & (TaskRecord.task_id.in_(part))
+                ).execute()
+        if task_ids:
+            with self._lock:
+                self._add_tombstones_locked(task_ids)
+        return len(task_ids)
+
+    def flush(self):
+        """立即把缓冲区写入数据库"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._inflight = self._pending
+                self._pending = {}
+                batch = self._inflight
+            try:
+                self._write(batch)
+            except Exception as e:
+                get_logger().error("任务记录写入失败 (%s): %s", self._kind, e)
+                # 写入失败时放回缓冲区，下一轮重试（不覆盖期间的新写入）
+                with self._lock:
+                    for task_id, item in batch.items():
+                        self._pending.setdefault(task_id, item)
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def _write(self, batch: dict[str, object]):
+        now = time.time()
+        rows = []
+        deleted = []
+        for task_id, item in batch.items():
+            if item is _DELETED:
+                deleted.append(task_id)
+                continue
+            rows.append({
+                "kind": self._kind,
+                "task_id": task_id,
+                "status": item["status"],
+                "created_at": item["created_at"],
+                "updated_at": now,
+                "version": item.get("version", 0),
+                "data": json.dumps(item, ensure_ascii=False),
+            })
+        with db.atomic():
+            for part in chunked(rows, BATCH_SIZE):
+                TaskRecord.insert_many(part).on_conflict_replace().execute()
+            for part in chunked(deleted, BATCH_SIZE):
+                TaskRecord.delete().where(
+                    (TaskRecord.kind == self._kind) & (TaskRecord.task_id.in_(part))
+                ).execute()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+        close_thread_connection()
+
+    def close(self):
+        """停止后台线程并写入剩余记录"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=10)
+
+    # ===================== 读取 =====================
+
+    def _buffered(self, task_id: str):
+        with self._lock:
+            if task_id in self._pending:
+                return self._pending[task_id]
+            return self._inflight.get(task_id)
+
+    def get(self, task_id: str) -> dict | None:
+        item = self._buffered(task_id)
+        if item is _DELETED:
+            return None
+        if item is not None:
+            return _snapshot(item)
+        record = TaskRecord.get_or_none(
+            (TaskRecord.kind == self._kind) & (TaskRecord.task_id == task_id)
+        )
+        return json.loads(record.data) if record else None
+
+    def page(
+        self,
+        limit: int,
+        after: str = "",
+        statuses: tuple[str, ...] | None = None,
+    ) -> tuple[list[dict], str]:
+        """
+        按 (创建时间, id) 游标分页，返回 (本页任务, 下一页游标)，没有下一页时游标为空串
+        游标格式为 "created_at|task_id"，由上一页返回，调用方不需要解析
+        """
+        self.flush()
+        query = TaskRecord.select(TaskRecord.task_id, TaskRecord.created_at, TaskRecord.data).where(
+            TaskRecord.kind == self._kind
+        )
+        if statuses:
+            query = query.where(TaskRecord.status.in_(statuses))
+        if after:
+            created_at, task_id = _parse_cursor(after)
+            query = query.where(
+                (TaskRecord.created_at > created_at)
+                | ((TaskRecord.created_at == created_at) & (TaskRecord.task_id > task_id))
+            )
+        rows = list(
+            query.order_by(TaskRecord.created_at, TaskRecord.task_id).limit(limit + 1)
+        )
+        cursor = ""
+        if len(rows) > limit:
+            rows = rows[:limit]
+            cursor = f"{rows[-1].created_at!r}|{rows[-1].task_id}"
+        return [json.loads(r.data) for r in rows], cursor
+
+    def changed_since(self, version: int) -> tuple[list[dict], list[str]] | None:
+        """
+        返回版本号大于 version 的 (变更任务, 已删除的 task_id)
+        version 早于保留的删除记录（或不属于本次数据库）时返回 None，调用方需要全量刷新
+        """
+        with self._lock:
+            if version < self._tombstone_floor or version > self._version:
+                return None
+            deleted = [task_id for v, task_id in self._tombstones if v > version]
+        self.flush()
+        query = TaskRecord.select(TaskRecord.data).where(
+            (TaskRecord.kind == self._kind) & (TaskRecord.version > version)
+        )
+        tasks = [json.loads(r.data) for r in query.order_by(TaskRecord.version)]
+        return tasks, deleted
+
+    def list(self, statuses: tuple[str, ...] | None = None) -> list[dict]:
+        """按创建时间排序列出任务（含尚未落库的缓冲记录）"""
+        query = TaskRecord.select(TaskRecord.task_id, TaskRecord.data).where(TaskRecord.kind == self._kind)
+        if statuses:
+            query = query.where(TaskRecord.status.in_(statuses))
+        tasks = {r.task_id: json.loads(r.data) for r in query}
+
+        with self._lock:
+            overlay = {**self._inflight, **self._pending}
+        for task_id, item in overlay.items():
+            if item is _DELETED:
+                tasks.pop(task_id, None)
+            elif not statuses or item["status"] in statuses:
+                tasks[task_id] = _snapshot(item)
+            else:
+                tasks.pop(task_id, None)
+
+        return sorted(tasks.values(), key=lambda t: t["created_at"])
+
+
+def _snapshot(task: dict) -> dict:
+    """任务快照：复制嵌套的列表 / 字典（progress、attempts、download 等），落库前不受后续修改影响"""
+    snapshot = dict(task)
+    for key, value in task.items():
+        if isinstance(value, list):
+            snapshot[key] = [dict(item) if isinstance(item, dict) else item for item in value]
+        elif isinstance(value, dict):
+            snapshot[key] = dict(value)
+    return snapshot
+
+
+def parse_statuses(status: str | list[str] | None) -> tuple[str, ...] | None:
+    """解析前端传入的状态过滤：逗号分隔的字符串或列表，空值表示不过滤"""
+    if not status:
+        return None
+    if isinstance(status, str):
+        status = status.split(",")
+    return tuple(s.strip() for s in status if s.strip()) or None
+
+
+def _parse_cursor(cursor: str) -> tuple[float, str]:
+    created_at, _, task_id = cursor.partition("|")
+    try:
+        return float(created_at), task_id
+    except ValueError:
+        raise ValueError(f"无效的分页游标: {cursor}") from None
@@ -0,0 +1,203 @@
+"""
+HeTangAI 前端推送调度
+- 任务更新先进入队列，后台线程每个时间窗口（帧）只调用一次 evaluate_js，批量交给前端回调
+- 同一任务在窗口内的连续进度合并为一条：download_progress 只保留最新值，
+  progress 的文本按顺序累积到 progress_texts（progress_text 为最新一条），前端逐条追加不丢失
+- 状态类更新（running / done / error / cancelled）从不合并或丢弃，且保持先后顺序
+- 可注册监听器（命令行、本地服务），在推送线程中按相同顺序接收每条更新，有无窗口均可
+"""
+
+import json
+import time
+import threading
+from typing import Callable
+
+from backend.logger import get_logger
+from backend.database import get_setting, subscribe
+
+
+DEFAULT_INTERVAL_MS = 50
+MAX_PENDING = 10000  # 队列上限，超出时丢弃新的进度类更新
+
+# 可合并/可丢弃的更新类型（progress 合并时保留全部文本，见 push）
+MERGEABLE_TYPES = ("progress", "download_progress")
+
+UpdateListener = Callable[[str, dict], None]  # (前端回调名, 更新数据)
+
+
+class UpdateDispatcher:
+    """按帧批量推送任务更新到 webview"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL_MS / 1000):
+        self._interval = interval
+        self._window = None
+        self._listeners: list[UpdateListener] = []
+        self._lock = threading.Lock()
+        self._queue: list[tuple[str, dict]] = []  # (前端回调名, 更新数据)
+        self._last: dict[tuple[str, str], int] = {}  # (回调名, task_id) -> 该任务在队列中最后一条的下标
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._queued = 0
+        self._merged = 0
+        self._dropped = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name="hetangai-push", daemon=True)
+        self._thread.start()
+
+    def set_window(self, window):
+        with self._lock:
+            self._window = window
+
+    def add_listener(self, listener: UpdateListener):
+        """注册更新监听器（在推送线程中调用，不应阻塞）"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: UpdateListener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def set_interval(self, interval: float):
+        """调整推送窗口（秒），下一帧生效"""
+        self._interval = max(0.0, interval)
+
+    # ===================== 入队 =====================
+
+    def push(self, callback: str, task_id: str, data: dict):
+        """登记一条任务更新（任意线程调用，不阻塞）"""
+        data["task_id"] = task_id
+        mergeable = data.get("type") in MERGEABLE_TYPES
+        with self._lock:
+            if (self._window is None and not self._listeners) or self._closed:
+                self._dropped += 1
+                return
+            key = (callback, task_id)
+            idx = self._last.get(key)
+            if mergeable and idx is not None and self._queue[idx][1].get("type") == data["type"]:
+                # 窗口内该任务最后一条是同类进度：替换为最新值，进度文本累积保留
+                if data["type"] == "progress":
+                    prev = self._queue[idx][1]
+                    texts = prev.setdefault("progress_texts", [prev["progress_text"]])
+                    texts.append(data["progress_text"])
+                    data["progress_texts"] = texts
+                self._queue[idx] = (callback, data)
+                self._merged += 1
+                return
+            if mergeable and len(self._queue) >= MAX_PENDING:
+                self._dropped += 1
+                return
+            self._last[key] = len(self._queue)
+            self._queue.append((callback, data))
+            self._queued += 1
+        self._wakeup.set()
+
+    # ===================== 推送线程 =====================
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            if self._closed:
+                return
+            # 等待一个窗口，收集这段时间内的更新
+            if self._interval:
+                time.sleep(self._interval)
+            self._wakeup.clear()
+            with self._lock:
+                batch, self._queue, self._last = self._queue, [], {}
+                window = self._window
+                listeners = list(self._listeners)
+            if batch and not self._closed:
+                for listener in listeners:
+                    self._notify(listener, batch)
+                if window is not None:
+                    self._deliver(window, batch)
+
+    @staticmethod
+    def _notify(listener: UpdateListener, batch: list[tuple[str, dict]]):
+        for callback, data in batch:
+            try:
+                listener(callback, data)
+            except Exception as e:
+                get_logger().debug("更新监听器异常: %s", e)
+
+    def _deliver(self, window, batch: list[tuple[str, dict]]):
+        """按回调分组，拼成一段脚本，一次 evaluate_js 推送整批更新"""
+        groups: dict[str, list[str]] = {}
+        for callback, data in batch:
+            try:
+                groups.setdefault(callback, []).append(json.dumps(data, ensure_ascii=True))
+            except (TypeError, ValueError):
+                with self._lock:
+                    self._dropped += 1
+        script = ";".join(
+            f"window.{callback} && [{','.join(items)}].forEach(function (u) {{"
+            f" try {{ window.{callback}(u) }} catch (e) {{}} }})"
+            for callback, items in groups.items()
+        )
+        if not script:
+            return
+        with self._lock:
+            self._batches += 1
+        try:
+            window.evaluate_js(script)
+        except Exception as e:
+            get_logger().debug("推送任务更新失败: %s", e)
+
+    def stats(self) -> dict:
+        """推送统计：入队条数、被合并条数、被丢弃条数、实际 evaluate_js 次数"""
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "merged": self._merged,
+                "dropped": self._dropped,
+                "batches": self._batches,
+                "pending": len(self._queue),
+                "interval_ms": round(self._interval * 1000),
+            }
+
+    def close(self):
+        """停止推送线程，丢弃未推送的更新（窗口已关闭）"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=2)
+
+
+_dispatcher: UpdateDispatcher | None = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_interval() -> float:
+    """读取设置中的推送窗口（毫秒），返回秒"""
+    try:
+        return max(0, int(get_setting("ui_push_interval_ms") or DEFAULT_INTERVAL_MS)) / 1000
+    except (ValueError, TypeError):
+        return DEFAULT_INTERVAL_MS / 1000
+
+
+def get_dispatcher() -> UpdateDispatcher:
+    """获取全局推送调度器（首次调用时启动推送线程）"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = UpdateDispatcher(get_interval())
+        return _dispatcher
+
+
+def shutdown_dispatcher():
+    """停止全局推送调度器"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.close()
+            _dispatcher = None
+
+
+def _on_interval_changed(key: str, value: str):
+    with _dispatcher_lock:
+        dispatcher = _dispatcher
+    if dispatcher is not None:
+        dispatcher.set_interval(get_interval())
+
+
+subscribe(_on_interval_changed, ("ui_push_interval_ms",))
@@ -1,60 +1,102 @@
 """
 HeTangAI 视频任务管理器
-- 使用 ThreadPoolExecutor 并发执行视频生成任务
+- 在共享异步引擎（单事件循环线程）上并发执行视频生成任务
 - 支持文生视频 (text2video) 和图生视频 (img2video)
 - 支持流式 SSE 解析、进度推送、自动下载
 """
 
-import json
 import re
 import time
+import asyncio
 import threading
 from uuid import uuid4
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, Future
-
-import requests
-import webview
+from typing import TYPE_CHECKING
 
+from backend import http_client
 from backend.logger import get_logger
-from backend.database import get_setting
+from backend.database import get_setting, subscribe
+from backend.blob_store import get_blob_store
+from backend.downloader import download_resumable
+from backend.download_queue import get_download_queue, is_auto_download_enabled
+from backend.batch_import import read_image_base64
+from backend.image_prep import get_preprocessor
+from backend.result_cache import get_result_cache, make_key as make_cache_key, is_enabled as is_result_cache_enabled
+from backend.engine import get_engine, CancelToken
+from backend.scheduler import TaskScheduler, get_caps
+from backend.sse import ChatStream
+from backend.rate_limiter import get_upstream_limiter, OVERLOAD_STATUSES
+from backend.retry import get_retry_policy
+from backend.update_dispatcher import get_dispatcher
+from backend.metrics import get_metrics
+from backend.task_store import (
+    TaskStore,
+    ACTIVE_STATUSES,
+    FINISHED_STATUSES,
+    INTERRUPTED_ERROR,
+    MAX_PAGE_SIZE,
+    parse_statuses,
+)
+from backend.task_manager import MAX_CONCURRENCY
+
+if TYPE_CHECKING:
+    import webview  # 只在有界面时使用，命令行运行不需要安装
 
 
 class VideoTaskManager:
     """管理视频生成任务队列"""
 
-    def __init__(self):
-        self._window: webview.Window | None = None
-        self._tasks: dict[str, dict] = {}  # task_id -> task
-        self._task_order: list[str] = []    # 保持插入顺序
-        self._futures: dict[str, Future] = {}
+    def __init__(self, restore: bool = True):
+        self._tasks: dict[str, dict] = {}  # task_id -> 活跃任务（排队中/运行中），已结束的只在数据库中
+        self._tokens: dict[str, CancelToken] = {}  # task_id -> 取消令牌
         self._lock = threading.Lock()
-        self._pool: ThreadPoolExecutor | None = None
+        self._engine = get_engine()
+        self._dispatcher = get_dispatcher()
+        self._store = TaskStore("video")
+        self._blobs = get_blob_store()
+        self._cache = get_result_cache()
+        self._prep = get_preprocessor()
+        self._scheduler: TaskScheduler | None = None
         self._init_pool()
+        self._unsubscribe = subscribe(self._on_setting_changed, ("thread_pool_size", "video_thread_pool_size", "concurrency_caps"))
+        if restore:  # 命令行运行时不恢复数据库中上次未结束的任务
+            self._restore_tasks()
 
-    def set_window(self, window: webview.Window):
-        self._window = window
+    def set_window(self, window: "webview.Window"):
+        self._dispatcher.set_window(window)
 
     def _init_pool(self):
-        """初始化线程池"""
+        """初始化任务调度器"""
         size = self._get_pool_size()
-        self._pool = ThreadPoolExecutor(max_workers=size)
-        get_logger().info("视频线程池已初始化, 线程数: %d", size)
+        self._scheduler = TaskScheduler(size, get_caps())
+        http_client.set_worker_count("video", size)
+        get_logger().info("视频任务并发已初始化, 并发数: %d", size)
 
     def _get_pool_size(self) -> int:
+        """视频并发数（video_thread_pool_size），未单独设置时沿用图片任务的并发数"""
         try:
-            size = int(get_setting("thread_pool_size") or "2")
-            return max(1, min(size, 10))
+            size = int(get_setting("video_thread_pool_size") or get_setting("thread_pool_size") or "2")
+            return max(1, min(size, MAX_CONCURRENCY))
         except (ValueError, TypeError):
             return 2
 
     def resize_pool(self):
-        """重新创建线程池"""
-        old_pool = self._pool
-        self._pool = ThreadPoolExecutor(max_workers=self._get_pool_size())
-        get_logger().info("视频线程池已调整, 新线程数: %d", self._get_pool_size())
-        if old_pool:
-            old_pool.shutdown(wait=False)
+        """调整并发上限，排队中的任务立即按新上限调度"""
+        size = self._get_pool_size()
+        self._engine.call_soon(self._scheduler.set_limit, size)
+        http_client.set_worker_count("video", size)
+        get_logger().info("视频任务并发已调整, 新并发数: %d", size)
+
+    def update_caps(self):
+        """按设置重新加载按模型 / 模式的并发上限"""
+        self._engine.call_soon(self._scheduler.set_caps, get_caps())
+
+    def _on_setting_changed(self, key: str, value: str):
+        """配置变更回调：并发数（视频未单独设置时跟随图片）、分组上限立即生效"""
+        if key == "concurrency_caps":
+            self.update_caps()
+        else:
+            self.resize_pool()
 
     # ===================== 任务操作 =====================
 
@@ -65,22 +107,122 @@ class VideoTaskManager:
         mode: str,
         image_base64: str = "",
         end_image_base64: str = "",
+        priority: int = 0,
+        use_cache: bool = True,
+        image_ref: str = "",
+        end_image_ref: str = "",
     ) -> dict:
         """
         添加一个视频生成任务，返回任务摘要
         - mode: "text2video" 或 "img2video"
         - image_base64: 图生视频首帧
         - end_image_base64: 图生视频尾帧（可选）
+        - priority: 优先级，越大越先执行
+        - use_cache: 结果缓存开启时，False 表示跳过缓存重新生成
+        - image_ref / end_image_ref: 已上传首帧 / 尾帧的句柄（upload_reference_image 返回），与 base64 二选一
+        """
+        task = self._new_task(
+            prompt,
+            model,
+            mode,
+            image_base64,
+            end_image_base64,
+            priority=priority,
+            use_cache=use_cache,
+            image_ref=image_ref,
+            end_image_ref=end_image_ref,
+        )
+        task_id = task["id"]
+        self._store_inline_images([task])
+        cached = self._apply_cache([task])
+
+        with self._lock:
+            self._tasks[task_id] = task
+            self._pin_refs(task)
+            self._store.save(task)
+
+        if cached:
+            get_logger().info("视频任务命中结果缓存: %s - %s", task_id, prompt[:30])
+            self._finish_cached([task_id])
+        else:
+            get_logger().info("视频任务已添加: %s - %s", task_id, prompt[:30])
+            self._submit(task_id)
+
+        return self._task_summary(task)
+
+    def add_tasks(self, specs: list[dict]) -> list[dict]:
+        """
+        批量添加视频生成任务（一次加锁、一次登记落库），返回任务简要信息列表
+        - specs: [{"prompt", "model", "mode", "image_base64" / "image_ref" / "image_path",
+          "end_image_base64" / "end_image_ref" / "end_image_path", "priority"}, ...]
         """
-        task_id = str(uuid4())[:8]
-        task = {
-            "id": task_id,
+        tasks = [
+            self._new_task(
+                spec["prompt"],
+                spec["model"],
+                spec["mode"],
+                spec.get("image_base64", ""),
+                spec.get("end_image_base64", ""),
+                spec.get("image_path", ""),
+                spec.get("end_image_path", ""),
+                spec.get("priority", 0),
+                spec.get("use_cache", True),
+                spec.get("image_ref", ""),
+                spec.get("end_image_ref", ""),
+            )
+            for spec in specs
+        ]
+        if not tasks:
+            return []
+        self._store_inline_images(tasks)
+        cached = {task["id"] for task in self._apply_cache(tasks)}
+
+        with self._lock:
+            for task in tasks:
+                self._tasks[task["id"]] = task
+                self._pin_refs(task)
+            self._store.save_many(tasks)
+
+        get_logger().info("批量添加视频任务: %d 个（命中结果缓存 %d 个）", len(tasks), len(cached))
+
+        self._submit_many([task["id"] for task in tasks if task["id"] not in cached])
+        if cached:
+            self._finish_cached(list(cached))
+
+        return [self._task_brief(task) for task in tasks]
+
+    @staticmethod
+    def _new_task(
+        prompt: str,
+        model: str,
+        mode: str,
+        image_base64: str = "",
+        end_image_base64: str = "",
+        image_path: str = "",
+        end_image_path: str = "",
+        priority: int = 0,
+        use_cache: bool = True,
+        image_ref: str = "",
+        end_image_ref: str = "",
+    ) -> dict:
+        return {
+            "id": str(uuid4())[:8],
             "prompt": prompt,
             "model": model,
             "mode": mode,
             "image_base64": image_base64,
             "end_image_base64": end_image_base64,
+            "image_path": image_path,  # 批量导入的首帧 / 尾帧路径，执行时才读取
+            "end_image_path": end_image_path,
+            "image_ref": image_ref,  # 已上传首帧 / 尾帧的 blob 哈希，执行时才读取
+            "end_image_ref": end_image_ref,
             "status": "pending",
+            "priority": int(priority),
+            "use_cache": bool(use_cache),  # False 时跳过结果缓存，总是重新生成
+            "cache_key": "",  # 结果缓存键（缓存开启时计算）
+            "cached": False,  # 结果是否来自缓存
+            "attempts": [],  # 每次执行的记录：开始/结束时间、错误、重试等待秒数
+            "retry_count": 0,  # 本轮已自动重试的次数（手动重试时清零）
             "progress": [],
             "result_video": "",  # 视频 URL
             "error": "",
@@ -88,24 +230,86 @@ class VideoTaskManager:
             "file_path": "",
         }
 
-        with self._lock:
-            self._tasks[task_id] = task
-            self._task_order.append(task_id)
-
-        get_logger().info("视频任务已添加: %s - %s", task_id, prompt[:30])
-
-        future = self._pool.submit(self._execute_task, task_id)
-        self._futures[task_id] = future
+    def _store_inline_images(self, tasks: list[dict]):
+        """
+        直接提交的 base64 首帧 / 尾帧写入结果存储，任务中只保留句柄（与上传的参考图相同），
+        任务记录不再携带数 MB 的 base64，失败后重试也从存储读取
+        """
+        for task in tasks:
+            for key in ("image", "end_image"):
+                b64_data = task[f"{key}_base64"]
+                if not b64_data or task[f"{key}_ref"]:
+                    continue
+                try:
+                    task[f"{key}_ref"], _ = self._blobs.put_base64(b64_data)
+                except (ValueError, OSError) as e:
+                    get_logger().warning("[%s] 首帧 / 尾帧写入存储失败，保留在任务中: %s", task["id"], e)
+                    continue
+                task[f"{key}_base64"] = ""
+
+    # ===================== 结果缓存 =====================
+
+    def _apply_cache(self, tasks: list[dict]) -> list[dict]:
+        """缓存开启时计算缓存键，允许使用缓存且命中的任务直接标记为完成，返回命中的任务"""
+        if not is_result_cache_enabled():
+            return []
+        for task in tasks:
+            task["cache_key"] = make_cache_key(
+                "video",
+                task["prompt"],
+                task["model"],
+                task["mode"],
+                [task["image_base64"], task["end_image_base64"]],
+                [task["image_path"], task["end_image_path"]],
+                [task["image_ref"], task["end_image_ref"]],
+            )
+        hits = self._cache.get_many([task["cache_key"] for task in tasks if task["use_cache"]])
+        cached = []
+        for task in tasks:
+            result = hits.get(task["cache_key"]) if task["use_cache"] else None
+            if result:
+                task.update(result)
+                task["status"] = "done"
+                task["cached"] = True
+                task["image_base64"] = ""
+                task["end_image_base64"] = ""
+                cached.append(task)
+        return cached
+
+    def _finish_cached(self, task_ids: list[str]):
+        """命中缓存的任务：归档并推送完成，自动下载交给下载队列"""
+        for task_id in task_ids:
+            with self._lock:
+                task = self._tasks.get(task_id)
+            if not task:
+                continue
+            self._finish_task(task_id)
+            get_metrics().count("video", task["model"], "cached")
+            self._push_update(
+                task_id,
+                {
+                    "type": "done",
+                    "result_video": task["result_video"],
+                    "file_path": "",
+                    "cached": True,
+                },
+            )
+            self._queue_download(task)
 
-        return self._task_summary(task)
+    def _remember_result(self, key: str, video_url: str):
+        """把生成结果写入缓存（阻塞，在 IO 线程池中调用）"""
+        try:
+            self._cache.put(key, "video", {"result_video": video_url})
+        except Exception as e:
+            get_logger().warning("写入结果缓存失败: %s", e)
 
     def get_all_tasks(self) -> list[dict]:
-        """获取所有任务摘要列表"""
+        """获取所有任务摘要列表，活跃任务取内存中的最新状态"""
+        records = self._store.list()
         with self._lock:
             return [
-                self._task_summary(self._tasks[tid])
-                for tid in self._task_order
-                if tid in self._tasks
+                self._task_summary(self._tasks.get(t["id"], t))
+                for t in records
             ]
 
     def get_task(self, task_id: str) -> dict:
@@ -113,61 +317,190 @@ class VideoTaskManager:
             task = self._tasks.get(task_id)
             if task:
                 return self._task_summary(task)
-            return {}
+        task = self._store.get(task_id)
+        return self._task_summary(task) if task else {}
+
+    def list_tasks(self, limit: int = 100, after: str = "", status: str | list[str] = "") -> dict:
+        """
+        分页获取任务摘要（按创建时间排序，进度只带最后一条）
+        - after: 上一页返回的 next 游标，首页传空串
+        - status: 状态过滤，逗号分隔的字符串或列表
+        返回: {"tasks": [...], "next": 下一页游标（没有时为空串）, "version": 当前版本号}
+        """
+        version = self._store.version
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        records, cursor = self._store.page(limit, after, parse_statuses(status))
+        with self._lock:
+            tasks = [self._task_brief(self._tasks.get(t["id"], t)) for t in records]
+        return {"tasks": tasks, "next": cursor, "version": version}
+
+    def get_tasks_changed_since(self, version: int) -> dict:
+        """
+        增量获取 version 之后有变更的任务
+        返回: {"tasks": [...], "deleted": [task_id, ...], "version": 当前版本号, "reset": 是否需要全量刷新}
+        """
+        current = self._store.version
+        changes = self._store.changed_since(int(version))
+        if changes is None:
+            return {"tasks": [], "deleted": [], "version": current, "reset": True}
+        records, deleted = changes
+        with self._lock:
+            changed = {t["id"]: t for t in records if t["id"] not in self._tasks}
+            # 活跃任务的进度只更新内存（见 _handle_progress），以内存中的版本为准
+            for task in self._tasks.values():
+                if task.get("version", 0) > version:
+                    changed[task["id"]] = task
+            tasks = [self._task_brief(t) for t in changed.values()]
+        tasks.sort(key=lambda t: t["created_at"])
+        return {"tasks": tasks, "deleted": deleted, "version": current, "reset": False}
+
+    # ===================== 排队调整 =====================
+
+    def set_task_priority(self, task_id: str, priority: int) -> bool:
+        """调整排队中任务的优先级（数值越大越先执行），任务已开始或不存在时返回 False"""
+        priority = int(priority)
+        if not self._scheduler.set_priority(task_id, priority):
+            return False
+        self._update_priority(task_id, priority)
+        return True
+
+    def move_task_to_front(self, task_id: str) -> bool:
+        """把排队中的任务插到队首"""
+        priority = self._scheduler.move_to_front(task_id)
+        if priority is None:
+            return False
+        self._update_priority(task_id, priority)
+        return True
+
+    def _update_priority(self, task_id: str, priority: int):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task:
+                task["priority"] = priority
+                self._store.save(task)
+
+    def get_queue_positions(self) -> dict[str, int]:
+        """所有排队中任务的排队位置（从 1 开始）"""
+        return self._scheduler.positions()
+
+    def get_queue_stats(self) -> dict:
+        """调度器状态：总并发、运行中、排队中及各分组的并发占用"""
+        return self._scheduler.stats()
 
     def cancel_task(self, task_id: str) -> bool:
+        """取消排队中或运行中的任务，运行中的任务会立即断开连接并释放并发名额"""
         with self._lock:
             task = self._tasks.get(task_id)
-            if task and task["status"] == "pending":
-                task["status"] = "cancelled"
-                future = self._futures.get(task_id)
-                if future:
-                    future.cancel()
-                self._push_update(task_id, {"type": "cancelled"})
-                get_logger().info("视频任务已取消: %s", task_id)
-                return True
-        return False
+            if not task or task["status"] not in ("pending", "running"):
+                return False
+            task["status"] = "cancelled"
+            self._end_attempt(task, "", "cancelled")
+            token = self._tokens.get(task_id)
+        if token:
+            token.cancel()
+        self._finish_task(task_id)
+        self._push_update(task_id, {"type": "cancelled"})
+        get_logger().info("视频任务已取消: %s", task_id)
+        return True
 
     def delete_task(self, task_id: str) -> bool:
         with self._lock:
-            if task_id in self._tasks:
-                del self._tasks[task_id]
-                if task_id in self._task_order:
-                    self._task_order.remove(task_id)
-                self._futures.pop(task_id, None)
-                return True
-        return False
+            task = self._tasks.pop(task_id, None)
+            token = self._tokens.pop(task_id, None)
+            if task:
+                self._pin_refs(task, False)
+        if token:
+            # 删除运行中的任务时一并中止
+            token.cancel()
+        if task is None and self._store.get(task_id) is None:
+            return False
+        self._store.delete(task_id)
+        return True
 
     def clear_done_tasks(self) -> int:
-        count = 0
+        """清除所有已完成/失败/取消的任务，返回清除数量"""
+        return self._store.clear(FINISHED_STATUSES)
+
+    def _restore_tasks(self):
+        """启动时恢复上次未结束的任务：排队中的重新入队，运行中的标记为中断待重试"""
+        requeued, interrupted = [], 0
+        for task in self._store.list(ACTIVE_STATUSES):
+            if task["status"] == "running":
+                task["status"] = "error"
+                task["error"] = INTERRUPTED_ERROR
+                self._store.save(task)
+                interrupted += 1
+            else:
+                self._tasks[task["id"]] = task
+                self._pin_refs(task)
+                requeued.append(task["id"])
+        for task_id in requeued:
+            self._submit(task_id)
+        if requeued or interrupted:
+            get_logger().info("已恢复视频任务: %d 个重新排队, %d 个中断待重试", len(requeued), interrupted)
+
+    def _finish_task(self, task_id: str):
+        """任务结束（完成/失败/取消）：写入数据库并移出内存"""
         with self._lock:
-            to_remove = [
-                tid
-                for tid, t in self._tasks.items()
-                if t["status"] in ("done", "error", "cancelled")
-            ]
-            for tid in to_remove:
-                del self._tasks[tid]
-                self._task_order.remove(tid)
-                self._futures.pop(tid, None)
-                count += 1
-        return count
+            task = self._tasks.pop(task_id, None)
+            self._tokens.pop(task_id, None)
+            if task:
+                self._pin_refs(task, False)
+                self._store.save(task)
+
+    def _pin_refs(self, task: dict, pin: bool = True):
+        """固定/释放任务引用的已上传首帧 / 尾帧（任务在内存中期间不被存储淘汰）"""
+        for key in ("image_ref", "end_image_ref"):
+            ref = task.get(key)
+            if ref:
+                (self._blobs.pin if pin else self._blobs.unpin)(ref)
 
     # ===================== 任务执行 =====================
 
-    def _execute_task(self, task_id: str):
-        """在线程池中执行单个视频任务"""
+    def _submit(self, task_id: str, delay: float = 0):
+        """提交任务协程到异步引擎，并登记取消令牌（delay 为自动重试的退避时间）"""
+        token = CancelToken()
+        self._tokens[task_id] = token
+        token.bind(self._engine.submit(self._run_task(task_id, token, delay)))
+
+    def _submit_many(self, task_ids: list[str]):
+        """批量提交任务协程（只唤醒一次事件循环）"""
+        tokens = [CancelToken() for _ in task_ids]
+        for task_id, token in zip(task_ids, tokens):
+            self._tokens[task_id] = token
+        futures = self._engine.submit_many([
+            self._run_task(task_id, token) for task_id, token in zip(task_ids, tokens)
+        ])
+        for token, future in zip(tokens, futures):
+            token.bind(future)
+
+    async def _run_task(self, task_id: str, token: CancelToken, delay: float = 0):
+        """等待退避时间（不占用并发名额）后在调度器中按优先级排队，拿到名额后执行任务"""
+        if delay:
+            await asyncio.sleep(delay)
+        queued_at = time.time()
+        with self._lock:
+            task = self._tasks.get(task_id)
+        if not task:
+            return
+        async with self._scheduler.slot(task_id, task["model"], task["mode"], task.get("priority", 0)):
+            await self._execute_task(task_id, token, queued_at)
+
+    async def _execute_task(self, task_id: str, token: CancelToken, queued_at: float):
+        """在事件循环中执行单个视频任务，各阶段的时间点记录在本次执行记录中（见 metrics.PHASE_MARKS）"""
         logger = get_logger()
 
         with self._lock:
             task = self._tasks.get(task_id)
-            if not task or task["status"] == "cancelled":
+            if not task or token.cancelled:
                 return
             task["status"] = "running"
+            task.setdefault("attempts", []).append({"queued_at": queued_at, "started_at": time.time()})
+            self._store.save(task)
 
         self._push_update(task_id, {"type": "status", "status": "running"})
 
-        api_base = "https://hetang.lyvideo.top"
+        api_base = http_client.get_api_base()
         api_key = get_setting("api_key")
 
         if not api_key:
@@ -176,24 +509,33 @@ class VideoTaskManager:
 
         url = f"{api_base.rstrip('/')}/v1/chat/completions"
 
-        # 构建 messages
-        if task["mode"] == "img2video" and task["image_base64"]:
+        # 构建 messages（批量导入的任务此时才读取首帧 / 尾帧）
+        image_base64 = end_image_base64 = ""
+        if task["mode"] == "img2video":
+            try:
+                image_base64 = await self._load_reference(task, "image")
+                end_image_base64 = await self._load_reference(task, "end_image")
+            except OSError as e:
+                self._fail_task(task_id, f"参考图读取失败: {e}")
+                return
+
+        if task["mode"] == "img2video" and image_base64:
             content = [
                 {"type": "text", "text": task["prompt"]},
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{task['image_base64']}"
+                        "url": f"data:image/jpeg;base64,{image_base64}"
                     },
                 },
             ]
             # 如果有尾帧
-            if task["end_image_base64"]:
+            if end_image_base64:
                 content.append(
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{task['end_image_base64']}"
+                            "url": f"data:image/jpeg;base64,{end_image_base64}"
                         },
                     }
                 )
@@ -218,84 +560,55 @@ class VideoTaskManager:
             task["prompt"][:30],
         )
 
+        upstream = get_upstream_limiter(api_key)
+        self._mark(task, "prepared")
         try:
-            response = requests.post(
-                url, json=payload, headers=headers, stream=True, timeout=600
-            )
-            response.raise_for_status()
-
-            full_content = ""
-            buffer = ""
-
-            for line in response.iter_lines(decode_unicode=True):
-                with self._lock:
-                    t = self._tasks.get(task_id)
-                    if not t or t["status"] == "cancelled":
-                        logger.info("[%s] 视频任务已被取消，终止请求", task_id)
-                        return
-
-                if not line:
-                    buffer = ""
-                    continue
-
-                if line.startswith("data: "):
-                    data_str = line[6:]
-                    if data_str.strip() == "[DONE]":
-                        break
-                    buffer = data_str
-                else:
-                    buffer += line
-
+            # 上游限流：令牌桶 + 自适应并发，名额占用到流读取结束
+            async with upstream.slot():
+                self._mark(task, "sent")
+                started = time.monotonic()
                 try:
-                    data = json.loads(buffer)
-                except json.JSONDecodeError:
-                    continue
-
-                buffer = ""
+                    response = await http_client.request(
+                        "POST", url, json_body=payload, headers=headers, timeout=600
+                    )
+                except (asyncio.TimeoutError, http_client.ConnectError):
+                    upstream.record_failure()
+                    raise
                 try:
-                    delta = data["choices"][0]["delta"]
-
-                    reasoning = delta.get("reasoning_content", "")
-                    if reasoning:
-                        text = reasoning.strip()
-                        if text:
-                            with self._lock:
-                                task["progress"].append(text)
-                            self._push_update(
-                                task_id,
-                                {"type": "progress", "progress_text": text},
-                            )
-
-                    content_piece = delta.get("content", "")
-                    if content_piece:
-                        full_content += content_piece
-
-                except (KeyError, IndexError):
-                    continue
+                    upstream.record_response(response.status, time.monotonic() - started, response.headers)
+                    self._mark(task, "headers", connect=response.timing.get("connect", 0))
+                    full_content = await self._read_stream(task_id, task, response)
+                finally:
+                    response.close()
+                self._mark(task, "streamed")
 
             # 提取视频 URL
             video_url = self._extract_video(full_content)
             if video_url:
                 logger.info("[%s] 视频生成成功", task_id)
                 with self._lock:
+                    if token.cancelled:
+                        return
                     task["status"] = "done"
+                    self._end_attempt(task, "", "done")
                     task["result_video"] = video_url
                     task["image_base64"] = ""
                     task["end_image_base64"] = ""
 
-                # 自动下载
-                file_path = self._auto_download(
-                    task_id, video_url, task["prompt"]
-                )
+                if task.get("cache_key"):
+                    await self._engine.run_blocking(self._remember_result, task["cache_key"], video_url)
 
+                # 先推送完成并释放生成名额，自动下载在下载队列中进行，完成后推送 downloaded
+                self._finish_task(task_id)
                 self._push_update(
                     task_id,
                     {
                         "type": "done",
                         "result_video": video_url,
-                        "file_path": file_path,
+                        "file_path": "",
                     },
                 )
+                self._queue_download(task)
             else:
                 # 检查是否有错误信息在 progress 中
                 error_msg = "未能从响应中提取视频"
@@ -309,46 +622,179 @@ class VideoTaskManager:
                 )
                 self._fail_task(task_id, error_msg)
 
-        except requests.exceptions.Timeout:
-            self._fail_task(task_id, "请求超时，请重试")
-        except requests.exceptions.ConnectionError:
-            self._fail_task(task_id, "无法连接到 API 服务器")
+        except asyncio.TimeoutError as e:
+            self._fail_task(task_id, "请求超时，请重试", e)
+        except http_client.ConnectError as e:
+            self._fail_task(task_id, "无法连接到 API 服务器", e)
+        except http_client.HTTPStatusError as e:
+            if e.status in OVERLOAD_STATUSES:
+                self._fail_task(task_id, f"上游服务繁忙 ({e.status})，已自动降低并发，请稍后重试", e)
+            else:
+                logger.error("[%s] 视频生成失败: %s", task_id, e)
+                self._fail_task(task_id, str(e), e)
         except Exception as e:
             logger.error("[%s] 视频生成失败: %s", task_id, e)
-            self._fail_task(task_id, str(e))
+            self._fail_task(task_id, str(e), e)
+
+    async def _load_reference(self, task: dict, key: str) -> str:
+        """读取首帧 / 尾帧（已上传的按句柄从存储读取，批量导入的从文件读取）并预处理，返回上传用的 base64"""
+        b64_data = task.get(f"{key}_base64", "")
+        if b64_data and key in task.get("image_prep", {}):
+            return b64_data  # 自动重试：任务中已是处理后的图片
+        ref, path = task.get(f"{key}_ref", ""), task.get(f"{key}_path", "")
+        source_hash = ""  # 原图内容哈希：已上传的句柄即为 sha256，预处理缓存直接使用
+        if not b64_data and ref:
+            b64_data = await self._engine.run_blocking(self._blobs.read_base64, ref)
+            if b64_data is None:
+                raise FileNotFoundError("参考图已失效，请重新上传")
+            source_hash = ref
+        elif not b64_data and path:
+            b64_data = await self._engine.run_blocking(read_image_base64, path)
+        b64_data, info = await self._prep.prepare(self._engine, b64_data, task["model"], source_hash)
+        if info:
+            get_logger().info(
+                "[%s] 参考图已预处理: %d KB -> %d KB", task["id"], info["before"] // 1024, info["after"] // 1024
+            )
+            with self._lock:
+                task.setdefault("image_prep", {})[key] = info
+                if task.get(f"{key}_base64"):
+                    # 排队重试期间只保留处理后的图片
+                    task[f"{key}_base64"] = b64_data
+        return b64_data
+
+    async def _read_stream(
+        self, task_id: str, task: dict, response: http_client.AsyncResponse
+    ) -> str:
+        """读取 SSE 流，推送进度，返回拼接后的 content"""
+        response.raise_for_status()
+
+        stream = ChatStream()
+        # 取消由 CancelToken 直接中断本协程（连接在调用方 finally 中关闭），无需逐块检查
+        async for chunk in response.iter_chunks():
+            self._handle_progress(task_id, task, stream.feed(chunk))
+            if stream.done:
+                break
+        else:
+            self._handle_progress(task_id, task, stream.close())
+
+        # 读完 [DONE] 之后的结束块，让连接回到连接池复用
+        await response.drain()
+        return stream.content.getvalue()
+
+    def _handle_progress(self, task_id: str, task: dict, texts: list[str]):
+        """记录并推送 reasoning_content 进度"""
+        for text in texts:
+            with self._lock:
+                task["progress"].append(text)
+                self._store.touch(task)
+            self._push_update(
+                task_id,
+                {"type": "progress", "progress_text": text},
+            )
 
     def retry_task(self, task_id: str) -> dict:
         """重试失败的任务"""
+        task = self._store.get(task_id)
         with self._lock:
-            task = self._tasks.get(task_id)
-            if not task or task["status"] not in ("error", "cancelled"):
+            if not task or task_id in self._tasks or task["status"] not in ("error", "cancelled"):
                 return {}
             task["status"] = "pending"
             task["progress"] = []
             task["result_video"] = ""
             task["error"] = ""
             task["file_path"] = ""
+            task.pop("download", None)
+            task["retry_count"] = 0
+            task["cached"] = False
+            self._tasks[task_id] = task
+            self._pin_refs(task)
+            self._store.save(task)
 
         get_logger().info("视频任务重试: %s", task_id)
 
-        future = self._pool.submit(self._execute_task, task_id)
-        self._futures[task_id] = future
+        self._submit(task_id)
 
         with self._lock:
             return self._task_summary(task)
 
-    def _fail_task(self, task_id: str, error: str):
+    def _fail_task(self, task_id: str, error: str, exc: BaseException | None = None):
+        """标记任务失败；exc 属于可重试的错误且未超过最大尝试次数时，退避后重新进入调度器排队"""
+        delay = None
+        policy = get_retry_policy("video")
         with self._lock:
             task = self._tasks.get(task_id)
-            if task:
+            if not task or task["status"] == "cancelled":
+                return
+            retry = task.get("retry_count", 0) + 1
+            reason = policy.reason(exc)
+            if reason and retry < policy.max_attempts:
+                delay = policy.delay(retry, exc)
+                self._end_attempt(task, error, "retry")
+                task["status"] = "pending"
+                task["retry_count"] = retry
+                task["attempts"][-1]["retry_in"] = round(delay, 1)
+                self._store.save(task)
+            else:
+                self._end_attempt(task, error, "error")
                 task["status"] = "error"
                 task["error"] = error
                 # 不清除 image_base64，保留以便重试
+        if delay is not None:
+            get_logger().warning(
+                "[%s] 第 %d 次执行失败 (%s)，%.1f 秒后自动重试: %s", task_id, retry, reason, delay, error
+            )
+            self._push_update(task_id, {"type": "retrying", "retry_count": retry, "delay": round(delay, 1), "error": error})
+            self._submit(task_id, delay)
+            return
+        self._finish_task(task_id)
         self._push_update(task_id, {"type": "error", "error": error})
         get_logger().error("[%s] 视频任务失败: %s", task_id, error)
 
+    def _mark(self, task: dict, phase: str, **extra):
+        """记录本次执行到达某阶段的时间点（{phase}_at）"""
+        with self._lock:
+            attempt = task["attempts"][-1]
+            attempt[f"{phase}_at"] = time.time()
+            attempt.update(extra)
+
+    def _end_attempt(self, task: dict, error: str, outcome: str):
+        """补全本次执行记录并计入指标（调用方持有锁），outcome: done / retry / error / cancelled"""
+        attempts = task.get("attempts")
+        if attempts and "ended_at" not in attempts[-1]:
+            attempts[-1]["ended_at"] = time.time()
+            attempts[-1]["error"] = error
+            get_metrics().observe_attempt("video", task["model"], attempts[-1], outcome)
+
     # ===================== 自动下载 =====================
 
+    def _queue_download(self, task: dict):
+        """启用自动下载时把已完成任务的视频放入下载队列"""
+        if is_auto_download_enabled():
+            get_download_queue().submit(
+                self._download_result, task["id"], task["model"], task["result_video"], task["prompt"], time.time()
+            )
+
+    def _download_result(self, task_id: str, model: str, video_url: str, prompt: str, queued_at: float):
+        """下载队列中执行：自动保存视频，记录文件路径和下载耗时并推送 downloaded"""
+        started_at = time.time()
+        file_path = self._auto_download(task_id, video_url, prompt)
+        timing = {"queued_at": queued_at, "started_at": started_at, "ended_at": time.time()}
+        get_metrics().observe("video", model, {
+            "download_wait": started_at - queued_at,
+            "download": timing["ended_at"] - started_at,
+        })
+        if not file_path:
+            self._push_update(task_id, {"type": "download_failed"})
+            return
+        with self._lock:
+            task = self._store.get(task_id)
+            if not task or task_id in self._tasks:
+                return  # 已删除或已重新执行
+            task["file_path"] = file_path
+            task["download"] = timing
+            self._store.save(task)
+        self._push_update(task_id, {"type": "downloaded", "file_path": file_path})
+
     def _auto_download(self, task_id: str, video_url: str, prompt: str) -> str:
         """如果启用自动下载，保存视频到本地"""
         auto = get_setting("auto_download")
@@ -367,23 +813,14 @@ class VideoTaskManager:
                 get_logger().error("[%s] 无法创建下载目录: %s", task_id, e)
                 return ""
 
+        # 文件名带任务 ID，同一秒完成的相同提示词不会互相覆盖
         ts = time.strftime("%Y%m%d_%H%M%S")
         safe_prompt = re.sub(r"[^\w\u4e00-\u9fff]", "", prompt)[:10]
-        filename = f"hetangai_video_{ts}_{safe_prompt}.mp4"
+        filename = f"hetangai_video_{ts}_{safe_prompt}_{task_id}.mp4"
         file_path = dl_dir / filename
 
         try:
-            resp = requests.get(video_url, timeout=120)
-            resp.raise_for_status()
-
-            with open(file_path, "wb") as f:
-                f.write(resp.content)
-
-            with self._lock:
-                task = self._tasks.get(task_id)
-                if task:
-                    task["file_path"] = str(file_path)
-
+            self._download_video(task_id, video_url, file_path)
             get_logger().info("[%s] 视频已自动保存: %s", task_id, file_path)
             return str(file_path)
 
@@ -391,20 +828,36 @@ class VideoTaskManager:
             get_logger().error("[%s] 视频自动下载失败: %s", task_id, e)
             return ""
 
+    def save_task_video(self, task_id: str, file_path: str) -> str:
+        """将已完成任务的视频保存到指定路径（手动保存），返回文件路径，失败返回空串"""
+        video_url = self.get_task_video(task_id)
+        if not video_url:
+            return ""
+        try:
+            self._download_video(task_id, video_url, Path(file_path))
+            get_logger().info("视频已保存: %s", file_path)
+            return file_path
+        except Exception as e:
+            get_logger().error("保存视频失败: %s", e)
+            return ""
+
+    def _download_video(self, task_id: str, video_url: str, file_path: Path):
+        """下载视频到 file_path（大文件分段并行、断点续传）并推送下载进度"""
+        download_resumable(
+            video_url,
+            file_path,
+            timeout=120,
+            on_progress=lambda done, total: self._push_update(
+                task_id,
+                {"type": "download_progress", "downloaded": done, "total": total},
+            ),
+        )
+
     # ===================== 推送与工具方法 =====================
 
     def _push_update(self, task_id: str, data: dict):
-        """通过 evaluate_js 推送任务状态更新到前端"""
-        if not self._window:
-            return
-        data["task_id"] = task_id
-        try:
-            json_str = json.dumps(data, ensure_ascii=True)
-            self._window.evaluate_js(
-                f"window.__onVideoTaskUpdate && window.__onVideoTaskUpdate({json_str})"
-            )
-        except Exception:
-            pass
+        """推送任务状态更新到前端（由推送调度器按帧合并批量发送，不阻塞调用方）"""
+        self._dispatcher.push("__onVideoTaskUpdate", task_id, data)
 
     def _task_summary(self, task: dict) -> dict:
         """生成任务摘要（不含大字段）"""
@@ -414,6 +867,12 @@ class VideoTaskManager:
             "model": task["model"],
             "mode": task["mode"],
             "status": task["status"],
+            "priority": task.get("priority", 0),
+            "retry_count": task.get("retry_count", 0),
+            "attempts": task.get("attempts", []),
+            "download": task.get("download", {}),
+            "cached": task.get("cached", False),
+            "image_prep": task.get("image_prep", {}),
             "progress": task["progress"],
             "result_video": task["result_video"],
             "error": task["error"],
@@ -421,12 +880,22 @@ class VideoTaskManager:
             "file_path": task["file_path"],
         }
 
+    def _task_brief(self, task: dict) -> dict:
+        """分页/增量列表用的精简摘要：进度只带最后一条"""
+        brief = self._task_summary(task)
+        brief["progress"] = task["progress"][-1:]
+        brief["progress_count"] = len(task["progress"])
+        brief["version"] = task.get("version", 0)
+        return brief
+
     def get_task_video(self, task_id: str) -> str:
         """获取任务的视频 URL"""
         with self._lock:
             task = self._tasks.get(task_id)
-            if task and task["status"] == "done":
-                return task["result_video"]
+        if task is None:
+            task = self._store.get(task_id)
+        if task and task["status"] == "done":
+            return task["result_video"]
         return ""
 
     @staticmethod
@@ -458,5 +927,8 @@ class VideoTaskManager:
         return ""
 
     def shutdown(self):
-        if self._pool:
-            self._pool.shutdown(wait=False)
+        """取消所有未完成的任务协程并写入剩余的任务记录（未结束的任务下次启动时恢复）"""
+        self._unsubscribe()
+        for token in list(self._tokens.values()):
+            token.cancel()
+        self._store.close()
@@ -0,0 +1,159 @@
+"""
+SQLite 读写基准测试
+- 对比 SQLite 默认配置（DELETE 日志、synchronous=FULL）与 database.SQLITE_PRAGMAS（WAL 等）
+- 每种配置使用新的临时数据库，多个线程并发执行（每个线程一个连接，结束时关闭）：
+  settings-write - set_setting（REPLACE，自动提交）
+  settings-read  - 按主键查询 Setting 表（缓存前 get_setting 的做法），以及内存缓存的 get_setting
+  task-write     - 每个线程一个 TaskStore，save 后 flush（批量事务落库）
+  task-read      - 写入进行中时并发分页读取任务列表
+
+运行: python -m bench.bench_db [--threads 8] [--ops 300] [--profiles default,tuned]
+"""
+
+import sys
+import time
+import tempfile
+import argparse
+import threading
+from pathlib import Path
+
+from backend.database import (
+    init_db,
+    get_setting,
+    set_setting,
+    close_thread_connection,
+    Setting,
+    SQLITE_PRAGMAS,
+)
+from backend.task_store import TaskStore
+
+
+PROFILES = {
+    "default": {},
+    "tuned": SQLITE_PRAGMAS,
+}
+TASK_BATCH = 20  # task-write 每次 flush 的任务数
+PAGE_SIZE = 100
+
+
+def run_threads(count: int, target, *args) -> float:
+    """启动 count 个线程同时执行 target(i, *args)，返回总耗时"""
+    barrier = threading.Barrier(count + 1)
+    errors: list[BaseException] = []
+
+    def worker(i: int):
+        barrier.wait()
+        try:
+            target(i, *args)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            close_thread_connection()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return elapsed
+
+
+def settings_write(i: int, ops: int):
+    for n in range(ops):
+        set_setting(f"bench_{i}", str(n))
+
+
+def settings_read_db(i: int, ops: int):
+    for _ in range(ops):
+        Setting.get_by_id("api_key")
+
+
+def settings_read_cached(i: int, ops: int):
+    for _ in range(ops):
+        get_setting("api_key")
+
+
+def _task(i: int, n: int) -> dict:
+    return {
+        "id": f"{i:02d}{n:06d}",
+        "prompt": "基准测试提示词 " * 8,
+        "model": "gemini-3.0-pro-image-landscape",
+        "mode": "text2img",
+        "status": "done",
+        "progress": ["步骤"] * 5,
+        "created_at": time.time(),
+    }
+
+
+def task_write(i: int, ops: int):
+    store = TaskStore(f"bench{i}", flush_interval=3600)
+    try:
+        for start in range(0, ops, TASK_BATCH):
+            store.save_many([_task(i, n) for n in range(start, min(start + TASK_BATCH, ops))])
+            store.flush()
+    finally:
+        store.close()
+
+
+def task_read(i: int, stop: threading.Event, counter: list[int]):
+    store = TaskStore("bench0", flush_interval=3600)
+    try:
+        while not stop.is_set():
+            store.page(PAGE_SIZE)
+            counter[i] += 1
+    finally:
+        store.close()
+
+
+def bench_profile(name: str, threads: int, ops: int) -> list[tuple[str, float, int]]:
+    """返回 [(场景, 耗时, 操作数), ...]"""
+    with tempfile.TemporaryDirectory() as tmp:
+        init_db(Path(tmp) / "bench.db", PROFILES[name])
+        results = []
+        total = threads * ops
+
+        results.append(("settings-write", run_threads(threads, settings_write, ops), total))
+        results.append(("settings-read (db)", run_threads(threads, settings_read_db, ops * 10), total * 10))
+        results.append(("settings-read (cache)", run_threads(threads, settings_read_cached, ops * 10), total * 10))
+
+        # 写入线程与读取线程同时运行，读取数按写入耗时折算吞吐
+        readers = max(1, threads // 2)
+        stop = threading.Event()
+        counter = [0] * readers
+        reader_thread = threading.Thread(target=run_threads, args=(readers, task_read, stop, counter))
+        reader_thread.start()
+        write_time = run_threads(threads, task_write, ops)
+        stop.set()
+        reader_thread.join()
+        results.append(("task-write", write_time, total))
+        results.append((f"task-read (page={PAGE_SIZE})", write_time, sum(counter)))
+        close_thread_connection()
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="SQLite 并发读写吞吐基准")
+    parser.add_argument("--threads", type=int, default=8, help="并发线程数")
+    parser.add_argument("--ops", type=int, default=300, help="每个线程的操作数")
+    parser.add_argument("--profiles", default="default,tuned", help="配置，逗号分隔：default / tuned")
+    args = parser.parse_args(argv)
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        print(f"未知配置: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    print(f"{'profile':<8} {'scenario':<22} {'seconds':>9} {'ops':>8} {'ops/s':>10}")
+    for profile in profiles:
+        for scenario, seconds, ops in bench_profile(profile, args.threads, args.ops):
+            print(f"{profile:<8} {scenario:<22} {seconds:>9.3f} {ops:>8} {ops / seconds:>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+端到端吞吐基准测试
+- 启动本地模拟上游（bench.mock_upstream，默认在子进程中运行，不计入本进程的内存和线程），
+  把 api_base 指向它，通过 TaskManager / VideoTaskManager 批量提交任务直到全部结束
+- 报告：任务吞吐（tasks/s）、端到端延迟 p50 / p95 / p99（提交到 done 推送，开启 --download 时到下载完成）、
+  成功 / 失败 / 重试数、峰值 RSS、峰值线程数、各阶段平均耗时（backend.metrics）、
+  模拟上游统计（请求数、峰值并发、注入的错误）
+- 在临时数据目录中运行（HETANGAI_DATA_DIR），不影响桌面版的数据库和结果存储
+
+运行: python -m bench.bench_e2e [--kind image|video] [--tasks 200] [--concurrency 16] [--download]
+      [--latency 0.5] [--steps 4] [--interval 0.2] [--image-kb 512] [--error-rate 0.05] [--errors 503,stream]
+      [--upstream http://127.0.0.1:8800]（使用已启动的模拟上游，此时模拟参数无效）
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+import subprocess
+import urllib.request
+
+from bench.mock_upstream import add_config_arguments, config_from_args
+
+
+DEFAULT_MODELS = {"image": "gemini-3.0-pro-image-landscape", "video": "veo_3_1_t2v_fast_landscape"}
+TERMINAL_EVENTS = ("done", "error", "cancelled")
+SAMPLE_INTERVAL = 0.05  # 线程数采样间隔（秒）
+MB = 1024 * 1024
+
+
+def peak_rss_mb() -> float | None:
+    """本进程的峰值 RSS（MB），无法获取时返回 None"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / MB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """监听推送调度器的任务更新，记录每个任务的结束时间"""
+
+    def __init__(self, wait_download: bool):
+        self._wait_download = wait_download
+        self._cond = threading.Condition()
+        self.submitted: dict[str, float] = {}
+        self.finished: dict[str, tuple[str, float]] = {}  # task_id -> (状态, 结束时间)
+        self.retries = 0
+
+    def on_update(self, callback: str, data: dict):
+        now = time.perf_counter()
+        kind = data.get("type")
+        event = data.get("status") if kind == "status" else kind
+        task_id = data.get("task_id", "")
+        with self._cond:
+            if event == "retrying":
+                self.retries += 1
+            elif event in ("downloaded", "download_failed"):
+                self.finished[task_id] = ("done" if event == "downloaded" else "download_failed", now)
+            elif event in TERMINAL_EVENTS and not (event == "done" and self._wait_download):
+                self.finished[task_id] = (event, now)
+            self._cond.notify_all()
+
+    def submit(self, task_ids: list[str], at: float):
+        with self._cond:
+            for task_id in task_ids:
+                self.submitted[task_id] = at
+
+    def wait(self, count: int, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self.finished) >= count, timeout)
+
+    def latencies(self) -> list[float]:
+        with self._cond:
+            return [
+                end - self.submitted[task_id]
+                for task_id, (status, end) in self.finished.items()
+                if status == "done" and task_id in self.submitted
+            ]
+
+    def count(self, status: str) -> int:
+        with self._cond:
+            return sum(1 for s, _ in self.finished.values() if s == status)
+
+
+class ThreadSampler:
+    """后台采样本进程的线程数峰值"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_mock(argv: list[str]) -> tuple[subprocess.Popen, str]:
+    """以子进程启动模拟上游，返回 (进程, 地址)"""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_upstream", "--port", "0", *argv],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    url = proc.stdout.readline().strip()
+    if not url:
+        proc.kill()
+        raise RuntimeError("模拟上游启动失败")
+    return proc, url
+
+
+def mock_argv(args: argparse.Namespace) -> list[str]:
+    argv = [
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--steps", str(args.steps),
+        "--interval", str(args.interval),
+        "--image-kb", str(args.image_kb),
+        "--result", args.result,
+        "--video-kb", str(args.video_kb),
+        "--error-rate", str(args.error_rate),
+        "--errors", args.errors,
+    ]
+    if args.seed is not None:
+        argv += ["--seed", str(args.seed)]
+    return argv
+
+
+def fetch_stats(url: str) -> dict:
+    try:
+        with urllib.request.urlopen(f"{url}/stats", timeout=5) as resp:
+            return json.loads(resp.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def run(args: argparse.Namespace, upstream: str, data_dir: str) -> dict:
+    os.environ["HETANGAI_DATA_DIR"] = data_dir
+    from backend.database import init_db, override_settings, close_thread_connection
+    from backend.engine import shutdown_engine
+    from backend.update_dispatcher import get_dispatcher, shutdown_dispatcher
+    from backend.download_queue import shutdown_download_queue
+    from backend.metrics import get_metrics
+
+    init_db()
+    override_settings({
+        "api_key": "bench",
+        "api_base": upstream,
+        "thread_pool_size": str(args.concurrency),
+        "video_thread_pool_size": str(args.concurrency),
+        "rate_limit_rps": str(args.rps),
+        "adaptive_concurrency": "true" if args.adaptive else "false",
+        "result_cache_enabled": "false",
+        "auto_download": "true" if args.download else "false",
+        "download_path": os.path.join(data_dir, "downloads") if args.download else "",
+    })
+    recorder = Recorder(args.download)
+    get_dispatcher().add_listener(recorder.on_update)
+
+    if args.kind == "video":
+        from backend.video_task_manager import VideoTaskManager
+
+        manager = VideoTaskManager()
+    else:
+        from backend.task_manager import TaskManager
+
+        manager = TaskManager()
+
+    model = args.model or DEFAULT_MODELS[args.kind]
+    mode = "text2video" if args.kind == "video" else "text2img"
+    specs = [
+        {"prompt": f"基准测试 {i}", "model": model, "mode": mode, "use_cache": False}
+        for i in range(args.tasks)
+    ]
+
+    with ThreadSampler() as sampler:
+        start = time.perf_counter()
+        for i in range(0, len(specs), args.batch):
+            submitted_at = time.perf_counter()
+            briefs = manager.add_tasks(specs[i:i + args.batch])
+            recorder.submit([b["id"] for b in briefs], submitted_at)
+        completed = recorder.wait(args.tasks, args.timeout)
+        elapsed = time.perf_counter() - start
+
+    phases = get_metrics().snapshot()["tasks"].get(args.kind, {}).get(model, {}).get("phases", {})
+    manager.shutdown()
+    shutdown_download_queue()
+    shutdown_dispatcher()
+    shutdown_engine()
+    close_thread_connection()
+
+    latencies = recorder.latencies()
+    return {
+        "completed": completed,
+        "seconds": elapsed,
+        "done": recorder.count("done"),
+        "error": recorder.count("error"),
+        "download_failed": recorder.count("download_failed"),
+        "retries": recorder.retries,
+        "latencies": latencies,
+        "peak_threads": sampler.peak,
+        "peak_rss_mb": peak_rss_mb(),
+        "phases": phases,
+    }
+
+
+def print_report(args: argparse.Namespace, result: dict, upstream_stats: dict):
+    latencies = result["latencies"]
+    rss = result["peak_rss_mb"]
+    print(f"kind={args.kind} tasks={args.tasks} concurrency={args.concurrency} download={args.download}")
+    if not result["completed"]:
+        print(f"超时：{args.timeout}s 内只结束了 {result['done'] + result['error']} 个任务")
+    print(f"{'seconds':<22}{result['seconds']:.2f}")
+    print(f"{'tasks/s':<22}{result['done'] / result['seconds']:.2f}")
+    print(f"{'done / error':<22}{result['done']} / {result['error'] + result['download_failed']}")
+    print(f"{'retries':<22}{result['retries']}")
+    for pct in (50, 95, 99):
+        print(f"{f'latency p{pct}':<22}{percentile(latencies, pct):.3f}s")
+    print(f"{'peak rss':<22}{f'{rss:.1f} MB' if rss is not None else 'n/a'}")
+    print(f"{'peak threads':<22}{result['peak_threads']}")
+    for phase, hist in result["phases"].items():
+        print(f"{f'phase {phase}':<22}avg {hist['avg']:.3f}s  p95 <= {hist['p95']}s  (n={hist['count']})")
+    if upstream_stats:
+        print(f"{'upstream':<22}{json.dumps(upstream_stats, ensure_ascii=False)}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="端到端吞吐基准（本地模拟上游）")
+    parser.add_argument("--kind", choices=("image", "video"), default="image", help="任务类型")
+    parser.add_argument("--tasks", type=int, default=200, help="任务数")
+    parser.add_argument("--concurrency", type=int, default=16, help="任务并发数")
+    parser.add_argument("--model", default="", help="模型（默认按任务类型选择）")
+    parser.add_argument("--batch", type=int, default=500, help="每次 add_tasks 提交的任务数")
+    parser.add_argument("--rps", type=float, default=0, help="上游限流（rate_limit_rps），0 为不限")
+    parser.add_argument("--adaptive", action="store_true", help="开启自适应并发")
+    parser.add_argument("--download", action="store_true", help="开启自动下载，延迟统计到下载完成")
+    parser.add_argument("--timeout", type=float, default=600, help="等待全部任务结束的超时（秒）")
+    parser.add_argument("--upstream", default="", help="使用已启动的模拟上游地址，不再自动启动")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        config_from_args(args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    proc = None
+    upstream = args.upstream.rstrip("/")
+    if not upstream:
+        proc, upstream = start_mock(mock_argv(args))
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            result = run(args, upstream, data_dir)
+        print_report(args, result, fetch_stats(upstream))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    return 0 if result["completed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+SSE 解析基准测试
+- 对比旧的逐行 json.loads + 字符串 += 实现与 backend.sse.ChatStream
+- 负载：1 MB / 10 MB / 50 MB 的 base64 图片，按 64 KB 网络块喂入
+- 三种流形态：
+  single  - 整张图在一条 data 中（image.md 中 -4k 模型的返回）
+  deltas  - 图片拆成大量 16 KB 的 content 增量事件
+  wrapped - 单条 data 被拆成不带 "data:" 前缀的续行（旧实现会反复 json.loads）
+
+运行: python -m bench.bench_sse [--sizes 1,10,50]
+"""
+
+import sys
+import json
+import time
+import base64
+import argparse
+
+from backend.sse import ChatStream
+
+
+NET_CHUNK = 64 * 1024
+DELTA_SIZE = 16 * 1024
+WRAP_WIDTH = 4096
+# 旧实现在 wrapped 形态下是二次方复杂度，超过该大小不再测试
+LEGACY_WRAPPED_LIMIT_MB = 1
+
+
+def _event(delta: dict) -> str:
+    payload = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta}]}
+    return "data: " + json.dumps(payload) + "\n\n"
+
+
+def build_stream(size_mb: int, shape: str) -> bytes:
+    raw = bytes(range(256)) * (size_mb * 1024 * 1024 * 3 // 4 // 256)
+    image = "![Generated Image](data:image/jpeg;base64," + base64.b64encode(raw).decode() + ")"
+
+    parts = [_event({"reasoning_content": f"步骤 {i}\n"}) for i in range(5)]
+    if shape == "single":
+        parts.append(_event({"content": image}))
+    elif shape == "deltas":
+        for i in range(0, len(image), DELTA_SIZE):
+            parts.append(_event({"content": image[i:i + DELTA_SIZE]}))
+    elif shape == "wrapped":
+        line = _event({"content": image}).rstrip("\n")
+        wrapped = "\n".join(line[i:i + WRAP_WIDTH] for i in range(0, len(line), WRAP_WIDTH))
+        parts.append(wrapped + "\n\n")
+    parts.append("data: [DONE]\n\n")
+    return "".join(parts).encode("utf-8")
+
+
+def iter_net_chunks(data: bytes):
+    for i in range(0, len(data), NET_CHUNK):
+        yield data[i:i + NET_CHUNK]
+
+
+def run_legacy(data: bytes) -> str:
+    """旧实现：按行解码，续行拼接后反复 json.loads，content 用 += 拼接"""
+    full_content = ""
+    buffer = ""
+    pending = b""
+    lines = []
+    for chunk in iter_net_chunks(data):
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        lines.extend(complete)
+    for raw_line in lines:
+        line = raw_line.decode("utf-8")
+        if not line:
+            buffer = ""
+            continue
+        if line.startswith("data: "):
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            buffer = data_str
+        else:
+            buffer += line
+        try:
+            obj = json.loads(buffer)
+        except json.JSONDecodeError:
+            continue
+        buffer = ""
+        delta = obj["choices"][0]["delta"]
+        content_piece = delta.get("content", "")
+        if content_piece:
+            full_content += content_piece
+    return full_content
+
+
+def run_chat_stream(data: bytes) -> str:
+    stream = ChatStream()
+    for chunk in iter_net_chunks(data):
+        stream.feed(chunk)
+        if stream.done:
+            break
+    else:
+        stream.close()
+    return stream.content.getvalue()
+
+
+def measure(fn, data: bytes) -> tuple[float, str]:
+    start = time.perf_counter()
+    result = fn(data)
+    return time.perf_counter() - start, result
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="SSE 解析吞吐基准")
+    parser.add_argument("--sizes", default="1,10,50", help="负载大小（MB），逗号分隔")
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    print(f"{'shape':<8} {'size':>6} {'impl':<8} {'seconds':>9} {'MB/s':>9}")
+    for shape in ("single", "deltas", "wrapped"):
+        for size_mb in sizes:
+            data = build_stream(size_mb, shape)
+            mb = len(data) / 1024 / 1024
+            new_time, new_result = measure(run_chat_stream, data)
+
+            if shape == "wrapped" and size_mb > LEGACY_WRAPPED_LIMIT_MB:
+                legacy = "skipped (quadratic)"
+            else:
+                old_time, old_result = measure(run_legacy, data)
+                if old_result != new_result:
+                    print(f"结果不一致: shape={shape} size={size_mb}MB", file=sys.stderr)
+                    return 1
+                legacy = f"{old_time:>9.3f} {mb / old_time:>9.1f}"
+
+            print(f"{shape:<8} {size_mb:>4}MB {'legacy':<8} {legacy}")
+            print(f"{shape:<8} {size_mb:>4}MB {'sse':<8} {new_time:>9.3f} {mb / new_time:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""
+本地模拟上游（hetang.lyvideo.top 的替身），用于不消耗额度的吞吐测试
+- POST /v1/chat/completions 按 image.md / video.md 的 SSE 格式返回：
+  reasoning_content 进度行，图片为 markdown（base64 或链接），视频为 <video src=...>，最后 data: [DONE]
+- 模型名含 veo 的请求按视频返回，其余按图片返回（-2k / -4k 模型多一段放大进度）
+- GET /files/<名称> 提供链接形式的结果文件（支持 Range，可测试分段下载）
+- GET /stats 返回请求数、峰值并发、注入的错误数
+- 可配置：首字节延迟与抖动、进度行数与间隔、结果大小、结果形式、错误注入比例与类型
+  错误类型: 429（带 Retry-After）/ 500 / 503 / auth（401）/ stream（流内 ❌ 生成失败）/ drop（流中途断开）
+
+运行: python -m bench.mock_upstream [--port 8800] [--latency 0.5] [--steps 4] [--interval 0.2]
+      [--image-kb 512] [--result base64|url] [--video-kb 4096] [--error-rate 0.1] [--errors 429,503,stream]
+应用中把设置 api_base 改为 http://127.0.0.1:8800 即可接入
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import base64
+import argparse
+import threading
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+ERROR_KINDS = ("429", "500", "503", "auth", "stream", "drop")
+
+
+class MockConfig:
+    """模拟上游的行为参数"""
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.0,
+        steps: int = 4,
+        interval: float = 0.2,
+        image_kb: int = 512,
+        result: str = "base64",
+        video_kb: int = 4096,
+        error_rate: float = 0.0,
+        errors: tuple[str, ...] = ("503",),
+        api_key: str = "",
+        seed: int | None = None,
+    ):
+        self.latency = latency  # 首字节延迟（秒）
+        self.jitter = jitter  # 延迟、进度间隔的随机波动比例（0-1）
+        self.steps = steps  # 进度行数（不含固定的开始 / 结束行）
+        self.interval = interval  # 进度行间隔（秒）
+        self.image_kb = image_kb  # 图片结果大小（KB，base64 编码前）
+        self.result = result  # 图片结果形式：base64 / url
+        self.video_kb = video_kb  # 视频文件大小（KB）
+        self.error_rate = error_rate  # 注入错误的请求比例（0-1）
+        self.errors = errors  # 注入的错误类型，随机选择
+        self.api_key = api_key  # 非空时校验 Authorization
+        self.random = random.Random(seed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 与真实上游一样使用长连接 + chunked
+    server: "MockUpstream"
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/v1/chat/completions":
+            self._send_plain(HTTPStatus.NOT_FOUND, b"not found")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            self._send_plain(HTTPStatus.BAD_REQUEST, b"invalid json")
+            return
+        config = self.server.config
+        if config.api_key and self.headers.get("Authorization") != f"Bearer {config.api_key}":
+            self._send_plain(HTTPStatus.UNAUTHORIZED, b'{"error": "invalid api key"}')
+            return
+
+        self.server.enter()
+        try:
+            self._chat(str(body.get("model", "")), config)
+        except OSError:
+            pass  # 客户端取消或断开
+        finally:
+            self.server.leave()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/stats":
+            self._send_plain(HTTPStatus.OK, json.dumps(self.server.stats()).encode(), "application/json")
+        elif path.startswith("/files/"):
+            self._send_file(path[len("/files/"):])
+        else:
+            self._send_plain(HTTPStatus.NOT_FOUND, b"not found")
+
+    # ===================== 生成 =====================
+
+    def _chat(self, model: str, config: MockConfig):
+        is_video = "veo" in model
+        error = config.random.choice(config.errors) if config.random.random() < config.error_rate else ""
+        self._sleep(config.latency)
+
+        if error in ("429", "500", "503", "auth"):
+            self.server.count_error(error)
+            status = {"429": 429, "500": 500, "503": 503, "auth": 401}[error]
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            self._send_plain(status, b'{"error": "mock upstream error"}', headers=headers)
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        chat_id = f"chatcmpl-{int(time.time())}"
+        kind = "视频" if is_video else "图片"
+        self._event(chat_id, {"role": "assistant", "reasoning_content": f"✨ {kind}生成任务已启动\n"})
+        self._event(chat_id, {"reasoning_content": "初始化生成环境...\n"})
+        fail_at = config.random.randrange(config.steps + 1) if error in ("stream", "drop") else -1
+        for step in range(config.steps):
+            if step == fail_at:
+                break
+            self._sleep(config.interval)
+            if is_video:
+                text = f"生成进度: {round(100 * step / config.steps)}%\n"
+            else:
+                text = "正在生成图片...\n" if step == 0 else f"生成中 {step}/{config.steps}...\n"
+            self._event(chat_id, {"reasoning_content": text})
+
+        if error == "drop":
+            # 不发送结束块直接断开，模拟上游中途断流
+            self.server.count_error(error)
+            self.close_connection = True
+            return
+        if error == "stream":
+            self.server.count_error(error)
+            self._event(chat_id, {"reasoning_content": "❌ 生成失败: mock upstream error\n"})
+            self._event(chat_id, {"content": "生成失败"}, finish="stop")
+        elif is_video:
+            self._event(chat_id, {"reasoning_content": "缓存已关闭,正在返回源链接...\n"})
+            src = f"{self._base_url()}/files/{os.urandom(8).hex()}.mp4"
+            self._event(chat_id, {"content": f"<video src='{src}' controls style='max-width:100%'></video>"}, finish="stop")
+        else:
+            for size in ("2k", "4k"):
+                if model.endswith(f"-{size}"):
+                    self._event(chat_id, {"reasoning_content": f"正在放大图片到 {size.upper()}...\n"})
+                    self._event(chat_id, {"reasoning_content": f"✅ 图片已放大到 {size.upper()}\n"})
+            if config.result == "url":
+                self._event(chat_id, {"reasoning_content": "缓存已关闭,正在返回源链接...\n"})
+                src = f"{self._base_url()}/files/{os.urandom(8).hex()}.jpg"
+            else:
+                src = f"data:image/jpeg;base64,{self.server.image_base64()}"
+            self._event(chat_id, {"content": f"![Generated Image]({src})"}, finish="stop")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+        if not error:
+            self.server.count_done()
+
+    def _event(self, chat_id: str, delta: dict, finish: str | None = None):
+        payload = {
+            "id": chat_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "flow2api",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _sleep(self, seconds: float):
+        config = self.server.config
+        if config.jitter:
+            seconds *= 1 + config.random.uniform(-config.jitter, config.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # ===================== 文件 =====================
+
+    def _send_file(self, name: str):
+        data = self.server.video_bytes() if name.endswith(".mp4") else self.server.image_bytes()
+        content_type = "video/mp4" if name.endswith(".mp4") else "image/jpeg"
+        start, end = 0, len(data) - 1
+        status = HTTPStatus.OK
+        spec = self.headers.get("Range", "")
+        if spec.startswith("bytes="):
+            first, _, last = spec[len("bytes="):].partition("-")
+            start = int(first or 0)
+            end = min(int(last), end) if last else end
+            status = HTTPStatus.PARTIAL_CONTENT
+        headers = {"Accept-Ranges": "bytes", "ETag": '"mock"'}
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        try:
+            self._send_plain(status, data[start:end + 1], content_type, headers)
+        except OSError:
+            pass
+
+    def _send_plain(self, status: int, body: bytes, content_type: str = "application/json", headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockUpstream(ThreadingHTTPServer):
+    """模拟上游服务（每个连接一个线程）"""
+
+    daemon_threads = True
+    request_queue_size = 256  # 大量并发连接同时建立时不被拒绝
+
+    def __init__(self, config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config
+        self._lock = threading.Lock()
+        self._image: bytes | None = None
+        self._image_b64 = ""
+        self._video: bytes | None = None
+        self._requests = 0
+        self._active = 0
+        self._peak = 0
+        self._done = 0
+        self._errors: dict[str, int] = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockUpstream":
+        threading.Thread(target=self.serve_forever, name="mock-upstream", daemon=True).start()
+        return self
+
+    def image_bytes(self) -> bytes:
+        with self._lock:
+            if self._image is None:
+                self._image = _fake_file(b"\xff\xd8\xff\xe0", b"\xff\xd9", self.config.image_kb * 1024)
+                self._image_b64 = base64.b64encode(self._image).decode("ascii")
+            return self._image
+
+    def image_base64(self) -> str:
+        self.image_bytes()
+        return self._image_b64
+
+    def video_bytes(self) -> bytes:
+        with self._lock:
+            if self._video is None:
+                self._video = _fake_file(b"\x00\x00\x00\x18ftypmp42", b"", self.config.video_kb * 1024)
+            return self._video
+
+    def enter(self):
+        with self._lock:
+            self._requests += 1
+            self._active += 1
+            self._peak = max(self._peak, self._active)
+
+    def leave(self):
+        with self._lock:
+            self._active -= 1
+
+    def count_done(self):
+        with self._lock:
+            self._done += 1
+
+    def count_error(self, kind: str):
+        with self._lock:
+            self._errors[kind] = self._errors.get(kind, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "active": self._active,
+                "peak": self._peak,
+                "done": self._done,
+                "errors": dict(self._errors),
+            }
+
+
+def _fake_file(head: bytes, tail: bytes, size: int) -> bytes:
+    """指定大小的占位文件（带文件头，内容为随机字节，不可压缩）"""
+    return head + os.urandom(max(0, size - len(head) - len(tail))) + tail
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """模拟上游参数（bench_e2e 共用）"""
+    parser.add_argument("--latency", type=float, default=0.5, help="首字节延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟与进度间隔的随机波动比例（0-1）")
+    parser.add_argument("--steps", type=int, default=4, help="进度行数")
+    parser.add_argument("--interval", type=float, default=0.2, help="进度行间隔（秒）")
+    parser.add_argument("--image-kb", type=int, default=512, help="图片结果大小（KB）")
+    parser.add_argument("--result", choices=("base64", "url"), default="base64", help="图片结果形式")
+    parser.add_argument("--video-kb", type=int, default=4096, help="视频文件大小（KB）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的请求比例（0-1）")
+    parser.add_argument("--errors", default="503", help=f"注入的错误类型，逗号分隔：{' / '.join(ERROR_KINDS)}")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（错误注入、抖动可复现）")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    errors = tuple(e.strip() for e in args.errors.split(",") if e.strip())
+    unknown = [e for e in errors if e not in ERROR_KINDS]
+    if unknown or not errors:
+        raise ValueError(f"未知错误类型: {', '.join(unknown) or '(空)'}")
+    return MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        steps=args.steps,
+        interval=args.interval,
+        image_kb=args.image_kb,
+        result=args.result,
+        video_kb=args.video_kb,
+        error_rate=args.error_rate,
+        errors=errors,
+        api_key=getattr(args, "api_key", ""),
+        seed=args.seed,
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="本地模拟上游（SSE 格式同 image.md / video.md）")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8800, help="监听端口，0 为随机")
+    parser.add_argument("--api-key", default="", help="校验的 API Key，留空为不校验")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        config = config_from_args(args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    server = MockUpstream(config, args.host, args.port)
+    # 第一行输出地址，供 bench_e2e 以子进程方式启动时读取
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
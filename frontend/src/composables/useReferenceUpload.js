@@ -0,0 +1,40 @@
+// 参考图分块上传：后端按内容哈希去重存储，任务只携带返回的句柄
+
+const CHUNK_SIZE = 768 * 1024 // 3 的倍数，各块单独 base64 编码后拼接不会出错
+
+function toBase64(bytes) {
+  let binary = ''
+  for (let i = 0; i < bytes.length; i += 0x8000) {
+    binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000))
+  }
+  return btoa(binary)
+}
+
+async function sha256Hex(buffer) {
+  // 非安全上下文没有 crypto.subtle，此时直接上传（后端同样会去重）
+  if (!window.crypto?.subtle) return ''
+  const digest = await window.crypto.subtle.digest('SHA-256', buffer)
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('')
+}
+
+// 上传参考图文件，返回句柄；后端已有相同内容时跳过上传
+export async function uploadReference(file) {
+  const buffer = await file.arrayBuffer()
+  const hash = await sha256Hex(buffer)
+  if (hash && await window.pywebview.api.has_reference_image(hash)) return hash
+
+  const bytes = new Uint8Array(buffer)
+  let uploadId = ''
+  for (let offset = 0; ; offset += CHUNK_SIZE) {
+    const final = offset + CHUNK_SIZE >= bytes.length
+    const result = await window.pywebview.api.upload_reference_image(
+      toBase64(bytes.subarray(offset, offset + CHUNK_SIZE)), uploadId, final
+    )
+    if (final) {
+      if (!result?.handle) throw new Error('参考图上传失败')
+      return result.handle
+    }
+    if (!result?.upload_id) throw new Error('参考图上传失败')
+    uploadId = result.upload_id
+  }
+}
@@ -0,0 +1,50 @@
+import { ref } from 'vue'
+
+const PAGE_SIZE = 200
+
+const API = {
+  image: { list: 'list_tasks', changed: 'get_tasks_changed_since' },
+  video: { list: 'list_video_tasks', changed: 'get_video_tasks_changed_since' },
+}
+
+// 任务列表在模块级缓存，切换页面后重新进入只拉取期间的变更
+const lists = {}
+
+export function useTaskList(kind) {
+  if (!lists[kind]) lists[kind] = { tasks: ref([]), version: 0, loaded: false }
+  const state = lists[kind]
+  const api = API[kind]
+
+  async function loadAll() {
+    const all = []
+    let after = ''
+    let version = 0
+    do {
+      const page = await window.pywebview.api[api.list](PAGE_SIZE, after, '')
+      if (!after) version = page.version
+      all.push(...page.tasks)
+      after = page.next
+    } while (after)
+    state.tasks.value = all
+    state.version = version
+    state.loaded = true
+  }
+
+  async function sync() {
+    if (!state.loaded) return loadAll()
+    const delta = await window.pywebview.api[api.changed](state.version)
+    if (delta.reset) return loadAll()
+
+    const deleted = new Set(delta.deleted)
+    if (deleted.size) state.tasks.value = state.tasks.value.filter(t => !deleted.has(t.id))
+    const byId = new Map(state.tasks.value.map(t => [t.id, t]))
+    for (const task of delta.tasks) {
+      const existing = byId.get(task.id)
+      if (existing) Object.assign(existing, task)
+      else state.tasks.value.unshift(task)
+    }
+    state.version = delta.version
+  }
+
+  return { tasks: state.tasks, sync }
+}
@@ -0,0 +1,92 @@
+"""
+AsyncResponse.drain 回归测试
+- 读到 SSE 的 [DONE] 后提前停止，drain() 应从停止处继续读完 body，连接归还连接池且不残留 body 字节
+- chunked 与 Content-Length 两种分帧都要覆盖
+
+运行: python -m pytest tests
+"""
+
+import asyncio
+import json
+import time
+
+from backend.http_client import AsyncResponse, _HostPool
+from backend.sse import ChatStream
+
+
+NEXT_RESPONSE = b"HTTP/1.1 200 OK\r\n"
+
+
+class _FakeWriter:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+
+def _sse_body() -> bytes:
+    delta = {"choices": [{"delta": {"reasoning_content": "思考中", "content": "ok"}}]}
+    return f"data: {json.dumps(delta)}\n\ndata: [DONE]\n\n".encode()
+
+
+def _chunked(*parts: bytes) -> bytes:
+    body = b"".join(b"%x\r\n%s\r\n" % (len(p), p) for p in parts)
+    return body + b"0\r\n\r\n"
+
+
+async def _read_then_drain(headers: dict[str, str], raw: bytes):
+    """模拟任务管理器的 _read_stream：读到 [DONE] 即停止，然后 drain + close"""
+    reader = asyncio.StreamReader()
+    reader.feed_data(raw + NEXT_RESPONSE)  # 不 feed_eof：连接保持打开，读多了会一直等到超时
+    writer = _FakeWriter()
+    pool = _HostPool("example.com", 1)
+    await pool.limiter.acquire()
+    response = AsyncResponse(
+        "http://example.com/", 200, "OK", headers, reader, writer, read_timeout=5, pool=pool, keep_alive=True
+    )
+
+    stream = ChatStream()
+    async for chunk in response.iter_chunks():
+        stream.feed(chunk)
+        if stream.done:
+            break
+    assert stream.done
+    assert stream.content.getvalue() == "ok"
+
+    started = time.monotonic()
+    await response.drain()
+    elapsed = time.monotonic() - started
+    response.close()
+    return reader, writer, pool, elapsed
+
+
+def _check(reader: asyncio.StreamReader, writer: _FakeWriter, pool: _HostPool, elapsed: float):
+    assert elapsed < 1
+    assert not writer.closed
+    assert len(pool.idle) == 1
+    assert pool.limiter.active == 0
+    # 下一个请求从响应行开始读，没有残留的 body 字节
+    assert bytes(reader._buffer) == NEXT_RESPONSE
+
+
+def test_drain_resumes_chunked_body():
+    body = _sse_body()
+    raw = _chunked(body, b": bye\r\n\r\n\r\n")
+
+    async def main():
+        return await _read_then_drain({"transfer-encoding": "chunked"}, raw)
+
+    _check(*asyncio.run(main()))
+
+
+def test_drain_resumes_content_length_body():
+    body = _sse_body() + b": bye\n\n" * 100
+
+    async def main():
+        return await _read_then_drain({"content-length": str(len(body))}, body)
+
+    _check(*asyncio.run(main()))